@@ -0,0 +1,46 @@
+""" KALMAN FILTER BENCHMARK """
+import argparse
+import timeit
+import numpy as np
+from bot import kalman as kal
+
+__author__ = 'Olve Drageset'
+
+
+def time_step(function, number):
+    """
+        Returns the best time (us) of a single call
+    """
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def benchmark(n_robots, number):
+    """
+        Time a filter step of n_robots robots with the kalman_filter function (one call per robot) and with a
+        batched KalmanFilter
+    """
+    rng = np.random.default_rng(0)
+    mu = rng.uniform(0, 360, (n_robots, 3))
+    sigma = np.zeros((n_robots, 3, 3))
+    u = rng.normal(0, 3, (n_robots, 3))
+    z = rng.uniform(0, 360, (n_robots, 3))
+    kalman = kal.KalmanFilter(mu, sigma)
+
+    def function_steps():
+        for i in range(n_robots):
+            kal.kalman_filter(mu[i], sigma[i], u[i], z[i])
+
+    return (n_robots,
+            time_step(function_steps, max(number // n_robots, 1)),
+            time_step(lambda: kalman.step(u, z), number))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--number", help='number of calls per measurement', action='store', type=int, default=1000)
+    args = parser.parse_args()
+
+    print("times in us per step of all robots")
+    print("{0:>6} {1:>12} {2:>12}".format('robots', 'function', 'filter'))
+    for n_robots in [1, 10, 100, 1000]:
+        print("{0:>6} {1:>12.1f} {2:>12.1f}".format(*benchmark(n_robots, args.number)))
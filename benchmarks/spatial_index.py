@@ -0,0 +1,83 @@
+""" SPATIAL INDEX BENCHMARK """
+import argparse
+import timeit
+import numpy as np
+from bot import environment as env
+from bot import robot as bot
+from bot import spatial as spatial
+from bot import trigonometry as tri
+
+__author__ = 'Steffen Schneider'
+
+ROOM_SIZE = 200
+DOOR_SIZE = 60
+
+
+def office_walls(rooms_x, rooms_y, room_size=ROOM_SIZE, door_size=DOOR_SIZE):
+    """
+        Returns the walls of an office floor with rooms_x * rooms_y rooms as an (n_walls, 4) array
+        Every wall between two rooms has a door in the middle (it is split into two walls), the outer walls are closed
+    """
+    walls = []
+    width = rooms_x * room_size
+    height = rooms_y * room_size
+    walls += [(0, 0, width, 0), (0, height, width, height), (0, 0, 0, height), (width, 0, width, height)]
+    side = (room_size - door_size) / 2
+    for i in range(rooms_x):
+        for j in range(rooms_y):
+            x = i * room_size
+            y = j * room_size
+            if i > 0:
+                walls += [(x, y, x, y + side), (x, y + room_size - side, x, y + room_size)]
+            if j > 0:
+                walls += [(x, y, x + side, y), (x + room_size - side, y, x + room_size, y)]
+    return np.array(walls, dtype=float)
+
+
+def time_query(function, repeat):
+    """
+        Returns the best time (us) of a single call
+    """
+    number = max(repeat, 1)
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def benchmark(rooms, repeat, n_robots):
+    """
+        Time a sensor update and a beacon line-of-sight query in the middle of an office floor
+        rooms = 0 uses the walls of the default Environment
+    """
+    walls = office_walls(rooms, rooms) if rooms > 0 else env.Environment().wall_segments
+    size = walls[:, 2:].max()
+    index = spatial.WallGrid(walls)
+
+    robot = bot.Robot()
+    robot.set_robot_position(size / 2 + ROOM_SIZE / 2, size / 2 + ROOM_SIZE / 2, 0)
+    origin = (robot.posx, robot.posy)
+    angles = robot.sensor_angles
+    beacons = np.random.default_rng(0).uniform(0, size, (8, 2))
+
+    # Population of robots (BatchEnvironment)
+    positions = np.random.default_rng(1).uniform(0, size, (n_robots, 2))
+    batch_angles = np.broadcast_to(angles, (n_robots, len(angles)))
+
+    return (len(walls),
+            time_query(lambda: tri.cast_rays(origin, angles, robot.sensor_max, walls), repeat),
+            time_query(lambda: index.cast_rays(origin, angles, robot.sensor_max), repeat),
+            time_query(lambda: index.line_of_sight(origin, beacons), repeat),
+            time_query(lambda: tri.cast_rays(positions, batch_angles, robot.sensor_max, walls), max(repeat // 10, 1)),
+            time_query(lambda: index.cast_rays(positions, batch_angles, robot.sensor_max), max(repeat // 10, 1)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--repeat", help='number of calls per measurement', action='store', type=int, default=100)
+    parser.add_argument("-n", "--robots", help='number of robots in the batch query', action='store', type=int, default=30)
+    args = parser.parse_args()
+
+    print("times in us per call; 12 sensors per robot, batch of {0} robots".format(args.robots))
+    print("{0:>6} {1:>12} {2:>12} {3:>12} {4:>12} {5:>12}".format(
+        'walls', 'all walls', 'index', 'beacons', 'batch all', 'batch index'))
+    for rooms in [0, 3, 6, 12, 24, 35]:
+        print("{0:>6} {1:>12.0f} {2:>12.0f} {3:>12.0f} {4:>12.0f} {5:>12.0f}".format(
+            *benchmark(rooms, args.repeat, args.robots)))
@@ -0,0 +1,65 @@
+""" WORKER STARTUP BENCHMARK """
+import argparse
+import concurrent.futures
+import multiprocessing
+import resource
+import subprocess
+import sys
+import time
+
+__author__ = 'Steffen Schneider'
+
+GRAPHICS_MODULES = ['pygame', 'matplotlib']
+
+# Python snippets that are timed in a fresh interpreter
+HEADLESS_WORKER = 'import main; main.get_environment()'
+GRAPHICS_IMPORTS = 'import pygame; pygame.font.init(); pygame.font.SysFont("arial", 20); import matplotlib.pyplot'
+
+
+def worker_status():
+    """
+        Runs inside a freshly spawned evaluation worker
+        Returns the loaded graphics modules and the peak memory usage (kB) after creating the worker's environment
+    """
+    import main
+    main.get_environment()
+    loaded = [module for module in GRAPHICS_MODULES if module in sys.modules]
+    return loaded, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def time_interpreter(code, repeat):
+    """
+        Returns the best wall-clock time (s) of running the code in a fresh python interpreter
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', code], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def time_spawned_worker():
+    """
+        Returns the time (s) until a spawned process pool worker has a warm environment, and its status
+    """
+    context = multiprocessing.get_context('spawn')
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        status = executor.submit(worker_status).result()
+    return time.perf_counter() - start, status
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--repeat", help='number of runs per measurement', action='store', type=int, default=5)
+    args = parser.parse_args()
+
+    print("headless worker startup:      {0:.3f} s".format(time_interpreter(HEADLESS_WORKER, args.repeat)))
+    print("graphics imports (avoided):   {0:.3f} s".format(time_interpreter(GRAPHICS_IMPORTS, args.repeat)))
+
+    elapsed, (loaded, max_rss) = time_spawned_worker()
+    print("spawned evaluation worker:    {0:.3f} s, {1} kB peak rss".format(elapsed, max_rss))
+    print("graphics modules in worker:   " + (', '.join(loaded) if loaded else 'none'))
+    if loaded:
+        sys.exit(1)
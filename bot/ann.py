@@ -15,73 +15,101 @@ def flatten_weights(list_of_mats):
     return flat_list
 
 
+def layer_shapes(nr_of_input_nodes, hidden_layers, hidden_layer_nodes, nr_of_outputs):
+    """
+        Shapes (rows, columns) of the weight matrices of each layer, in the order they are stored in the flat weights
+    """
+    if hidden_layers == 0:
+        # First layer is output layer
+        return [(nr_of_input_nodes, nr_of_outputs)]
+    shapes = [(nr_of_input_nodes, hidden_layer_nodes)]
+    # Matrices between hidden layers
+    for i in range(1, hidden_layers):
+        shapes.append((hidden_layer_nodes, hidden_layer_nodes))
+    # Matrix from last hidden layer to output layer
+    shapes.append((hidden_layer_nodes, nr_of_outputs))
+    return shapes
+
+
+def layers_as_views(weights, shapes):
+    """
+        Split flat weights (..., n_weights) into layer matrices (..., rows, columns)
+        The matrices are reshaped views on the weights array, no values are copied
+    """
+    layers = []
+    start = 0
+    for rows, columns in shapes:
+        layers.append(weights[..., start:start + rows * columns].reshape(weights.shape[:-1] + (rows, columns)))
+        start += rows * columns
+    return layers
+
+
 class NeuralNet:
     def __init__(self, weights, nr_of_input_nodes=13, hidden_layers=1,
                  hidden_layer_nodes=6, nr_of_outputs=2, recurrence=True):
         """
             Initialize the neural net
+            weights is one flat list of weights, or an array (n_nets, n_weights) with the weights of a whole
+            population of equally shaped nets that can be evaluated at once with forward_batch
         """
         self.nr_of_input_nodes = nr_of_input_nodes
         self.hidden_layers = hidden_layers
         self.hidden_layer_nodes = hidden_layer_nodes
         self.nr_of_output_nodes = nr_of_outputs
-        self.weights = weights  # One array of numbers, that contain the weights ordered
+        self.weights = np.asarray(weights, dtype=float)  # One array of numbers (per net), that contain the weights ordered
         self.recurrence = recurrence
+        self.nr_of_external_inputs = nr_of_input_nodes
         if recurrence:
-            self.prev_out = []
             self.nr_of_input_nodes += nr_of_outputs
-            for i in range(0, nr_of_outputs):
-                self.prev_out.append(0)
+
+        # Layer matrices are built once, as views on the flat weights
+        shapes = layer_shapes(self.nr_of_input_nodes, hidden_layers, hidden_layer_nodes, nr_of_outputs)
+        self.layers = layers_as_views(self.weights, shapes)
+
+        # Preallocated buffers: the input layer (external inputs followed by the recurrent inputs) and the
+        # activations of every layer. The last activation is the output of the net.
+        batch_shape = self.weights.shape[:-1]
+        self.inputs = np.zeros(batch_shape + (self.nr_of_input_nodes,))
+        self.activations = [np.zeros(batch_shape + (columns,)) for rows, columns in shapes]
+        self.prev_out = self.activations[-1]  # Outputs of the previous round, 0 before the first round
 
     def weights_as_mat(self):
         """
-            Build matrices for neural net from the flat weights list
+            Matrices for neural net from the flat weights list
         """
-        weights = []
-        split_count = self.nr_of_output_nodes
-        # Initialize matrix from input layer to first layer
-        if self.hidden_layers > 0:
-            w1 = np.empty([self.nr_of_input_nodes, self.hidden_layer_nodes])
-            split_count = self.hidden_layer_nodes
-        else:  # If first layer is output layer
-            w1 = np.empty([self.nr_of_input_nodes, self.nr_of_output_nodes])
-        start = 0
-        for index, vector in enumerate(w1):
-            w1[index] = self.weights[start:start + split_count]
-            start += split_count
-        weights.append(w1)
-
-        if self.hidden_layers > 0:
-            # Matrices between hidden layers
-            for i in range(1, self.hidden_layers):
-                wi = np.empty([self.hidden_layer_nodes, self.hidden_layer_nodes])
-                for index, vector in enumerate(wi):
-                    wi[index] = self.weights[start:start + self.hidden_layer_nodes]
-                    start += self.hidden_layer_nodes
-                weights.append(wi)
-
-            # Matrix from last hidden layer to output layer
-            wn = np.empty([self.hidden_layer_nodes, self.nr_of_output_nodes])
-            for index, vector in enumerate(wn):
-                wn[index] = self.weights[start:start + self.nr_of_output_nodes]
-                start += self.nr_of_output_nodes
-            weights.append(wn)
-        return weights
+        return self.layers
 
-    def forward_prop(self, _inputs):
+    def set_inputs(self, _inputs):
         """
-            Append last rounds outputs as input values if recurrence is enabled
+            Copy the inputs into the input layer and append last rounds outputs if recurrence is enabled
         """
-
-        inputs = list(_inputs)
+        self.inputs[..., :self.nr_of_external_inputs] = _inputs
         if self.recurrence:
-            for out in self.prev_out:
-                inputs.append(out)
-        output = inputs  # The inputs will be transformed to output through several matmuls
+            self.inputs[..., self.nr_of_external_inputs:] = self.prev_out
+
+    def forward_prop(self, _inputs):
+        """
+            Propagate the inputs through the layers
+            The returned output array is reused (overwritten) by the next call
+        """
+        self.set_inputs(_inputs)
+        output = self.inputs  # The inputs will be transformed to output through several matmuls
         # This is where we propagate through the layers
-        for weights in self.weights_as_mat():
-            output = np.tanh(np.matmul(output, weights))
-        self.prev_out = output  # Store for future recurrence use
+        for weights, activation in zip(self.layers, self.activations):
+            np.matmul(output, weights, out=activation)
+            output = np.tanh(activation, out=activation)
+        return output
+
+    def forward_batch(self, _inputs):
+        """
+            Propagate the stacked inputs (n_nets, n_inputs) of all nets through their layers at once
+            Returns the outputs (n_nets, n_outputs), the array is reused (overwritten) by the next call
+        """
+        self.set_inputs(_inputs)
+        output = self.inputs
+        for weights, activation in zip(self.layers, self.activations):
+            np.einsum('...i,...io->...o', output, weights, out=activation)
+            output = np.tanh(activation, out=activation)
         return output
 
     def get_velocities(self, inputs):
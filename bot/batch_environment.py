@@ -0,0 +1,253 @@
+""" BATCH ENVIRONMENT MODULE """
+import numpy as np
+from bot import robot as bot
+from bot import ann as ann
+from bot import kinematics as kin
+from bot import dirt as dirt
+from bot import spatial as spatial
+from bot import fitness as fit
+
+__author__ = 'Camiel Kerkhofs, Steffen Schneider'
+
+
+class BatchEnvironment:
+    """
+        Simulates a whole population of robots in lockstep (no graphics, static delta_t only)
+
+        The state of all N robots is kept as struct-of-arrays: every attribute holds one entry per robot.
+        Each tick advances all robots at once with vectorized kinematics, ray casting and neural net forward passes.
+        The fitness values are the same as the ones Environment.fitness() returns for each robot simulated on its own.
+        Localization (beacons, odometry and kalman filter) does not influence the fitness and is not simulated.
+    """
+
+    def __init__(self, walls, n_sensors=12, grid_size=dirt.DEFAULT_GRID_SIZE, size=(1024, 768), field=None,
+                 continuous_collision=False):
+        self.walls = spatial.as_index(walls)
+        self.field = field  # Optional spatial.DistanceField that resolves wall contacts (see Robot.update_sensors)
+        # Robot constants (radius, sensor range, start pose, continuous collision detection)
+        self.template = bot.Robot(n_sensors=n_sensors, continuous_collision=continuous_collision)
+        self.n_sensors = n_sensors
+        self.grid_size = grid_size
+        self.size = self.width, self.height = size
+
+        self.reset(0)
+
+    @classmethod
+    def from_environment(cls, environment):
+        """
+            Create a batch environment with the same sensor walls, sensors and dust grid as the given Environment
+            (batches use fixed steps, event driven environments can not be batched)
+        """
+        if environment.event_driven:
+            raise ValueError('A batch environment can not simulate an event driven environment')
+        return cls(environment.sensor_walls, n_sensors=environment.robot.n_sensors,
+                   grid_size=environment.grid_size, size=environment.size, field=environment.contact_field,
+                   continuous_collision=environment.robot.continuous_collision)
+
+    def reset(self, n_robots, start_x=None, start_y=None, start_angle=None):
+        """
+            Reset the state of all robots before a new simulation starts
+        """
+        robot = self.template
+        self.n_robots = n_robots
+        self.posx = np.full(n_robots, robot.initial_posx if start_x is None else start_x, dtype=float)
+        self.posy = np.full(n_robots, robot.initial_posy if start_y is None else start_y, dtype=float)
+        self.angle = np.full(n_robots, robot.initial_angle if start_angle is None else start_angle, dtype=float)
+        self.start = np.stack([self.posx, self.posy, self.angle], axis=1)  # Start poses for the fitness records
+        self.vel_left = np.zeros(n_robots)
+        self.vel_right = np.zeros(n_robots)
+        self.sensors = np.zeros((n_robots, self.n_sensors, 4))
+        self.num_collisions = np.zeros(n_robots, dtype=int)
+
+        # Dust grid per robot (same footprint as Environment)
+        if getattr(self, 'dirt', None) is not None and len(self.dirt.grid) == n_robots:
+            self.dirt.reset()
+        else:
+            self.dirt = dirt.DirtGrid(self.grid_size, self.size, self.template.radius, n_grids=n_robots)
+        self.dirt_sensor = np.zeros(n_robots)
+        self.cleaned = np.zeros(n_robots)
+
+        # Fitness accumulators
+        self.genes = [b''] * n_robots  # Digests of the genes (see fitness.gene_digest)
+        self.delta_t = 0
+        self.updates = 0
+        self.activation_sum = np.zeros(n_robots)
+        self.wheel_fitness = np.zeros(n_robots)  # Sum of the per update evaluations of fitness 4 and 5
+
+    def simulate(self, genes, simulation_time, static_delta_t=200, recurrence=False, start_x=0, start_y=0,
+                 start_angle=0, fitness_id=1):
+        """
+            Simulate one robot per gene for simulation_time seconds
+            The parameters match Environment.simulate with graphics disabled and time_dilation 0
+
+            Returns an array with the fitness evaluation of each robot
+        """
+        genes = np.asarray(genes, dtype=float)
+        if static_delta_t > bot.MAX_DELTA_T and not self.template.continuous_collision:
+            raise ValueError('delta_t exceeds the limit of ' + str(bot.MAX_DELTA_T) + 'ms, '
+                             'continuous_collision=True lifts it. Requested delta_t: ' + str(static_delta_t))
+        if start_x != 0 and start_y != 0:
+            self.reset(len(genes), start_x, start_y, start_angle)
+        else:
+            self.reset(len(genes))
+        self.genes = [fit.gene_digest(gene) for gene in genes]
+        self.delta_t = static_delta_t
+
+        # One stacked neural net evaluates all genes at once
+        net = ann.NeuralNet(genes, nr_of_input_nodes=self.n_sensors + 1, recurrence=recurrence)
+        inputs = np.zeros((len(genes), self.n_sensors + 1))
+
+        self.update_sensors()
+        while True:
+            # Get a new move from the neural nets
+            inputs[:, :-1] = self.sensors[:, :, 1]
+            inputs[:, -1] = self.dirt_sensor
+            output = net.forward_batch(inputs)
+            self.vel_left[:] = output[:, 0]
+            self.vel_right[:] = output[:, 1]
+
+            self.on_loop(static_delta_t)
+
+            if int(static_delta_t * self.updates) > simulation_time * 1000:
+                break
+
+        return self.fitness(fitness_id)
+
+    def on_loop(self, delta_t):
+        """
+            Advance all robots by one update of delta_t milliseconds
+        """
+        robot = self.template
+        self.updates += 1
+
+        # Update robot positions (wheel velocities are switched like in Robot.move_robot)
+        left_velocity = np.round(self.vel_right, 5)
+        right_velocity = np.round(self.vel_left, 5)
+        if robot.continuous_collision:
+            # Sweep the robots along the arcs of their moves (see Robot.sweep)
+            fractions = np.linspace(0, 1, bot.SWEEP_CHORDS + 1)[:, None]
+            xs, ys, angles = kin.bot_calc_coordinates(self.posx, self.posy, self.angle, left_velocity,
+                                                      right_velocity, delta_t / 10 * fractions, robot.radius * 2)
+            positions, touched = spatial.sweep_circles(self.walls, np.stack((xs, ys), axis=-1), robot.radius,
+                                                       bot.COLLISION_TOLERANCE)
+            self.posx, self.posy, self.angle = positions[:, 0], positions[:, 1], angles[-1]
+            self.num_collisions += touched
+        else:
+            self.posx, self.posy, self.angle = kin.bot_calc_coordinates(
+                self.posx, self.posy, self.angle, left_velocity, right_velocity, delta_t / 10, robot.radius * 2)
+
+        # Update robot sensors
+        closest_activation = self.update_sensors()
+        norm = closest_activation / robot.max_activation
+        self.activation_sum += norm
+
+        # Evaluation of fitness 4 and 5 for this update
+        v = (np.abs(self.vel_left) + np.abs(self.vel_right)) / 2
+        delta_v = np.abs(self.vel_left - self.vel_right)
+        self.wheel_fitness += (v * (1 - np.sqrt(delta_v))) * (1 - norm)
+
+        # Update dirt
+        self.update_dirt(5 * norm)
+
+    def update_sensors(self):
+        """
+            Update the sensors of all robots and resolve wall collisions (see Robot.update_sensors)
+            Returns the closest transformed sensor value of each robot
+        """
+        robot = self.template
+        indices = np.arange(self.n_sensors)
+        closest_transformed = np.zeros(self.n_robots)
+        first_collision = np.full(self.n_robots, -1)
+
+        if self.field is not None:
+            # Contacts are resolved with the field only, the sensors are cast once (see Robot.update_sensors)
+            positions, touched = self.field.contacts(np.stack((self.posx, self.posy), axis=1), robot.radius,
+                                                     bot.COLLISION_TOLERANCE)
+            self.posx[:] = positions[:, 0]
+            self.posy[:] = positions[:, 1]
+            self.num_collisions += touched
+            angles = (self.angle[:, None] + robot.sensor_angles) % 360
+            distances, points = self.walls.cast_rays(positions, angles, robot.sensor_max, bot.COLLISION_TOLERANCE)
+            transformed = (robot.sensor_max - distances) ** robot.dist_transformation_factor
+            self.sensors[:, :, 0] = distances
+            self.sensors[:, :, 1] = transformed
+            self.sensors[:, :, 2:4] = points
+            return transformed.max(axis=1)
+
+        active = np.arange(self.n_robots)
+        for _ in range(bot.MAX_COLLISION_UPDATES):
+            angles = (self.angle[active, None] + robot.sensor_angles) % 360
+            positions = np.stack((self.posx[active], self.posy[active]), axis=1)
+            distances, points = self.walls.cast_rays(positions, angles, robot.sensor_max, bot.COLLISION_TOLERANCE)
+            transformed = (robot.sensor_max - distances) ** robot.dist_transformation_factor
+            self.sensors[active, :, 0] = distances
+            self.sensors[active, :, 1] = transformed
+            self.sensors[active, :, 2:4] = points
+
+            if isinstance(self.walls, spatial.RayTable):
+                # The table only gives the sensor activations, collisions are tested with exact rays near the walls
+                near = self.walls.near_walls(positions, robot.radius - bot.COLLISION_TOLERANCE)
+                distances = np.full_like(distances, np.inf)
+                if near.any():
+                    distances[near], points[near] = self.walls.walls.cast_rays(
+                        positions[near], angles[near], robot.sensor_max, bot.COLLISION_TOLERANCE)
+
+            colliding = distances < robot.radius - bot.COLLISION_TOLERANCE
+            has_collision = colliding.any(axis=1)
+
+            # Robots without a collision are done. Sensors after the first infringing sensor count at this position
+            done = ~has_collision
+            tail = np.where(indices > first_collision[active, None], transformed, 0).max(axis=1)
+            closest_transformed[active[done]] = np.maximum(closest_transformed[active[done]], tail[done])
+
+            active = active[has_collision]
+            if len(active) == 0:
+                break
+            index = colliding[has_collision].argmax(axis=1)
+            transformed = transformed[has_collision]
+            self.num_collisions[active] += 1
+
+            # The closest activation is measured up to the first infringing sensor, before the position is corrected
+            new = first_collision[active] < 0
+            head = np.where(indices <= index[:, None], transformed, 0).max(axis=1)
+            closest_transformed[active[new]] = head[new]
+            first_collision[active[new]] = index[new]
+
+            # The robot is moved back along the angle of the current (infringing) sensor using the illegal distance
+            rows = np.arange(len(active))
+            illegal_distance = (robot.radius - distances[has_collision][rows, index]) + robot.radius
+            rad = np.radians(angles[has_collision][rows, index])
+            self.posx[active] = points[has_collision][rows, index, 0] - illegal_distance * np.cos(rad)
+            self.posy[active] = points[has_collision][rows, index, 1] - illegal_distance * np.sin(rad)
+
+        return closest_transformed
+
+    def update_dirt(self, dirt_value):
+        """
+            Clean the dust grid cells around each robot and update the dirt sensors
+        """
+        self.dirt_sensor = self.dirt.clean_batch(self.posx, self.posy, dirt_value)
+        self.cleaned += self.dirt_sensor
+
+    def fitness_records(self):
+        """
+            Returns the statistics of every robot that the fitness functions are computed from
+            (see Environment.fitness_record)
+        """
+        records = np.zeros(self.n_robots, dtype=fit.RECORD_DTYPE)
+        records['gene'] = self.genes
+        records['start'] = self.start
+        records['delta_t'] = self.delta_t
+        records['cleaned'] = self.cleaned
+        records['num_collisions'] = self.num_collisions
+        records['activation_sum'] = self.activation_sum
+        records['updates'] = self.updates
+        records['wheel_fitness'] = self.wheel_fitness
+        records['n_controls'] = self.updates  # The neural nets decide every update
+        return records
+
+    def fitness(self, fitness_id):
+        """
+            Returns the current fitness evaluation of every robot (see Environment.fitness)
+        """
+        return fit.score(self.fitness_records(), fitness_id)
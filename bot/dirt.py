@@ -0,0 +1,127 @@
+""" DIRT MODULE """
+import math
+import numpy as np
+
+__author__ = 'Camiel Kerkhofs'
+
+DEFAULT_GRID_SIZE = 128
+
+
+def footprint_stencil(radius, tile_width, tile_height):
+    """
+        Returns a boolean disk mask of the grid cells covered by a robot with the given radius
+        The mask is centered on the cell of the robot center; a cell is covered if its center offset lies within
+        the radius
+    """
+    rows = int(math.floor(radius / tile_height))
+    columns = int(math.floor(radius / tile_width))
+    j, i = np.mgrid[-rows:rows + 1, -columns:columns + 1]
+    return (i * tile_width) ** 2 + (j * tile_height) ** 2 <= radius ** 2
+
+
+class DirtGrid:
+    """
+        Dust grid (a grid of numbers representing the places cleaned by the robot) stored as a numpy array
+        cell value 0 means the robot has not been there yet (dirty)
+        cell value > 0 means the robot has been there (clean), the value is the dirt that was cleaned
+
+        The grid covers the whole display (width x height) with grid_size x grid_size cells.
+        With n_grids, the grid array has shape (n_grids, grid_size, grid_size) and holds one grid per robot.
+    """
+
+    def __init__(self, grid_size=DEFAULT_GRID_SIZE, size=(1024, 768), radius=30, n_grids=None):
+        self.grid_size = grid_size
+        self.width, self.height = size
+        self.tile_width = self.width / grid_size
+        self.tile_height = self.height / grid_size
+        shape = (grid_size, grid_size) if n_grids is None else (n_grids, grid_size, grid_size)
+        self.grid = np.zeros(shape)
+        self.cells = grid_size * grid_size
+        self.clean_cells = 0  # Number of cleaned cells (single grid only)
+
+        # Precomputed footprint of the robot
+        self.stencil = footprint_stencil(radius, self.tile_width, self.tile_height)
+        self.stencil_rows = self.stencil.shape[0] // 2
+        self.stencil_columns = self.stencil.shape[1] // 2
+        self.stencil_cells = np.count_nonzero(self.stencil)
+        offsets = np.nonzero(self.stencil)
+        self.offset_rows = offsets[0] - self.stencil_rows
+        self.offset_columns = offsets[1] - self.stencil_columns
+
+        # Dirt per cell relative to a cell of the default grid, so the amount of dirt in the environment does not
+        # depend on the grid resolution
+        self.cell_weight = (DEFAULT_GRID_SIZE / grid_size) ** 2
+
+    def reset(self):
+        self.grid.fill(0)
+        self.clean_cells = 0
+
+    def dirty_cells(self):
+        return self.cells - self.clean_cells
+
+    def cell(self, x, y):
+        """
+            Returns the grid cell (row, column) of position (x, y)
+        """
+        return int(y / self.tile_height), int(x / self.tile_width)
+
+    def clean(self, x, y, value):
+        """
+            Stamp the robot footprint at position (x, y) onto the grid, dirty cells get the given value
+            Returns the amount of dirt that was cleaned
+        """
+        j, i = self.cell(x, y)
+
+        # Crop the footprint to the grid
+        top = max(j - self.stencil_rows, 0)
+        bottom = min(j + self.stencil_rows + 1, self.grid_size)
+        left = max(i - self.stencil_columns, 0)
+        right = min(i + self.stencil_columns + 1, self.grid_size)
+        if top >= bottom or left >= right:
+            return 0
+        stencil = self.stencil[top - j + self.stencil_rows:bottom - j + self.stencil_rows,
+                               left - i + self.stencil_columns:right - i + self.stencil_columns]
+
+        patch = self.grid[top:bottom, left:right]
+        dirty = (patch == 0) & stencil
+        patch[dirty] = value
+        count = np.count_nonzero(dirty)
+        if value != 0:
+            self.clean_cells += count
+        return count * value * self.cell_weight
+
+    def clean_path(self, x, y, value):
+        """
+            Stamp the robot footprint at all positions (arrays x, y) of a path onto the (single) grid at once
+            Returns the amount of dirt that was cleaned (same as cleaning the positions one by one)
+        """
+        rows = (np.asarray(y) / self.tile_height).astype(int)[:, None] + self.offset_rows
+        columns = (np.asarray(x) / self.tile_width).astype(int)[:, None] + self.offset_columns
+
+        # Cells outside of the grid are ignored, cells covered by several positions are cleaned once
+        inside = (rows >= 0) & (rows < self.grid_size) & (columns >= 0) & (columns < self.grid_size)
+        cells = np.unique(rows[inside] * self.grid_size + columns[inside])
+        flat = self.grid.reshape(-1)
+        cells = cells[flat[cells] == 0]
+        flat[cells] = value
+        if value != 0:
+            self.clean_cells += len(cells)
+        return len(cells) * value * self.cell_weight
+
+    def clean_batch(self, x, y, value):
+        """
+            Batched version of clean for a grid with n_grids: x, y and value are arrays with one entry per grid
+            Returns the amount of dirt cleaned in each grid
+        """
+        rows = (y / self.tile_height).astype(int)[:, None] + self.offset_rows
+        columns = (x / self.tile_width).astype(int)[:, None] + self.offset_columns
+        grids = np.broadcast_to(np.arange(len(self.grid))[:, None], rows.shape)
+
+        # Cells outside of the grid are ignored
+        inside = (rows >= 0) & (rows < self.grid_size) & (columns >= 0) & (columns < self.grid_size)
+        grids, rows, columns = grids[inside], rows[inside], columns[inside]
+
+        dirty = self.grid[grids, rows, columns] == 0
+        grids, rows, columns = grids[dirty], rows[dirty], columns[dirty]
+        self.grid[grids, rows, columns] = value[grids]
+        return np.bincount(grids, minlength=len(self.grid)) * value * self.cell_weight
@@ -1,31 +1,44 @@
 """ ROBOT MODULE """
 import numpy as np
-import pygame
 import math
-from datetime import datetime
 from bot import robot as bot
+from bot import kinematics as kin
 from bot import genetic as gen
 from bot import ann as ann
-from bot import beacon as bc
-from bot import trigonometry as tri
-import time
-import queue
-import matplotlib.patches as matches
-import matplotlib.pyplot as plt
+from bot import dirt as dirt
+from bot import maps as maps
+from bot import particle as pf
+from bot import scheduler as sched
+from bot import renderer as ren
+from bot import metrics as metrics
+from bot import fitness as fit
 
 __author__ = 'Steffen Schneider, Camiel Kerkhofs, Olve Dragesat'
 
-pygame.font.init()
-game_font = pygame.font.SysFont('arial', 20)
-BLACK = (0, 0, 0)
-GRAY = (244, 245, 247)
-WHITE = (255, 255, 255)
-BLUE = (66, 134, 244)
-RED = (226, 123, 120)
-GREEN = (34, 139, 34)
-ORANGE = (255, 165, 0)
+# pygame and matplotlib are only imported when graphics are used (see load_graphics), headless simulations
+# (e.g. genetic algorithm workers) never load them
+pygame = None
+game_font = None
 
-DRAW_KALMAN_HISTORY = True
+DRAW_PARTICLES = 500  # Maximum number of particles drawn with particle filter localization
+MAX_DIRT_VALUE = 5  # Dirt cleaned per cell at the maximum sensor activation
+PRUNE_INTERVAL = 10  # Number of updates between two checks of the prune threshold (see simulate)
+REALTIME_DELTA_T = 50  # Step (ms) of realtime simulations (time_dilation > 0) without a static delta_t
+MIN_EVENT_TIME = 1  # Event driven simulations slide along a wall when it is closer than this (ms) to a contact
+EVENT_CLEAN_SPACING = 4  # Distance (pixels) between the positions that clean the dirt along an event driven move
+
+
+def load_graphics():
+    """
+        Import pygame and load the font used for the debug output
+    """
+    global pygame, game_font
+    if pygame is None:
+        import pygame as pygame_module
+        pygame_module.font.init()
+        game_font = pygame_module.font.SysFont('arial', 20)
+        pygame = pygame_module
+    return pygame
 
 
 class Environment:
@@ -47,26 +60,31 @@ class Environment:
         # reset bot
         self.robot.reset()
         self.neural_net = None
-        self.activations = []
-        self.rotation_speeds = []
+        self.gene = b''
         self.fitness_id = 1
-        self.delta_kalman = []
-        self.delta_odometry = []
-        self.delta_beacon = []
+        self.activation_sum = 0
+        self.wheel_fitness = 0
+        self.n_controls = 0
+        self.control_velocities = (0, 0)
+        self.errors.reset()
+
+        self.pruned = False
 
         # Reset the dust grid
         self.cleaned = 0
         self.dirt_sensor = 0
-        for index in range(self.grid_size):
-            row = [0] * self.grid_size
-            self.dirt[index] = row
+        self.dirt.reset()
 
         self.frames = 0
         self.updates = 0
         self.time = 0  # elapsed time in milliseconds
-        self.simulation_start_time = datetime.now()  # timestamp
+        self.next_control = 0  # time of the next decision of the neural net (event driven simulations)
+        self.scheduler = sched.FixedStepScheduler(REALTIME_DELTA_T)  # replaced by the one of the simulation
 
-    def __init__(self):
+    def __init__(self, n_sensors=12, grid_size=dirt.DEFAULT_GRID_SIZE, map_name=maps.DEFAULT_MAP,
+                 localization='kalman', n_particles=pf.DEFAULT_PARTICLES, ray_table=None, distance_field=False,
+                 sphere_tracing=False, continuous_collision=False, event_driven=False, render_thread=False,
+                 error_report_interval=0):
         self._pygame_initialized = False
         self._running = True
         self._paused = False
@@ -75,98 +93,80 @@ class Environment:
         self.static_time_mode = False
         self.time_dilation = 1
 
-        self.robot = bot.Robot()
+        # localization is 'kalman' or 'particle', continuous_collision lifts the delta_t limit (see Robot)
+        # event_driven: the simulation jumps from event to event instead of using fixed steps (see on_next_event),
+        # its slides along the walls are swept
+        self.event_driven = event_driven
+        self.robot = bot.Robot(n_sensors=n_sensors, localization=localization, n_particles=n_particles,
+                               continuous_collision=continuous_collision or event_driven)
         self.neural_net = None
-        self.qsize = 10
-        self.q = queue.Queue(maxsize=self.qsize)  # Queue of last 10 KF predictions that should be drawn in pygame
+        self.nn_inputs = np.zeros(n_sensors + 1)  # Sensor activations followed by the dirt sensor
 
         self.velocity_base = 0.1
         self.velocity_min = -1
         self.velocity_max = 1
 
-        self.delta_kalman = []
-        self.delta_odometry = []
-        self.delta_beacon = []
+        # Localization errors, their statistics are printed every error_report_interval updates (0: never)
+        self.errors = metrics.ErrorMetrics()
+        self.error_report_interval = error_report_interval
 
-        # Walls
+        # Walls and beacons of the map (see maps.CompiledMap)
         # A wall is defined as 2 points: [(x1,y1), (x2,y2)] which gives a line from x1,y1 to x2,y2
-        self.walls = [
-            # Outer walls
-            [(50, 50), (750, 50)],
-            [(50, 750), (750, 750)],
-            [(50, 50), (50, 750)],
-            [(750, 50), (750, 750)],
-
-            # Maze walls
-            [(200, 150), (650, 300)],
-            [(200, 600), (500, 400)],
-            # [(300, 300), (300, 500)],
-            # [(500, 300), (500, 500)],
-
-            # Inner walls big
-            # [(300, 300), (500, 300)],
-            # [(300, 500), (500, 500)],
-            # [(300, 300), (300, 500)],
-            # [(500, 300), (500, 500)],
-
-            # Inner small walls 1
-            # [(200, 300), (300, 300)],
-            # [(200, 500), (300, 500)],
-            # [(200, 300), (200, 500)],
-            # [(300, 300), (300, 500)],
-
-            # Inner small walls 2
-            # [(400, 300), (500, 300)],
-            # [(400, 500), (500, 500)],
-            # [(400, 300), (400, 500)],
-            # [(500, 300), (500, 500)],
-
-        ]
-
-        # Beacons
-        # A beacon is placed at each wallcorner and is reperesented by an x and y coordinate [x, y]
-        self.beacons = [
-            bc.Beacon(50, 50),
-            bc.Beacon(750, 50),
-            bc.Beacon(50, 750),
-            bc.Beacon(750, 750),
-
-            # Maze walls
-            bc.Beacon(200, 150),
-            bc.Beacon(650, 300),
-            bc.Beacon(200, 600),
-            bc.Beacon(500, 400)
-
-            # Inner walls big
-            # bc.Beacon(300, 300),
-            # bc.Beacon(300, 500),
-            # bc.Beacon(500, 300),
-            # bc.Beacon(500, 500)
-        ]
-
-        # Dust grid (a grid of integers representing the places cleaned by the robot)
-        # cell value 0 means the robot has not been there yet (dirty)
-        # cell value 1 means the robot has not been there (clean)
-        self.grid_size = 128
+        # A beacon is reperesented by an x and y coordinate [x, y]
+        self.map = maps.load_map(map_name)
+        self.walls = self.map.walls
+        self.wall_segments = self.map.segments  # Walls as an array for the vectorized ray caster
+        self.wall_index = self.map.index  # Spatial index for sensor and beacon queries
+        self.visibility = self.map.visibility  # Precomputed beacon visibility (same order as self.beacons)
+
+        # ray_table = (resolution, angle_resolution): the sensors read interpolated distances from a precomputed
+        # table (faster, approximate; see spatial.RayTable), None casts the sensor rays against the walls
+        self.ray_table = ray_table
+        self.sensor_walls = self.wall_index
+        if ray_table is not None:
+            self.sensor_walls = maps.load_ray_table(map_name, self.robot.sensor_max, *ray_table)
+
+        # distance_field: wall contacts are resolved with the distance field of the map (also contacts between the
+        # sensor rays), sphere_tracing: the sensor rays are sphere traced through the field (see spatial.DistanceField)
+        self.contact_field = self.map.distance_field if distance_field else None
+        if sphere_tracing:
+            if ray_table is not None:
+                raise ValueError('The sensors use either a ray table or sphere tracing')
+            self.sensor_walls = self.map.distance_field
+        self.beacons = self.map.create_beacons()
+
+        # Display parameters
+        self.size = self.width, self.height = 1024, 768
+
+        # Dust grid (see dirt.DirtGrid)
+        self.grid_size = grid_size
         self.cleaned = 0
         self.dirt_sensor = 0
-        self.dirt = [0] * self.grid_size
-        for index in range(self.grid_size):
-            row = [0] * self.grid_size
-            self.dirt[index] = row
-
-        # Track fitness
-        self.activations = []
-        self.rotation_speeds = []
+        self.dirt = dirt.DirtGrid(grid_size, self.size, self.robot.radius)
+
+        # Graphics: frames are drawn right away, or by a separate thread with render_thread (see renderer.RenderThread;
+        # the thread draws on the pygame display that was created by the simulation thread)
+        self.render_thread = render_thread
+        self.render_worker = None
+        self.renderer = None  # renderer.Renderer of the display, created with the display
+        self.frame = ren.Frame(self.dirt.grid.shape)
+
+        # Track fitness, every fitness function is a running accumulator that is updated in observe
+        # (see fitness_record, the statistics every fitness function is computed from)
+        self.gene = b''  # Digest of the weights of the neural net (see fitness.gene_digest)
         self.fitness_id = 1
+        self.activation_sum = 0  # Sum of the normalized sensor activations of all updates
+        self.wheel_fitness = 0  # Sum of the per update evaluations of fitness 4 and 5
+        self.n_controls = 0  # Number of decisions of the neural net
+        self.control_velocities = (0, 0)  # Wheel velocities of the last decision
+        self.pruned = False
 
-        # Display parameters
-        self.size = self.width, self.height = 1024, 768
         self.frames = 0
         self.updates = 0
         self.time = 0
-        self.simulation_start_time = datetime.now()
-        self.delta_t = 0  # Simulation will update using this delta_t if static_time_mode is enabled.
+        self.next_control = 0
+        self.scheduler = sched.FixedStepScheduler(REALTIME_DELTA_T)
+        self.delta_t = 0  # Simulation time (ms) of a single update
 
     def on_init(self):
         """
@@ -174,11 +174,16 @@ class Environment:
         """
         if self.graphics_enabled:
             if not self._pygame_initialized:
+                load_graphics()
                 pygame.init()
                 self._pygame_initialized = True
             self._display_surf = pygame.display.set_mode(self.size, pygame.HWSURFACE | pygame.DOUBLEBUF)
+            self.renderer = ren.Renderer(self._display_surf, game_font, self.walls,
+                                         [(beacon.x, beacon.y) for beacon in self.beacons], self.dirt,
+                                         self.robot.radius,
+                                         'Particle' if self.robot.particle_filter is not None else 'Kalman')
         self._running = True
-        self.robot.update_sensors(self.walls)
+        self.robot.update_sensors(self.sensor_walls, self.contact_field)
         # self.robot.update_beacons(self.beacons, self.walls)
         self.on_render()
 
@@ -198,11 +203,12 @@ class Environment:
                     self._paused = False
                 else:
                     # When simulation is paused, a plot of the errors is shown to the user
+                    import matplotlib.pyplot as plt
 
-                    # Transpose the error matrices to plot more easily
-                    beacon_error = np.transpose(self.delta_beacon)
-                    kalman_error = np.transpose(self.delta_kalman)
-                    odometry_error = np.transpose(self.delta_odometry)
+                    # Transpose the error matrices (latest errors) to plot more easily
+                    beacon_error = np.transpose(self.errors.history('beacon'))
+                    kalman_error = np.transpose(self.errors.history('kalman'))
+                    odometry_error = np.transpose(self.errors.history('odometry'))
 
                     # Find out how many measurements
                     x = np.linspace(1, len(beacon_error[0]), len(beacon_error[0]))
@@ -261,182 +267,142 @@ class Environment:
             Update all relevant movement and simulation logic
         """
 
-        # Check update timings
-        current_time = self.get_elapsed_time()
-        time_since_update = current_time - self.time
-
-        # Wait if time dilation is used
-        delta_t = self.delta_t
-        if self.delta_t == 0:
-            delta_t = time_since_update
-        if not self.static_time_mode:
-            while time_since_update < self.delta_t:
-                time.sleep(0.01)  # wait for 10 ms
-                current_time = self.get_elapsed_time()
-                time_since_update = current_time - self.time
-
+        # Fixed step, the scheduler decides when it runs (see simulate)
         self.updates += 1
-        self.time = current_time
+        self.time += self.delta_t
 
         # Get a new move from the neural net if it was initialized
         if self.neural_net is not None:
-            inputs = []
-            for index, sensor in enumerate(self.robot.sensors):
-                inputs.append(sensor[1])
-            inputs.append(self.dirt_sensor)  # dirt sensor "weighs" the dirt cleaned since last update
-            vel_lr = self.neural_net.get_velocities(inputs)
-            self.robot.set_velocity(vel_lr[0], vel_lr[1])
-            self.rotation_speeds.append(vel_lr)
+            self.control()
 
         # Update robot position
-        self.robot.move_robot(delta_t, self.beacons, self.walls)
-
-        # get deviations for plotting
-        if len(self.delta_kalman) < 1000:
-            self.delta_kalman.append(self.robot.get_kf_deviation())
-            avg_xy = (np.sum([x[0] for x in self.delta_kalman]) / len(self.delta_kalman) + np.sum(
-                [x[1] for x in self.delta_kalman]) / len(self.delta_kalman)) / 2
-            avg_angle = np.sum([x[2] for x in self.delta_kalman]) / len(self.delta_kalman)
-            print("----------------")
-            print("kalman avg_xy deviation: ", avg_xy)
-            print("kalman avg_angle deviation: ", avg_angle)
-        if len(self.delta_odometry) < 1000:
-            self.delta_odometry.append(self.robot.get_odometry_deviation())
-            avg_xy = (np.sum([x[0] for x in self.delta_odometry]) / len(self.delta_odometry) + np.sum(
-                [x[1] for x in self.delta_odometry]) / len(self.delta_odometry)) / 2
-            avg_angle = np.sum([x[2] for x in self.delta_odometry]) / len(self.delta_odometry)
-            print("odometry avg_xy deviation: ", avg_xy)
-            print("odometry avg_angle deviation: ", avg_angle)
-        if len(self.delta_beacon) < 1000:
-            self.delta_beacon.append(self.robot.get_beacon_deviation())
-            avg_xy = (np.sum([x[0] for x in self.delta_beacon]) / len(self.delta_beacon) + np.sum(
-                [x[1] for x in self.delta_beacon]) / len(self.delta_beacon)) / 2
-            avg_angle = np.sum([x[2] for x in self.delta_beacon]) / len(self.delta_beacon)
-            print("beacon avg_xy deviation: ", avg_xy)
-            print("beacon avg_angle deviation: ", avg_angle)
+        self.robot.move_robot(self.delta_t, self.beacons, self.wall_index, self.visibility)
+        self.observe()
+
+    def on_next_event(self, timeout):
+        """
+            Event driven update: the robot moves along the exact arc of its wheel velocities up to the next event
+                control: the neural net decides every delta_t ms (never without a neural net)
+                contact: the robot touches a wall (see Robot.time_to_contact)
+                timeout: the end of the simulation
+            After a contact the robot slides along the walls for the rest of the control step (at most delta_t,
+            swept like continuous_collision), so long runs without contacts or decisions take a single update.
+        """
+        end = timeout * 1000 if timeout > 0 else math.inf
+        next_control = math.inf
+        if self.neural_net is not None:
+            if self.time >= self.next_control:
+                self.control()
+                self.next_control += self.delta_t
+            next_control = self.next_control
+        horizon = min(next_control, end) - self.time
+        if math.isinf(horizon):
+            horizon = self.delta_t
+
+        # Move to the contact (or to the next event), the slide along the wall is the next update
+        step = self.robot.time_to_contact(self.wall_index, horizon)
+        contact_free = step > MIN_EVENT_TIME
+        if not contact_free:
+            step = min(self.delta_t, horizon)
+        start = self.robot.posx, self.robot.posy, self.robot.angle
+        # Wheel velocities are switched like in Robot.move_robot
+        velocities = round(self.robot.vel_right, 5), round(self.robot.vel_left, 5)
+        self.robot.move_robot(step, self.beacons, self.wall_index, self.visibility, contact_free=contact_free)
+
+        self.updates += 1
+        self.time += step
+        if self.time >= end:
+            self._running = False
+
+        # A free move cleans the dirt along its arc, a slide at its end
+        path = None
+        if contact_free:
+            n_points = int(step * max(abs(velocities[0]), abs(velocities[1])) / 10 / EVENT_CLEAN_SPACING) + 2
+            path = kin.bot_calc_coordinates(np.full(n_points, start[0]), np.full(n_points, start[1]),
+                                            np.full(n_points, start[2]), velocities[0], velocities[1],
+                                            np.linspace(0, step / 10, n_points), self.robot.radius * 2)[:2]
+        self.observe(path)
+
+    def control(self):
+        """
+            Get a new move from the neural net
+        """
+        self.nn_inputs[:-1] = self.robot.sensors[:, 1]
+        self.nn_inputs[-1] = self.dirt_sensor  # dirt sensor "weighs" the dirt cleaned since last update
+        vel_lr = self.neural_net.get_velocities(self.nn_inputs)
+        self.robot.set_velocity(vel_lr[0], vel_lr[1])
+        self.control_velocities = (vel_lr[0], vel_lr[1])  # vel_lr is overwritten by the next forward pass
+        self.n_controls += 1
+
+    def observe(self, path=None):
+        """
+            Update the sensors, the fitness and the dirt after the robot moved
+            path: optional (x, y) arrays of positions along the move, the dirt is cleaned along it
+        """
+
+        # Localization errors for the statistics and the plot
+        self.errors.add({'kalman': self.robot.get_kf_deviation(),
+                         'odometry': self.robot.get_odometry_deviation(),
+                         'beacon': self.robot.get_beacon_deviation()})
+        if self.error_report_interval and self.updates % self.error_report_interval == 0:
+            print('\n'.join(self.errors.report()))
 
         # Update robot sensors
-        closest_activation = self.robot.update_sensors(self.walls)
+        closest_activation = self.robot.update_sensors(self.sensor_walls, self.contact_field)
         max_activation = self.robot.max_activation
         norm = closest_activation / max_activation
-        self.activations.append(norm)
+        self.activation_sum += norm
+
+        # Evaluation of fitness 4 and 5 for this update, only defined while the neural net decides every update
+        if self.n_controls == self.updates:
+            left, right = self.control_velocities
+            v = (abs(left) + abs(right)) / 2  # Average of unsigned velocities for both wheels
+            delta_v = abs(left - right)  # Absolute algebraic difference
+            self.wheel_fitness += (v * (1 - math.sqrt(delta_v))) * (1 - norm)
 
-        dirt_value = 5 * norm
-        self.dirt_sensor = 0
         # Update dirt
-        dirt_i = int(self.robot.posx / (self.width / self.grid_size))
-        dirt_j = int(self.robot.posy / (self.height / self.grid_size))
-        for n in range(int(math.floor(self.robot.radius / (self.height / self.grid_size))) - 1):
-            for m in range(int(math.ceil(self.robot.radius / (self.width / self.grid_size))) - 1):
-                if self.dirt[dirt_j - n][dirt_i - m] == 0:
-                    self.dirt[dirt_j - n][dirt_i - m] = dirt_value
-                    self.dirt_sensor += dirt_value
-                if self.dirt[dirt_j + n][dirt_i + m] == 0:
-                    self.dirt[dirt_j + n][dirt_i + m] = dirt_value
-                    self.dirt_sensor += dirt_value
-                if self.dirt[dirt_j - n][dirt_i + m] == 0:
-                    self.dirt[dirt_j - n][dirt_i + m] = dirt_value
-                    self.dirt_sensor += dirt_value
-                if self.dirt[dirt_j + n][dirt_i - m] == 0:
-                    self.dirt[dirt_j + n][dirt_i - m] = dirt_value
-                    self.dirt_sensor += dirt_value
+        if path is None:
+            self.dirt_sensor = self.dirt.clean(self.robot.posx, self.robot.posy, MAX_DIRT_VALUE * norm)
+        else:
+            self.dirt_sensor = self.dirt.clean_path(path[0], path[1], MAX_DIRT_VALUE * norm)
         self.cleaned += self.dirt_sensor
 
     def on_render(self):
         """
             print debug information and render the graphics if they are enabled
+            With a render thread the frame is only captured here and drawn by the thread
         """
 
         if not self.graphics_enabled:
             return True
+        if self.render_worker is not None:
+            self.render_worker.publish(self.capture)
+            return
+        self.capture(self.frame)
+        self.draw(self.frame)
 
+    def capture(self, frame):
+        """
+            Copy the state that is drawn into a renderer.Frame
+        """
+        np.copyto(frame.grid, self.dirt.grid)
+        frame.pose = self.robot.posx, self.robot.posy, self.robot.angle
+        frame.beacon_pose = self.robot.get_robot_beacon_position()
+        frame.odometry_pose = self.robot.get_robot_od_position()
+        frame.belief_pose = self.robot.get_robot_bel_position()
+        frame.particles = None
+        if self.robot.particle_filter is not None:
+            particles = self.robot.particle_filter.particles
+            frame.particles = particles[::max(len(particles) // DRAW_PARTICLES, 1), :2].astype(int)
+        frame.debug = self.get_debug_output()
+
+    def draw(self, frame):
+        """
+            Draw a renderer.Frame
+        """
         self.frames += 1
-
-        debug = self.get_debug_output()
-
-        # Clean display
-        self._display_surf.fill(GRAY)
-
-        # Draw dirt
-        for index_row, dirt_row in enumerate(self.dirt):
-            tile_height = self.height / self.grid_size
-            y_offset = tile_height * index_row
-            for index_column, dirt_column in enumerate(dirt_row):
-                if dirt_column > 0:
-                    tile_width = self.width / self.grid_size
-                    x_offset = tile_width * index_column
-                    pygame.draw.rect(self._display_surf, WHITE, (x_offset, y_offset, tile_width, tile_height), 0)
-
-        # Draw walls
-        for w in self.walls:
-            pygame.draw.line(self._display_surf, BLACK, w[0], w[1])
-
-        # Draw beacons
-        for b in self.beacons:
-            pygame.draw.circle(self._display_surf, RED, (b.x, b.y), 5, 0)
-
-        # Draw beacon connections
-        # robot_pos = (int(self.robot.posx), int(self.robot.posy))
-        # for index, beacon in enumerate(self.robot.connected_beacons):
-        #     pygame.draw.line(self._display_surf, RED, robot_pos, [beacon.x, beacon.y])
-
-        # Draw sensors
-        robot_pos = (int(self.robot.posx), int(self.robot.posy))
-        # for index, sensor in enumerate(self.robot.sensors):
-        #     pygame.draw.line(self._display_surf, RED, robot_pos, sensor[2])
-        #     textsurface = game_font.render(str(index) + ": " + "{0:.0f}".format(sensor[1]), False, RED)
-        #     self._display_surf.blit(textsurface, sensor[2])
-
-        # Draw the robot
-        pygame.draw.circle(self._display_surf, BLUE, robot_pos, self.robot.radius, 0)
-        robot_head = tri.line_endpoint(robot_pos, self.robot.angle, self.robot.radius)
-        pygame.draw.line(self._display_surf, BLACK, robot_pos, robot_head, 2)
-
-        # Draw beacon triangulation output
-        X_beacons = self.robot.get_robot_beacon_position()
-        pygame.draw.circle(self._display_surf, ORANGE, (int(X_beacons[0]), int(X_beacons[1])), 15, 7)
-        robot_head = tri.line_endpoint((int(X_beacons[0]), int(X_beacons[1])), X_beacons[2], 15)
-        pygame.draw.line(self._display_surf, BLACK, (int(X_beacons[0]), int(X_beacons[1])), robot_head, 2)
-
-        # Draw odometry measurement
-        X_odometry = self.robot.get_robot_od_position()
-        if X_odometry[0] is not None:
-            pygame.draw.circle(self._display_surf, RED, (int(X_odometry[0]), int(X_odometry[1])), 15, 7)
-            robot_head = tri.line_endpoint((int(X_odometry[0]), int(X_odometry[1])), X_odometry[2], 15)
-            pygame.draw.line(self._display_surf, BLACK, (int(X_odometry[0]), int(X_odometry[1])), robot_head, 2)
-
-        # Draw Kalman output(s)
-        X_believe = self.robot.get_robot_bel_position()
-        # remove last item from queue if its longer than max, put new prediction in a queue
-        if self.q.full():
-            self.q.get()
-        self.q.put(X_believe)
-        # for each item in self.q, draw to pygame
-        for i in range(0, self.qsize):
-            belief = self.q.get()
-            if i == self.qsize - 1 or DRAW_KALMAN_HISTORY:
-                pygame.draw.circle(self._display_surf, GREEN, (int(belief[0]), int(belief[1])), 15, 7)
-                robot_head = tri.line_endpoint((int(belief[0]), int(belief[1])), belief[2], 15)
-                pygame.draw.line(self._display_surf, BLACK, (int(belief[0]), int(belief[1])), robot_head, 2)
-            self.q.put(belief)
-
-        # Draw debug metrics
-        for index, info in enumerate(debug):
-            self._display_surf.blit(game_font.render(info, False, BLACK), (830, 50 + (index * 18)))
-
-        # Kalman info
-        types = [(BLUE, 'Actual position', 0),
-                 (ORANGE, 'Beacon position', 7),
-                 (RED, 'Odometry position', 7),
-                 (GREEN, 'Kalman position', 0)]
-        pos = [830, 550]
-        for t in types:
-            pygame.draw.circle(self._display_surf, t[0], pos, int(self.robot.radius / 2), t[2])
-            self._display_surf.blit(game_font.render(t[1], False, BLACK), (pos[0] + 40, pos[1] - 15))
-            pos[1] += int(self.robot.radius) + 10
-
-        # Update display
-        pygame.display.update()
+        self.scheduler.count_frame()
+        self.renderer.draw(frame)
 
     def get_debug_output(self):
         return ["Debug info:",
@@ -444,9 +410,9 @@ class Environment:
                 "Simulation time: " + str(int(self.get_elapsed_time() / 1000)) + " s",
                 "Time dilation: * " + str(self.time_dilation),
                 "Frames: " + str(self.frames),
-                "FPS: " + str(int(self.frames / max(1, (self.get_elapsed_time(realtime=True) / 1000)))),
+                "FPS: " + str(int(self.scheduler.frames_per_second)),
                 "Updates: " + str(self.updates),
-                "UPS: " + str(int(self.updates / max(1, (self.get_elapsed_time(realtime=True) / 1000)))),
+                "UPS: " + str(int(self.scheduler.updates_per_second)),
                 "",
                 "Robot:",
                 "  Angle: " + str(int(self.robot.angle)),
@@ -458,7 +424,7 @@ class Environment:
                 "Fitness:",
                 "  Cleaned: " + str(int(self.cleaned)),
                 "  Collisions: " + str(self.robot.num_collisions),
-                "  Activations: " + str(len(self.activations)),
+                "  Activations: " + str(self.updates),
                 "  Evaluation: " + str(int(self.fitness())),
                 "",
                 "",
@@ -475,30 +441,27 @@ class Environment:
 
     def get_elapsed_time(self, realtime=False):
         """
-            Returns the elapsed time in milliseconds multiplied by the time dilation factor
-            If realtime is set to True, time dilation is ignored
+            Returns the elapsed simulation time in milliseconds (the fixed steps or events so far)
+            If realtime is set to True, the real time since the start of the simulation is returned
         """
-        # Returns a fake elapsed time if time mode is static
-        if self.static_time_mode and not realtime:
-            return int(self.delta_t * self.updates)
-
-        # Calculate the actual elapsed time
-        elapsed_t = self.time_diff_ms(datetime.now(), self.simulation_start_time)
         if realtime:
-            return int(elapsed_t)
-        else:
-            return int(elapsed_t * self.time_dilation)
+            return int(self.scheduler.elapsed())
+        return int(self.time)
 
     def simulate(self, graphics_enabled=True, time_dilation=1, timeout=0, weights=[], static_delta_t=None,
-                 recurrence=False, start_x=0, start_y=0, start_angle=0, fitness_id=1):
+                 recurrence=False, start_x=0, start_y=0, start_angle=0, fitness_id=1, prune_threshold=None,
+                 prune_interval=PRUNE_INTERVAL):
         """
             Start a simulation
             graphics_enabled: boolean; If set to false, graphics rendering is skipped
             time_dilation: integer; All time interactions are multiplied  by this factor. 1 = realtime
                 Set time_dilation to 0 to use a static delta_t for updating (simulation will run as fast as hardware allows)
             timeout: integer; Timeout of simulation in seconds. 0 = no timeout
+            prune_threshold: float; Stop the simulation early once the fitness can not exceed this value anymore
+                (checked every prune_interval updates, static delta_t with a timeout only; see fitness_upper_bound)
 
             Returns the fitness evaluation of the simulation (float) when the simulation is finished
+            A pruned simulation sets self.pruned and returns the upper bound of its fitness (below the threshold)
         """
         try:
             self.reset()
@@ -506,7 +469,9 @@ class Environment:
             self.graphics_enabled = graphics_enabled
             self.fitness_id = fitness_id
             if len(weights) > 0:
-                self.neural_net = ann.NeuralNet(weights, recurrence=recurrence)
+                self.gene = fit.gene_digest(weights)
+                self.neural_net = ann.NeuralNet(weights, nr_of_input_nodes=len(self.nn_inputs),
+                                                recurrence=recurrence)
             else:
                 # Just use some sample velocity in case weights are missing (demo mode)
                 self.robot.set_velocity(0.65, 0.5)  # 0.65,0.5 = circle movement
@@ -514,14 +479,19 @@ class Environment:
             self.time_dilation = time_dilation
             if time_dilation == 0:
                 self.static_time_mode = True
+            elif self.event_driven:
+                raise ValueError('An event driven simulation needs a static delta_t (time_dilation 0)')
             if static_delta_t is not None:
                 # Static delta_t can not exceed the robots radius or else it will shoot trough environment limits!
-                if static_delta_t > 200:
-                    raise ValueError('delta_t exceeds the limit of 200ms. Requested delta_t: ' + str(static_delta_t))
+                # (unless the robot is swept along its moves with continuous collision detection)
+                if static_delta_t > bot.MAX_DELTA_T and not self.robot.continuous_collision:
+                    raise ValueError('delta_t exceeds the limit of ' + str(bot.MAX_DELTA_T) + 'ms, '
+                                     'continuous_collision=True lifts it. Requested delta_t: ' + str(static_delta_t))
                 self.delta_t = static_delta_t
+            elif time_dilation == 0:
+                self.delta_t = 200
             else:
-                if time_dilation == 0:
-                    self.delta_t = 200
+                self.delta_t = REALTIME_DELTA_T
 
             if start_x != 0 and start_y != 0:
                 self.robot.set_robot_initial_position(start_x, start_y, start_angle)
@@ -530,21 +500,41 @@ class Environment:
                 # Has no return value but will return False if pygame library encounters an internal error
                 raise ValueError('Error during pygame initialization')
 
-            # Reset simulation time
+            # Reset simulation time, the scheduler runs the fixed steps (realtime or as fast as possible)
             self.time = 0
-            self.simulation_start_time = datetime.now()
+            self.scheduler = sched.FixedStepScheduler(self.delta_t, time_dilation)
+            if graphics_enabled and self.render_thread:
+                self.render_worker = ren.RenderThread(self.draw, self.dirt.grid.shape)
+                self.render_worker.start()
 
             while self._running:
                 if graphics_enabled:
                     for event in pygame.event.get():
                         self.on_event(event)
-                if not self._paused:
-                    self.on_loop()
-                    self.on_render()
-
-                if timeout > 0:
-                    if (self.get_elapsed_time() > (timeout * 1000)):
-                        self._running = False
+                if self._paused:
+                    self.scheduler.pause()
+                    continue
+
+                for _ in range(self.scheduler.due()):
+                    if self.event_driven:
+                        self.on_next_event(timeout)
+                    else:
+                        self.on_loop()
+                    self.scheduler.count_update()
+
+                    if timeout > 0:
+                        if (self.get_elapsed_time() > (timeout * 1000)):
+                            self._running = False
+
+                    # Stop hopeless simulations early
+                    if prune_threshold is not None and self._running and self.updates % prune_interval == 0:
+                        bound = self.fitness_upper_bound(timeout)
+                        if bound < prune_threshold:
+                            self.pruned = True
+                            return bound
+                    if not self._running:
+                        break
+                self.on_render()
 
             # pygame.quit()
 
@@ -563,75 +553,87 @@ class Environment:
         #     print(inst)
         #     print('\033[0m' + "\n")
         #     return 0
+        finally:
+            if self.render_worker is not None:
+                self.render_worker.stop()
+                self.render_worker = None
 
-    def fitness(self):
+    def fitness_upper_bound(self, timeout):
         """
-            Returns the current fitness evaluation of the simulation (float)
+            Returns an upper bound of the fitness at the end of the simulation (after timeout seconds)
+            The bound is only known with a static delta_t (and fixed steps), otherwise it is inf
         """
+        if not self.static_time_mode or timeout <= 0 or self.event_driven:
+            return math.inf
+        remaining_updates = max(int(timeout * 1000 / self.delta_t) + 2 - self.updates, 0)
+        return self.fitness_bound(self.fitness_id, remaining_updates, self.cleaned, self.dirt.dirty_cells(),
+                                  self.robot.num_collisions, self.activation_sum, self.updates,
+                                  self.fitness())
+
+    def max_fitness(self, timeout, delta_t, fitness_id):
+        """
+            Returns an upper bound of the fitness of a simulation of timeout seconds with a static delta_t
+        """
+        return self.fitness_bound(fitness_id, int(timeout * 1000 / delta_t) + 2)
 
-        if self.fitness_id == 1:
-            # 1: Simple fitness: total number of dust collected
-            return self.cleaned
-
-
-        elif self.fitness_id == 2:
-            # 2: Total number of dust collected devided by the number of collisions
-            return self.cleaned / (1 + self.robot.num_collisions * 0.3)
-
-
-        elif self.fitness_id == 3 and len(self.activations) > 0:
-            # 3: Total number of dust collected * sensor activation / num collisions
-            total = 0
-            for i in self.activations:
-                total += i
-            avg = total / len(self.activations)
-            return (self.cleaned * avg) / (1 + (self.robot.num_collisions * 0.3))
-
-
-        elif self.fitness_id == 4 and len(self.activations) > 0 and len(self.activations) == len(self.rotation_speeds):
-            # 4: Wheel speeds + activation (from slides)
-            # self.activations and self.rotation_speeds contain the values at each update
-            fitness = 0
-
-            for n in range(len(self.activations)):
-                # Normalized activation value
-                i = self.activations[n]
-
-                # Average of unsigned velocities for both wheels
-                v = (abs(self.rotation_speeds[n][0]) + abs(self.rotation_speeds[n][1])) / 2
-
-                # Absolute algebraic difference
-                delta_v = abs(self.rotation_speeds[n][0] - self.rotation_speeds[n][1])
-
-                evaluate = (v * (1 - math.sqrt(delta_v))) * (1 - i)
-                fitness += evaluate
-
-            return fitness
-
-
-        elif self.fitness_id == 5 and len(self.activations) > 0 and len(self.activations) == len(self.rotation_speeds):
-            # 5: Wheel speeds + activation (from slides)
-            # self.activations and self.rotation_speeds contain the values at each update
-            fitness = 0
-
-            for n in range(len(self.activations)):
-                # Normalized activation value
-                i = self.activations[n]
-
-                # Average of unsigned velocities for both wheels
-                v = (abs(self.rotation_speeds[n][0]) + abs(self.rotation_speeds[n][1])) / 2
-
-                # Absolute algebraic difference
-                delta_v = abs(self.rotation_speeds[n][0] - self.rotation_speeds[n][1])
-
-                evaluate = (v * (1 - math.sqrt(delta_v))) * (1 - i)
-                fitness += evaluate
-
-            return self.cleaned / fitness
-        else:
-            return 0
+    def fitness_bound(self, fitness_id, remaining_updates, cleaned=0, dirty_cells=None, num_collisions=0,
+                      activation_sum=0, n_activations=0, current_fitness=0):
+        """
+            Upper bound of the fitness after remaining_updates more updates, given the current state
+            In a single update the robot cleans at most the cells of its footprint at the maximum dirt value, and the
+            normalized activation and the per update evaluation of fitness 4 are at most 1.
+            Collisions only lower the fitness, so the current number of collisions is used.
+        """
+        if dirty_cells is None:
+            dirty_cells = self.dirt.cells
+        max_cleaned = cleaned + MAX_DIRT_VALUE * self.dirt.cell_weight * min(
+            remaining_updates * self.dirt.stencil_cells, dirty_cells)
+        collision_factor = 1 + num_collisions * 0.3
+
+        if fitness_id == 1:
+            return max_cleaned
+        elif fitness_id == 2:
+            return max_cleaned / collision_factor
+        elif fitness_id == 3:
+            if n_activations + remaining_updates == 0:
+                return 0
+            max_avg = (activation_sum + remaining_updates) / (n_activations + remaining_updates)
+            return max_cleaned * max_avg / collision_factor
+        elif fitness_id == 4:
+            return current_fitness + remaining_updates
+        elif fitness_id == 5:
+            # The wheel speed evaluation can get arbitrarily close to 0
+            return math.inf
+        return 0
+
+    def fitness_record(self):
+        """
+            Returns the statistics of the simulation so far that every fitness function is computed from
+            (array with a single record, see fitness.RECORD_DTYPE)
+        """
+        record = np.zeros(1, dtype=fit.RECORD_DTYPE)
+        record['gene'] = self.gene
+        record['start'] = self.robot.initial_posx, self.robot.initial_posy, self.robot.initial_angle
+        record['delta_t'] = self.delta_t
+        record['cleaned'] = self.cleaned
+        record['num_collisions'] = self.robot.num_collisions
+        record['activation_sum'] = self.activation_sum
+        record['updates'] = self.updates
+        record['wheel_fitness'] = self.wheel_fitness
+        record['n_controls'] = self.n_controls
+        record['pruned'] = self.pruned
+        return record
 
-    def time_diff_ms(self, time1, time2):
-        dt = time1 - time2
-        ms = (dt.days * 24 * 60 * 60 + dt.seconds) * 1000 + dt.microseconds / 1000.0
-        return ms
+    def fitness(self):
+        """
+            Returns the current fitness evaluation of the simulation (float)
+                1: Simple fitness: total number of dust collected
+                2: Total number of dust collected devided by the number of collisions
+                3: Total number of dust collected * sensor activation / num collisions
+                4: Wheel speeds + activation (from slides): sum of (v * (1 - sqrt(delta_v))) * (1 - i) of all updates
+                    with v the average unsigned wheel velocity, delta_v the absolute difference of the wheel
+                    velocities and i the normalized activation
+                5: Dust collected divided by the evaluation of fitness 4
+            (see fitness.score)
+        """
+        return fit.score(self.fitness_record(), self.fitness_id)[0]
@@ -0,0 +1,96 @@
+""" FITNESS MODULE """
+import hashlib
+import os
+import numpy as np
+
+__author__ = 'Steffen Schneider, Camiel Kerkhofs'
+
+# Sufficient statistics of a simulation, every fitness function is computed from them (see score)
+RECORD_DTYPE = np.dtype([('gene', 'S20'),  # sha1 digest of the gene (see gene_digest), empty if unknown
+                         ('start', 'f8', 3),  # Start pose (x, y, angle)
+                         ('delta_t', 'f8'),
+                         ('cleaned', 'f8'),  # Total dirt cleaned
+                         ('num_collisions', 'i8'),
+                         ('activation_sum', 'f8'),  # Sum of the normalized sensor activations of all updates
+                         ('updates', 'i8'),
+                         ('wheel_fitness', 'f8'),  # Sum of the per update evaluations of fitness 4 and 5
+                         ('n_controls', 'i8'),  # Number of decisions of the neural net
+                         ('pruned', '?')])  # The simulation was stopped early (see Environment.simulate)
+
+
+def gene_digest(gene):
+    return hashlib.sha1(np.asarray(gene, dtype=float).tobytes()).digest()
+
+
+def score(records, fitness_id):
+    """
+        Fitness of every record (array of RECORD_DTYPE), the same as Environment.fitness at the end of its simulation
+        fitness_id: one of the fitness functions of Environment.fitness, or a function that returns the fitness of
+            every record for other formulas
+        Fitness 5 is 0 when the wheel evaluation is 0 (no defined fitness, like a simulation that failed)
+    """
+    if callable(fitness_id):
+        return np.asarray(fitness_id(records), dtype=float)
+    cleaned = records['cleaned']
+    updates = records['updates']
+    collision_factor = 1 + records['num_collisions'] * 0.3
+    active = updates > 0
+    # Fitness 4 and 5 are only defined when the neural net decided every update
+    wheel = active & (records['n_controls'] == updates)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if fitness_id == 1:
+            return cleaned.astype(float)
+        elif fitness_id == 2:
+            return cleaned / collision_factor
+        elif fitness_id == 3:
+            avg = records['activation_sum'] / updates
+            return np.where(active, (cleaned * avg) / collision_factor, 0)
+        elif fitness_id == 4:
+            return np.where(wheel, records['wheel_fitness'], 0)
+        elif fitness_id == 5:
+            wheel_fitness = records['wheel_fitness']
+            return np.where(wheel & (wheel_fitness != 0), cleaned / wheel_fitness, 0)
+    return np.zeros(len(records))
+
+
+def costs(records, fitness_id):
+    """
+        Re-score archived simulations: returns the gene digests and their costs under fitness_id (minus the total
+        fitness of the simulations of a gene, like the cost function of the genetic algorithm)
+        Repeated simulations (same gene, start pose and statistics) are counted once. Genes with a pruned
+        simulation are left out, the statistics of a pruned simulation are incomplete.
+    """
+    records = np.ascontiguousarray(records)
+    _, first = np.unique(records.view(np.dtype((np.void, RECORD_DTYPE.itemsize))), return_index=True)
+    records = records[np.sort(first)]
+    digests, inverse = np.unique(records['gene'], return_inverse=True)
+    total = np.bincount(inverse, weights=score(records, fitness_id), minlength=len(digests))
+    complete = np.bincount(inverse, weights=records['pruned'], minlength=len(digests)) == 0
+    return digests[complete], -total[complete]
+
+
+class RecordArchive:
+    """
+        Binary file of records (RECORD_DTYPE), new records are appended
+        Every append is a single write to a file opened in append mode, so worker processes can share an archive.
+        Keep one archive per experiment (map, simulation time, ...), those are not part of the records.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, records):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'ab') as file:
+            file.write(np.asarray(records, dtype=RECORD_DTYPE).tobytes())
+
+    def load(self):
+        """
+            Returns all records of the archive (an empty array if there is no archive yet)
+        """
+        if not os.path.exists(self.path):
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.fromfile(self.path, dtype=RECORD_DTYPE)
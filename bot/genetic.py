@@ -4,12 +4,18 @@ import random
 import math
 import numpy as np
 import os
-from graphing import visualize_cost as vc
+import concurrent.futures
+import hashlib
+import json
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
 
 __author__ = "Olve Drageset"
 
 WEIGHTS_DIRECTORY = 'weights/weights_' + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
 
+EVALUATION_BACKENDS = ['serial', 'thread', 'process']
+
 
 def getcost(individual):
     return individual.cost
@@ -53,6 +59,258 @@ def two_point_crossover(parent1, parent2):
             Individual(gene6)]
 
 
+class PrunedCost(float):
+    """
+        Cost of an evaluation that was stopped early because it could not beat the prune threshold anymore
+        The value is a lower bound of the real cost, so it is ranked behind every cost that beats the threshold
+    """
+    pass
+
+
+class FailedCost(float):
+    """
+        Failure cost of an evaluation that raised an error (or whose worker crashed), so failures are told apart from
+        real costs with the same value
+    """
+    pass
+
+
+def evaluate_safely(cost_function, genes, failure_cost, population=False, threshold=None):
+    """
+        Evaluate a gene (or a list of genes if population is set) and return the cost(s)
+        With a threshold, the cost function is called as cost_function(gene, threshold) and may stop evaluations
+        that can not get a lower cost than the threshold (see PrunedCost)
+        A failing evaluation is reported and gets the failure cost (a FailedCost), so it does not take down the
+        generation.
+        When a population evaluation fails, its genes are evaluated one by one so only the failing genes get the
+        failure cost.
+    """
+    try:
+        if population:
+            return [float(cost) for cost in cost_function(genes)]
+        if threshold is not None:
+            return cost_function(genes, threshold)
+        return cost_function(genes)
+    except Exception as inst:
+        if population and len(genes) > 1:
+            # Evaluate the genes one by one to find the failing one(s)
+            return [evaluate_safely(cost_function, [gene], failure_cost, True)[0] for gene in genes]
+        print('\033[91m' + "=== EVALUATION ERROR === Cost evaluation failed with message: ")
+        print(repr(inst))
+        print('\033[0m')
+        if population:
+            return [FailedCost(failure_cost)]
+        return FailedCost(failure_cost)
+
+
+class FitnessCache:
+    """
+        Least recently used cache of costs, keyed on a hash of the gene and the scenario
+
+        The scenario holds everything besides the gene that determines the cost (e.g. start poses, delta_t,
+        fitness function, simulation time, map and seed). The same gene in another scenario is a different entry.
+        With a path, the cache is loaded from and saved to a json file so it persists between runs. The file can
+        hold entries of several scenarios; delete it when the simulation itself changes.
+    """
+
+    def __init__(self, scenario=None, max_size=100000, path=None):
+        self.scenario = hashlib.sha1(repr(sorted((scenario or {}).items())).encode()).hexdigest()
+        self.max_size = max_size
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, gene):
+        digest = hashlib.sha1(self.scenario.encode())
+        digest.update(np.asarray(gene, dtype=float).tobytes())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+            Returns the cached cost for the key (see key()) or None
+        """
+        cost = self.entries.get(key)
+        if cost is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return cost
+
+    def put(self, key, cost):
+        self.entries[key] = cost
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def load(self, path):
+        with open(path, 'r') as file:
+            for key, cost in json.load(file):
+                self.put(key, cost)
+
+    def save(self, path=None):
+        """
+            Save the entries (least recently used first) to a json file
+        """
+        path = path or self.path
+        if path is None:
+            return
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as file:
+            json.dump(list(self.entries.items()), file)
+        os.replace(temporary, path)
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = self.hits / total if total > 0 else 0
+        return f"FITNESS CACHE: {self.hits} hits, {self.misses} misses ({rate:.0%}), {len(self.entries)} entries"
+
+
+class Evaluator:
+    """
+        Calculates the cost of a list of genes using one of the EVALUATION_BACKENDS:
+            serial: evaluate the genes one after another in this process
+            thread: evaluate the genes on a pool of worker threads
+            process: evaluate the genes on a pool of worker processes (the cost functions need to be picklable)
+        With a population cost function, the genes are split into one chunk per worker instead.
+
+        The cost function is expected to be deterministic for a given gene, which makes the results of all backends
+        identical. The state of the random module is restored after each evaluation so the evaluation does not
+        influence the random choices of the genetic algorithm either.
+
+        With a FitnessCache, cached genes are not evaluated again and identical genes are only evaluated once.
+        Failed evaluations (FailedCost) and pruned evaluations (PrunedCost) are not cached, real costs equal to the
+        failure cost are.
+
+        A prune threshold is only passed to the (single gene) cost function.
+    """
+
+    def __init__(self, cost_function=None, population_cost_function=None, backend='serial', workers=None,
+                 failure_cost=0, cache=None):
+        if backend not in EVALUATION_BACKENDS:
+            raise ValueError('Unknown evaluation backend: ' + str(backend) + '. Choose from ' + str(EVALUATION_BACKENDS))
+        self.cost_function = cost_function
+        self.population_cost_function = population_cost_function
+        self.backend = backend
+        self.workers = workers or os.cpu_count() or 1
+        self.failure_cost = failure_cost
+        self.cache = cache
+        self.executor = None
+
+    def get_executor(self):
+        if self.executor is None:
+            if self.backend == 'thread':
+                self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+            elif self.backend == 'process':
+                self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        return self.executor
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def evaluate(self, genes, threshold=None):
+        """
+            Returns the list of costs for the given list of genes
+        """
+        if self.cache is None:
+            return self.run(genes, threshold)
+
+        # Look up the genes, identical genes that are not cached are evaluated once
+        costs = [None] * len(genes)
+        pending = OrderedDict()  # key -> indices of the genes with this key
+        for index, gene in enumerate(genes):
+            key = self.cache.key(gene)
+            if key in pending:
+                self.cache.hits += 1
+                pending[key].append(index)
+                continue
+            cost = self.cache.get(key)
+            if cost is None:
+                pending[key] = [index]
+            else:
+                costs[index] = cost
+
+        if pending:
+            new_costs = self.run([genes[indices[0]] for indices in pending.values()], threshold)
+            for (key, indices), cost in zip(pending.items(), new_costs):
+                if not isinstance(cost, (FailedCost, PrunedCost)):
+                    self.cache.put(key, cost)
+                for index in indices:
+                    costs[index] = cost
+        return costs
+
+    def run(self, genes, threshold=None):
+        """
+            Evaluate all genes with the evaluation backend
+        """
+        random_state = random.getstate()
+        try:
+            if self.population_cost_function is not None:
+                return self.evaluate_population(genes)
+            if self.backend == 'serial':
+                return [evaluate_safely(self.cost_function, gene, self.failure_cost, threshold=threshold)
+                        for gene in genes]
+            return self.collect([self.submit(self.cost_function, gene, threshold=threshold) for gene in genes])
+        finally:
+            random.setstate(random_state)
+
+    def evaluate_population(self, genes):
+        if self.backend == 'serial' or self.workers == 1:
+            return evaluate_safely(self.population_cost_function, genes, self.failure_cost, population=True)
+
+        # One chunk per worker
+        chunk_size = math.ceil(len(genes) / self.workers)
+        chunks = [genes[i:i + chunk_size] for i in range(0, len(genes), chunk_size)]
+        futures = [self.submit(self.population_cost_function, chunk, population=True) for chunk in chunks]
+        costs = []
+        for chunk_costs in self.collect(futures, [len(chunk) for chunk in chunks]):
+            costs += chunk_costs
+        return costs
+
+    def submit(self, cost_function, genes, population=False, threshold=None):
+        try:
+            return self.get_executor().submit(evaluate_safely, cost_function, genes, self.failure_cost, population,
+                                              threshold)
+        except BrokenProcessPool:
+            # A worker died during an earlier evaluation, start a new pool
+            self.executor = None
+            return self.get_executor().submit(evaluate_safely, cost_function, genes, self.failure_cost, population,
+                                              threshold)
+
+    def collect(self, futures, chunk_sizes=None):
+        """
+            Wait for all futures. A worker that crashed (e.g. killed by the os) only fails its own evaluation(s)
+            chunk_sizes is given when the futures evaluate chunks of a population
+        """
+        results = []
+        broken = False
+        for index, future in enumerate(futures):
+            try:
+                results.append(future.result())
+            except BrokenProcessPool as inst:
+                broken = True
+                print('\033[91m' + "=== EVALUATION ERROR === Worker process crashed: " + repr(inst) + '\033[0m')
+                if chunk_sizes is None:
+                    results.append(FailedCost(self.failure_cost))
+                else:
+                    results.append([FailedCost(self.failure_cost)] * chunk_sizes[index])
+        if broken:
+            # The pool can not be used anymore, the next evaluation starts a new one
+            self.close()
+        return results
+
+
 class Individual:
     def __init__(self, gene, cost=0):
         self.gene = gene
@@ -132,6 +390,7 @@ class GenAlg:
 
     def __init__(self,
                  cost_function=None,
+                 population_cost_function=None,  # Optional: evaluates a list of genes at once, returns their costs
                  crossover_function=single_point_crossover,
                  pop_size=20,
                  gene_length=5,
@@ -142,8 +401,28 @@ class GenAlg:
                  value_range=[-5, 5],
                  init_near_zero=False,
                  verbose=True,
-                 plot=False):
+                 plot=False,
+                 evaluation='serial',  # Evaluation backend, see EVALUATION_BACKENDS
+                 workers=None,  # Number of worker threads/processes, defaults to the number of cpus
+                 failure_cost=0,  # Cost of an individual whose evaluation failed
+                 seed=None,
+                 fitness_cache=None,  # Optional FitnessCache, genes are not evaluated again
+                 prune_rank=None):  # Stop evaluations that can not beat the cost of the prune_rank-th best individual
+        if prune_rank is not None and population_cost_function is not None:
+            # The population cost function evaluates whole chunks and gets no threshold (see Evaluator)
+            raise ValueError('prune_rank needs a single gene cost function, population cost functions are not pruned')
+        self.fitness_cache = fitness_cache
+        self.prune_rank = prune_rank
+        if seed is not None:
+            random.seed(seed)
         self.cost_function = cost_function
+        self.population_cost_function = population_cost_function
+        self.evaluator = Evaluator(cost_function=cost_function,
+                                   population_cost_function=population_cost_function,
+                                   backend=evaluation,
+                                   workers=workers,
+                                   failure_cost=failure_cost,
+                                   cache=fitness_cache)
         GenAlg.pop_size = pop_size
         GenAlg.pop_size_current = pop_size
         self.value_range = value_range
@@ -157,30 +436,44 @@ class GenAlg:
         if self.verbose: print("GEN 0 IS BORN, SIZE: ", len(self.pop.pop))
         self.plot = plot
         self.graph = None
-        if self.plot: 
+        if self.plot:
+            # Only import matplotlib when plotting is enabled
+            from graphing import visualize_cost as vc
             self.graph = vc.Graph()
             self.graph.start_animated_plotting()
 
-        # Calculate the starting cost of the population
-        GenAlg.gen_progress = 0
-        for agent in self.pop.pop:
-            GenAlg.gen_progress += 1
-            agent.update_cost(self.cost_function)
-
-        # Sort population from lowest to highest cost
-        self.pop.pop = sorted(self.pop.pop, key=getcost)
-
-        # Print relevant information about Generation 0: [x,y], cost, and the gene with nums rounded to nearest int
-        for agent in self.pop.pop:
-            if self.verbose: print(f"COST: {agent.cost} GENE(rounded):{[int(i) for i in agent.gene]}")
-        if self.verbose: print("-----------------------------------------------")
-
-        # Run max_generations generations
-        for gen_index in range(0, max_generations):
-            GenAlg.generation_counter += 1
+        try:
+            # Calculate the starting cost of the population
             GenAlg.gen_progress = 0
-            # Reproduce, creating a new generation
-            self.reproduce(crossover_function, elite_rate)
+            self.evaluate(self.pop.pop)
+
+            # Sort population from lowest to highest cost
+            self.pop.pop = sorted(self.pop.pop, key=getcost)
+
+            # Print relevant information about Generation 0: [x,y], cost, and the gene with nums rounded to nearest int
+            for agent in self.pop.pop:
+                if self.verbose: print(f"COST: {agent.cost} GENE(rounded):{[int(i) for i in agent.gene]}")
+            if self.verbose: print("-----------------------------------------------")
+
+            # Run max_generations generations
+            for gen_index in range(0, max_generations):
+                GenAlg.generation_counter += 1
+                GenAlg.gen_progress = 0
+                # Reproduce, creating a new generation
+                self.reproduce(crossover_function, elite_rate)
+        finally:
+            self.evaluator.close()
+            if self.fitness_cache is not None:
+                self.fitness_cache.save()
+
+    def evaluate(self, individuals, threshold=None):
+        """
+            Calculate the cost of the given individuals using the evaluation backend
+        """
+        costs = self.evaluator.evaluate([individual.gene for individual in individuals], threshold)
+        for individual, cost in zip(individuals, costs):
+            individual.cost = cost
+        GenAlg.gen_progress = len(individuals)
 
     def reproduce(self, crossover_function, elite_rate):
 
@@ -192,6 +485,11 @@ class GenAlg:
         # Sort by cost, ascending
         self.pop.pop = sorted(self.pop.pop, key=getcost)
 
+        # Individuals of the new generation that can not beat the prune_rank-th best of this generation are pruned
+        threshold = None
+        if self.prune_rank is not None and len(self.pop.pop) >= self.prune_rank:
+            threshold = self.pop.pop[self.prune_rank - 1].cost
+
         # Create a new generation by crossing over and mutating the previous
         new_generation = []
         for i in range(0, parent_individuals-1):
@@ -211,21 +509,18 @@ class GenAlg:
         if self.verbose: print(f"GEN {GenAlg.generation_counter} IS BORN, SIZE: {len(new_generation)}")
 
         # Elitism: Keep the top individuals.
+        genes = set(tuple(individual.gene) for individual in new_generation)
         for i in range(0, elite_individuals):
             # If new_generation does not contain an individual with same gene as self.pop.pop[i]
             # Add self.pop.pop[i] to new generation
-            copy = False
-            for individual in new_generation:
-                if individual.gene == self.pop.pop[i].gene:
-                    copy = True
-            if not copy:
+            if tuple(self.pop.pop[i].gene) not in genes:
                 new_generation.append(self.pop.pop[i])
+                genes.add(tuple(self.pop.pop[i].gene))
 
         self.pop.pop = new_generation
 
         # Calculate the cost of individuals in the new generation
-        for individual in self.pop.pop:
-            individual.update_cost(self.cost_function)
+        self.evaluate(self.pop.pop, threshold)
 
         # Sort by cost, ascending
         self.pop.pop = sorted(self.pop.pop, key=getcost)
@@ -246,6 +541,8 @@ class GenAlg:
         if self.verbose:
             print(f"MIN COST:{min_cost} AVG COST: {avg_cost}")
             print(f"BEST GENE: {self.pop.pop[0].gene}")
+            if self.fitness_cache is not None:
+                print(self.fitness_cache.stats())
             print(f"END GEN {GenAlg.generation_counter}-----------------------------------------------")
 
         if self.plot:
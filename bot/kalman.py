@@ -3,6 +3,123 @@ import numpy as np
 
 __author__ = "Olve Drageset, Andre Gramlich"
 
+# Q is the covariance for the sensor error, R is for the odometry error
+SENSOR_NOISE = np.diag([.01, .01, .01])
+ODOMETRY_NOISE = np.diag([.05, .05, .05])
+
+# Flat (row * 3 + column) indices of the 2x2 minors of a 3x3 matrix:
+# cofactor[i, j] = a[i+1, j+1] * a[i+2, j+2] - a[i+1, j+2] * a[i+2, j+1] (indices modulo 3)
+_ROWS = np.arange(3)[:, None]
+_COLUMNS = np.arange(3)[None, :]
+_MINOR_INDICES = np.array([((_ROWS + r) % 3) * 3 + (_COLUMNS + c) % 3 for r, c in ((1, 1), (2, 2), (1, 2), (2, 1))])
+
+
+class KalmanFilter:
+    """
+        Kalman filter of a robot pose (x, y, theta) or of a batch of poses
+
+        The motion and sensor models are the identity (A = B = C = I), so a step is
+            prediction: mu = mu + u, sigma = sigma + R
+            correction: K = sigma (sigma + Q)^-1, mu = mu + K (z - mu), sigma = sigma - K sigma
+        The 3x3 inverse is computed in closed form (adjugate / determinant) and every step works in place on
+        preallocated arrays, so a step does not allocate.
+
+        mu: (3,) pose or (M, 3) poses of M robots
+        sigma: (3, 3) or (M, 3, 3) covariance matrices, zeros by default
+    """
+
+    def __init__(self, mu=(0, 0, 0), sigma=None, sensor_noise=SENSOR_NOISE, odometry_noise=ODOMETRY_NOISE):
+        self.mu = np.array(mu, dtype=float)
+        shape = self.mu.shape[:-1]
+        self.sigma = np.zeros(shape + (3, 3))
+        if sigma is not None:
+            self.sigma[...] = sigma
+        self.sensor_noise = np.broadcast_to(np.asarray(sensor_noise, dtype=float), shape + (3, 3))
+        self.odometry_noise = np.broadcast_to(np.asarray(odometry_noise, dtype=float), shape + (3, 3))
+
+        # Work arrays and views on them (creating a view also costs a NumPy call)
+        self._angle = self.mu[..., 2]
+        self._innovation_covariance = np.empty(shape + (3, 3))
+        self._flat_covariance = self._innovation_covariance.reshape(shape + (9,))
+        self._first_row = self._innovation_covariance[..., :1, :]
+        self._minors = np.empty(shape + (4, 3, 3))
+        self._products = [self._minors[..., 0, :, :], self._minors[..., 1, :, :],
+                          self._minors[..., 2, :, :], self._minors[..., 3, :, :]]
+        self._cofactors = np.empty(shape + (3, 3))
+        self._adjugate = self._cofactors.swapaxes(-1, -2)
+        self._first_cofactors = self._adjugate[..., :, :1]
+        self._determinant = np.empty(shape + (1, 1))
+        self._gain = np.empty(shape + (3, 3))
+        self._product = np.empty(shape + (3, 3))
+        self._innovation = np.empty(shape + (3, 1))
+        self._innovation_vector = self._innovation[..., 0]
+        self._innovation_angle = self._innovation[..., 2, 0]
+        self._correction = np.empty(shape + (3, 1))
+        self._correction_vector = self._correction[..., 0]
+
+    def __reduce__(self):
+        # The work arrays are views on each other, rebuild them instead of unpickling copies
+        return KalmanFilter, (self.mu, self.sigma, self.sensor_noise, self.odometry_noise)
+
+    def reset(self, mu=(0, 0, 0), sigma=0):
+        """
+            Set the pose(s) and covariance(s) in place (the arrays of the filter keep their identity)
+        """
+        self.mu[...] = mu
+        self.sigma[...] = sigma
+
+    def predict(self, u):
+        """
+            Move the pose(s) by the change in pose u = [delta_x, delta_y, delta_theta] according to our knowledge of
+            our wheels and increase the covariance by the odometry error
+        """
+        np.add(self.mu, u, out=self.mu)
+        np.remainder(self._angle, 360, out=self._angle)
+        np.add(self.sigma, self.odometry_noise, out=self.sigma)
+
+    def correct(self, z, sensor_noise=None):
+        """
+            Correct the pose(s) with the pose(s) z as predicted by the sensor data
+            sensor_noise overrides the sensor covariance of this correction
+        """
+        if sensor_noise is None:
+            sensor_noise = self.sensor_noise
+        covariance = self._innovation_covariance
+        np.add(self.sigma, sensor_noise, out=covariance)
+
+        # (sigma + Q)^-1 = adjugate / determinant, the adjugate is the transposed cofactor matrix
+        np.take(self._flat_covariance, _MINOR_INDICES, axis=-1, out=self._minors)
+        first, second, third, fourth = self._products
+        np.multiply(first, second, out=self._cofactors)
+        np.multiply(third, fourth, out=third)
+        np.subtract(self._cofactors, third, out=self._cofactors)
+        np.matmul(self._first_row, self._first_cofactors, out=self._determinant)
+
+        # K = sigma adjugate / determinant
+        np.matmul(self.sigma, self._adjugate, out=self._gain)
+        np.divide(self._gain, self._determinant, out=self._gain)
+
+        np.subtract(z, self.mu, out=self._innovation_vector)
+        # The angle difference is wrapped to [-180, 180)
+        np.add(self._innovation_angle, 180, out=self._innovation_angle)
+        np.remainder(self._innovation_angle, 360, out=self._innovation_angle)
+        np.subtract(self._innovation_angle, 180, out=self._innovation_angle)
+        np.matmul(self._gain, self._innovation, out=self._correction)
+        np.add(self.mu, self._correction_vector, out=self.mu)
+        np.remainder(self._angle, 360, out=self._angle)
+
+        np.matmul(self._gain, self.sigma, out=self._product)
+        np.subtract(self.sigma, self._product, out=self.sigma)
+
+    def step(self, u, z, sensor_noise=None):
+        """
+            Prediction with the control input u followed by the correction with the sensor data z
+            Returns the new pose(s) and covariance(s) (the arrays of the filter, they are updated in place)
+        """
+        self.predict(u)
+        self.correct(z, sensor_noise)
+        return self.mu, self.sigma
+
 
 def kalman_filter(mu_t_minus_1, sigma_t_minus_1, u_t, z_t):
     """
@@ -13,40 +130,8 @@ def kalman_filter(mu_t_minus_1, sigma_t_minus_1, u_t, z_t):
         sigma_t_minus_1 is the covariance matrix from the previous frame
         u_t is the change in position [delta_x, delta_y, delta_theta] since t-1 according to our knowledge of our wheels
         z_t is the position as predicted by the sensor data
-    """
 
-    # A_t is the Identity matrix because we have 0 change in position depending on our previous position
-    # B_t is the Identity matrix because our input u_t is already the delta in position due to control
-    # C_t is the Identity matrix because we want to make it simple
-    A_t = B_t = C_t = np.array([[1, 0, 0],
-                                [0, 1, 0],
-                                [0, 0, 1]])
-
-    C_t_transpose = np.transpose(C_t)
-
-    # Q_t is the covariance for the sensor error, R_t is for the odometry error
-    Q_t = np.array([[.01, 0, 0],
-                    [0, .01, 0],
-                    [0, 0, .01]])
-    R_t = np.array([[.05, 0, 0],
-                    [0, .05, 0],
-                    [0, 0, .05]])
-
-    # PREDICTION
-    # Set our predicted position according to our old position, velocity, and estimated change due to control
-    mu_bar_t = np.matmul(A_t, mu_t_minus_1) + np.matmul(B_t, u_t)
-    mu_bar_t[2] = mu_bar_t[2] % 360
-    # Increase our covariance based on our estimated error in u_t
-    sigma_bar_t = np.matmul(np.matmul(A_t, sigma_t_minus_1), np.transpose(A_t)) + R_t
-
-    # CORRECTION
-    K_t = np.matmul(
-        np.matmul(sigma_bar_t, C_t_transpose),
-        np.linalg.inv(np.matmul(np.matmul(C_t, sigma_bar_t), C_t_transpose) + Q_t))
-    # Correct our predicted position due to our sensor observation
-    mu_t = mu_bar_t + np.matmul(K_t, z_t - np.matmul(C_t, mu_bar_t))
-    mu_t[2] = mu_t[2] % 360
-    # Correct our covariance matrix (decrease covariance) due to the sensor data
-    sigma_t = np.matmul(np.identity(3) - np.matmul(K_t, C_t), sigma_bar_t)
-
-    return mu_t, sigma_t  # Prediction of pose at time t, covariance at time t
+        Batches of poses ((M, 3) and (M, 3, 3)) are filtered at once. Use a KalmanFilter to filter a sequence of
+        steps without allocating new arrays every step.
+    """
+    return KalmanFilter(mu_t_minus_1, sigma_t_minus_1).step(u_t, z_t)
@@ -1,5 +1,6 @@
 ''' KINEMATICS MODULE '''
 import math
+import numpy as np
 
 __author__ = 'Steffen Schneider'
 
@@ -95,3 +96,35 @@ def bot_calc_coordinate(pos_x, pos_y, angle, vel_l, vel_r, delta_t=1, wheel_dist
         angle_new = (angle + math.degrees(rr)) % 360
 
         return x_new, y_new, angle_new
+
+
+def bot_calc_coordinates(pos_x, pos_y, angle, vel_l, vel_r, delta_t=1, wheel_dist=1):
+    """
+    vectorized version of bot_calc_coordinate
+    - all pose and velocity arguments are arrays of the same shape (one entry per robot)
+    - returns the arrays (x, y, orientation)
+    """
+
+    rad = np.radians(angle)
+    straight = vel_l == vel_r
+
+    # velocities are equal (angle doesn't change): move along the heading
+    t_vel = total_velocity(vel_l, vel_r) * delta_t
+    x_straight = np.cos(rad) * t_vel + pos_x
+    y_straight = np.sin(rad) * t_vel + pos_y
+
+    # velocities are different (angle will change): rotate around the ICC
+    vel_diff = np.where(straight, 1, vel_r - vel_l)
+    icc_dist = (wheel_dist / 2) * (vel_r + vel_l) / vel_diff
+    x_icc = pos_x - icc_dist * np.sin(rad)
+    y_icc = pos_y + icc_dist * np.cos(rad)
+    rr = rotation_rate_by_velocities(vel_l, vel_r, wheel_dist) * delta_t
+    x_tmp = pos_x - x_icc
+    y_tmp = pos_y - y_icc
+    x_curve = (x_tmp * np.cos(rr)) + (y_tmp * -np.sin(rr)) + x_icc
+    y_curve = (x_tmp * np.sin(rr)) + (y_tmp * np.cos(rr)) + y_icc
+    angle_curve = (angle + np.degrees(rr)) % 360
+
+    return (np.where(straight, x_straight, x_curve),
+            np.where(straight, y_straight, y_curve),
+            np.where(straight, angle, angle_curve))
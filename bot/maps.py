@@ -0,0 +1,225 @@
+""" MAPS MODULE """
+import hashlib
+import json
+import os
+import numpy as np
+from bot import beacon as bc
+from bot import spatial as spatial
+
+__author__ = 'Steffen Schneider, Camiel Kerkhofs'
+
+MAPS_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'maps')
+CACHE_DIRECTORY = os.path.join(MAPS_DIRECTORY, '.cache')
+DEFAULT_MAP = 'default'
+CACHE_VERSION = 3  # Increase when the compiled arrays change, old cache files are ignored
+
+# Compiled maps and ray tables of this process by map path (see load_map and load_ray_table)
+_maps = {}
+_ray_tables = {}
+
+
+class CompiledMap:
+    """
+        Immutable map with everything the simulation needs precomputed
+
+        A map file is a json file with a list of walls (each wall is 2 points: [[x1, y1], [x2, y2]]) and a list of
+        beacons ([x, y]). Compiling the map gives read-only arrays:
+            - endpoints: (4, n_walls) struct-of-arrays wall endpoints x1, y1, x2, y2
+            - segments: (n_walls, 4) view on the endpoints with one wall per row (see trigonometry.as_segments)
+            - directions: (n_walls, 2) vectors from the first to the second point of each wall
+            - lengths: (n_walls,) wall lengths
+            - normals: (n_walls, 2) unit normals of the walls
+            - beacons: (n_beacons, 2) beacon positions
+            - index: spatial.WallGrid over the walls, the ray casts, sweeps and fields use the directions, lengths and
+              normals above through it
+            - visibility: spatial.VisibilityGrid of the beacons (which beacons can be seen from where)
+            - distance_field: spatial.DistanceField, distance to the closest wall (robot contacts, sphere tracing)
+
+        A compiled map can be shared by any number of environments (and is pickled to worker processes as arrays).
+    """
+
+    def __init__(self, name, walls, beacons, index_state=None, path=None, visibility_state=None, field_state=None):
+        endpoints = np.ascontiguousarray(np.asarray(walls, dtype=float).reshape(-1, 4).T)
+        x1, y1, x2, y2 = endpoints
+        directions = np.stack((x2 - x1, y2 - y1), axis=1)
+        lengths = np.sqrt((directions ** 2).sum(axis=1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normals = np.stack((-directions[:, 1], directions[:, 0]), axis=1) / lengths[:, None]
+
+        arrays = {
+            'endpoints': endpoints,
+            'segments': endpoints.T,
+            'directions': directions,
+            'lengths': lengths,
+            'normals': np.nan_to_num(normals),
+            'beacons': np.asarray(beacons, dtype=float).reshape(-1, 2),
+        }
+        for key, array in arrays.items():
+            array.flags.writeable = False
+            object.__setattr__(self, key, array)
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'path', path)
+
+        index = spatial.WallGrid(self.segments, state=index_state, directions=self.directions, lengths=self.lengths,
+                                 normals=self.normals)
+        for array in index.state().values():
+            array.flags.writeable = False
+        object.__setattr__(self, 'index', index)
+
+        visibility = spatial.VisibilityGrid(index, self.beacons, state=visibility_state)
+        for array in visibility.state().values():
+            array.flags.writeable = False
+        object.__setattr__(self, 'visibility', visibility)
+
+        distance_field = spatial.DistanceField(index, state=field_state)
+        for array in distance_field.state().values():
+            array.flags.writeable = False
+        object.__setattr__(self, 'distance_field', distance_field)
+
+    def __setattr__(self, key, value):
+        raise AttributeError('CompiledMap is immutable')
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def __reduce__(self):
+        # Worker processes rebuild the read-only arrays instead of unpickling writeable copies
+        return CompiledMap, (self.name, self.segments, self.beacons, self.index.state(), self.path,
+                             self.visibility.state(), self.distance_field.state())
+
+    @property
+    def walls(self):
+        """
+            The walls as a list of point pairs [(x1, y1), (x2, y2)]
+        """
+        return [[(x1, y1), (x2, y2)] for x1, y1, x2, y2 in self.segments.tolist()]
+
+    def create_beacons(self):
+        """
+            Returns new Beacon objects for the beacons of the map (beacons carry the measurements of a robot)
+        """
+        return [bc.Beacon(x, y) for x, y in self.beacons.tolist()]
+
+    def save(self, path):
+        """
+            Save the compiled map as a binary (.npz) file
+        """
+        np.savez(path, version=CACHE_VERSION, name=self.name, endpoints=self.endpoints, beacons=self.beacons,
+                 **{'index_' + key: value for key, value in self.index.state().items()},
+                 **{'visibility_' + key: value for key, value in self.visibility.state().items()},
+                 **{'field_' + key: value for key, value in self.distance_field.state().items()})
+
+    @classmethod
+    def load(cls, path, source=None):
+        """
+            Load a compiled map that was saved with save()
+        """
+        with np.load(path) as data:
+            if int(data['version']) != CACHE_VERSION:
+                raise ValueError('Compiled map ' + path + ' has an old version')
+            state = {key[len('index_'):]: data[key] for key in data.files if key.startswith('index_')}
+            visibility_state = {key[len('visibility_'):]: data[key] for key in data.files
+                                if key.startswith('visibility_')}
+            field_state = {key[len('field_'):]: data[key] for key in data.files if key.startswith('field_')}
+            return cls(str(data['name']), data['endpoints'].T, data['beacons'], index_state=state, path=source,
+                       visibility_state=visibility_state, field_state=field_state)
+
+
+def map_path(name):
+    """
+        Returns the path of a map given its name (a file in the maps/ directory) or a path to a map file
+    """
+    if os.path.exists(name):
+        return os.path.abspath(name)
+    return os.path.join(MAPS_DIRECTORY, name + '.json')
+
+
+def cache_path(path):
+    """
+        Returns the path (without extension) of the cache files of a map file, keyed by the content of the file
+    """
+    with open(path, 'rb') as file:
+        digest = hashlib.sha1(file.read()).hexdigest()[:16]
+    return os.path.join(CACHE_DIRECTORY, os.path.splitext(os.path.basename(path))[0] + '-' + digest)
+
+
+def compile_map(path):
+    """
+        Compile a json map file
+    """
+    with open(path, 'r') as file:
+        data = json.load(file)
+    name = data.get('name', os.path.splitext(os.path.basename(path))[0])
+    return CompiledMap(name, data['walls'], data.get('beacons', []), path=path)
+
+
+def load_map(name=DEFAULT_MAP, cache=True):
+    """
+        Returns the compiled map with the given name or path
+
+        Compiled maps are kept in memory for the lifetime of the process and cached on disk in maps/.cache
+        The disk cache is keyed by the content of the map file, so edited maps are compiled again.
+    """
+    path = map_path(name)
+    if cache and path in _maps:
+        return _maps[path]
+
+    cache_file = cache_path(path) + '.npz'
+
+    compiled = None
+    if cache and os.path.exists(cache_file):
+        try:
+            compiled = CompiledMap.load(cache_file, source=path)
+        except (OSError, ValueError, KeyError) as inst:
+            print('Ignoring compiled map ' + cache_file + ': ' + str(inst))
+    if compiled is None:
+        compiled = compile_map(path)
+        if cache:
+            try:
+                os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+                # Write to a temporary file first, concurrent workers never see a partial cache file
+                temporary = cache_file + '.' + str(os.getpid()) + '.tmp.npz'
+                compiled.save(temporary)
+                os.replace(temporary, cache_file)
+            except OSError as inst:
+                print('Could not cache compiled map ' + cache_file + ': ' + str(inst))
+
+    if cache:
+        _maps[path] = compiled
+    return compiled
+
+
+def load_ray_table(name=DEFAULT_MAP, length=500, resolution=spatial.RAY_TABLE_RESOLUTION,
+                   angle_resolution=spatial.RAY_TABLE_ANGLE_RESOLUTION, tolerance=0.001):
+    """
+        Returns the spatial.RayTable of a map (approximate sensor distances, see spatial.RayTable)
+        The distance field of the map tells the robots where to test collisions with the exact ray caster.
+
+        Tables are built once and saved in maps/.cache next to the compiled map. They are memory-mapped, so all
+        environments and worker processes that use the same table share one copy.
+    """
+    path = map_path(name)
+    key = (path, length, resolution, angle_resolution, tolerance)
+    if key in _ray_tables:
+        return _ray_tables[key]
+
+    compiled = load_map(name)
+    table_file = cache_path(path) + '-rays-{:g}-{:g}-{:g}-{:g}.npy'.format(length, resolution, angle_resolution,
+                                                                             tolerance)
+    table = None
+    if os.path.exists(table_file + '.json'):
+        try:
+            table = spatial.RayTable.load(compiled.index, table_file, compiled.distance_field)
+        except (OSError, ValueError, KeyError) as inst:
+            print('Ignoring ray table ' + table_file + ': ' + str(inst))
+    if table is None:
+        os.makedirs(CACHE_DIRECTORY, exist_ok=True)
+        # Build into a temporary file first, concurrent workers never see a partial table
+        temporary = table_file + '.' + str(os.getpid()) + '.tmp.npy'
+        spatial.RayTable.build(compiled.index, length, resolution, angle_resolution, tolerance, temporary)
+        os.replace(temporary, table_file)
+        os.replace(temporary + '.json', table_file + '.json')
+        table = spatial.RayTable.load(compiled.index, table_file, compiled.distance_field)
+
+    _ray_tables[key] = table
+    return table
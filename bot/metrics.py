@@ -0,0 +1,100 @@
+""" METRICS MODULE """
+import math
+import numpy as np
+
+__author__ = 'Steffen Schneider'
+
+HISTORY_LENGTH = 1000  # Number of the latest errors kept per channel (plotted when the simulation is paused)
+CHANNELS = ('kalman', 'odometry', 'beacon')
+
+
+class RunningStatistics:
+    """
+        Running mean, variance and maximum of a stream of (x, y, angle) values
+        Every value is added in O(1) (Welford's algorithm), no values are kept.
+        The values are plain floats: for 3 values per update the overhead of numpy calls is larger than the work.
+    """
+
+    def __init__(self, n_values=3):
+        self.count = 0
+        self.mean = [0.0] * n_values
+        self.m2 = [0.0] * n_values  # Sum of the squared differences from the mean
+        self.max = [-math.inf] * n_values
+
+    def add(self, values):
+        self.count += 1
+        count = self.count
+        mean, m2, maximum = self.mean, self.m2, self.max
+        for index, value in enumerate(values):
+            delta = value - mean[index]
+            mean[index] += delta / count
+            m2[index] += delta * (value - mean[index])
+            if value > maximum[index]:
+                maximum[index] = value
+
+    @property
+    def variance(self):
+        """
+            Population variance of every value (0 before the first value)
+        """
+        if self.count == 0:
+            return [0.0] * len(self.m2)
+        return [m2 / self.count for m2 in self.m2]
+
+    @property
+    def std(self):
+        return [math.sqrt(variance) for variance in self.variance]
+
+
+class ErrorMetrics:
+    """
+        Streaming statistics of the localization errors (absolute x, y and angle deviation from the actual pose)
+            channels: names of the error sources (kalman or particle filter, odometry, beacon triangulation)
+            history_length: number of the latest errors kept per channel for plots, older ones are overwritten
+
+        Every channel has its RunningStatistics over the whole simulation and a ring buffer of the latest errors.
+    """
+
+    def __init__(self, channels=CHANNELS, history_length=HISTORY_LENGTH):
+        self.channels = channels
+        self.history_length = history_length
+        self.reset()
+
+    def reset(self):
+        self.statistics = {channel: RunningStatistics() for channel in self.channels}
+        self.errors = {channel: np.zeros((self.history_length, 3)) for channel in self.channels}
+        self.history_size = 0
+        self.history_index = 0
+
+    def add(self, errors):
+        """
+            Add the errors of a single update, errors: dictionary {channel: (x, y, angle)}
+        """
+        for channel, values in errors.items():
+            self.statistics[channel].add(values)
+            self.errors[channel][self.history_index] = values
+        self.history_index = (self.history_index + 1) % self.history_length
+        self.history_size = min(self.history_size + 1, self.history_length)
+
+    def history(self, channel):
+        """
+            Latest errors of a channel (oldest first), shape (n, 3)
+        """
+        errors = self.errors[channel]
+        if self.history_size < self.history_length:
+            return errors[:self.history_size]
+        return np.roll(errors, -self.history_index, axis=0)
+
+    def report(self):
+        """
+            Returns the lines of a report of the statistics so far
+        """
+        lines = []
+        for channel in self.channels:
+            statistics = self.statistics[channel]
+            mean, std, maximum = statistics.mean, statistics.std, statistics.max
+            lines.append('{} avg_xy deviation: {:.3f} (std {:.3f}, max {:.3f})'.format(
+                channel, (mean[0] + mean[1]) / 2, (std[0] + std[1]) / 2, max(maximum[0], maximum[1])))
+            lines.append('{} avg_angle deviation: {:.3f} (std {:.3f}, max {:.3f})'.format(
+                channel, mean[2], std[2], maximum[2]))
+        return lines
@@ -1,7 +1,7 @@
 ''' ODOMETRY MODULE '''
 import math
 import random
-import numpy
+import numpy as np
 
 __author__ = 'Steffen Schneider'
 
@@ -15,15 +15,19 @@ class Odometry:
 
         self.prob_func = prob_normal_dist
         self.sample_func = sample_normal_dist
+        self.prob_array_func = prob_normal_dist_array
+        self.sample_array_func = sample_normal_dist_array
 
     def set_noise_params(self, noise_parameters):
         self.np = noise_parameters
 
     def set_prob_func(self, func):
         self.prob_func = func
+        self.prob_array_func = array_function(func)
 
     def set_sample_func(self, func):
         self.sample_func = func
+        self.sample_array_func = array_function(func, sampling=True)
 
     def get_prob(self, p1, p2, ut):
 
@@ -74,6 +78,74 @@ class Odometry:
 
         return x_prime, y_prime, angle
 
+    def get_prob_array(self, p1, p2, ut):
+        """
+            Array version of get_prob
+            p1, p2: (N, 3) poses (or (3,) poses, broadcast against the other arguments)
+            ut: measured poses before and after the move, each (3,) or (N, 3)
+            Returns the (N,) probabilities of moving from p1 to p2
+        """
+        p1, p2 = np.asarray(p1, dtype=float), np.asarray(p2, dtype=float)
+        u1, u2 = np.asarray(ut[0], dtype=float), np.asarray(ut[1], dtype=float)
+
+        # Measured odometry motion components
+        d_trans = delta_trans_array(u1[..., 0], u1[..., 1], u2[..., 0], u2[..., 1])
+        d_rot1 = delta_rot1_array(u1[..., 0], u1[..., 1], u2[..., 0], u2[..., 1], np.radians(u1[..., 2]))
+        d_rot2 = np.radians(u2[..., 2]) - np.radians(u1[..., 2]) - d_rot1
+
+        # states to be evaluated
+        d_hat_trans = delta_trans_array(p1[..., 0], p1[..., 1], p2[..., 0], p2[..., 1])
+        d_hat_rot1 = delta_rot1_array(p1[..., 0], p1[..., 1], p2[..., 0], p2[..., 1], np.radians(p2[..., 2]))
+        d_hat_rot2 = np.radians(p2[..., 2]) - np.radians(p1[..., 2]) - d_hat_rot1
+
+        # compute probabilities
+        abs_rot1 = np.abs(d_hat_rot1)
+        abs_rot2 = np.abs(d_hat_rot2)
+        p_1 = self.prob_array_func(d_rot1 - d_hat_rot1, self.np[0] * abs_rot1 + self.np[1] * d_hat_trans)
+        p_2 = self.prob_array_func(d_trans - d_hat_trans,
+                                   self.np[2] * d_hat_trans + self.np[3] * (abs_rot1 + abs_rot2))
+        p_3 = self.prob_array_func(d_rot2 - d_hat_rot2, self.np[0] * abs_rot2 + self.np[1] * d_hat_trans)
+
+        return p_1 * p_2 * p_3
+
+    def sample_motion_model_array(self, ut, poses, rng=None, out=None):
+        """
+            Array version of sample_motion_model: draws one sample for each pose
+            ut: measured poses before and after the move, each (3,) or (N, 3)
+            poses: (N, 3) poses to move
+            rng: numpy.random.Generator (a new unseeded generator by default)
+            out: optional (N, 3) array for the result, may be poses itself
+            Returns an (N, 3) array of sampled poses
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        poses = np.asarray(poses, dtype=float)
+        u1, u2 = np.asarray(ut[0], dtype=float), np.asarray(ut[1], dtype=float)
+        shape = np.broadcast_shapes(poses.shape[:-1], u1.shape[:-1], u2.shape[:-1])
+
+        # Measured odometry motion components
+        d_trans = delta_trans_array(u1[..., 0], u1[..., 1], u2[..., 0], u2[..., 1])
+        d_rot1 = delta_rot1_array(u1[..., 0], u1[..., 1], u2[..., 0], u2[..., 1], np.radians(u1[..., 2]))
+        d_rot2 = np.radians(u2[..., 2]) - np.radians(u1[..., 2]) - d_rot1
+
+        # Sample
+        abs_rot1 = np.abs(d_rot1)
+        abs_rot2 = np.abs(d_rot2)
+        d_hat_rot1 = d_rot1 + self.sample_array_func(
+            np.broadcast_to(self.np[0] * abs_rot1 + self.np[1] * d_trans, shape), rng)
+        d_hat_trans = d_trans + self.sample_array_func(
+            np.broadcast_to(self.np[2] * d_trans + self.np[3] * (abs_rot1 + abs_rot2), shape), rng)
+        d_hat_rot2 = d_rot2 + self.sample_array_func(
+            np.broadcast_to(self.np[0] * abs_rot2 + self.np[1] * d_trans, shape), rng)
+
+        # calculate new positions
+        heading = np.radians(poses[..., 2]) + d_hat_rot1
+        sampled = np.empty(shape + (3,)) if out is None else out
+        sampled[..., 0] = poses[..., 0] + d_hat_trans * np.cos(heading)
+        sampled[..., 1] = poses[..., 1] + d_hat_trans * np.sin(heading)
+        sampled[..., 2] = np.degrees(heading + d_hat_rot2) % 360
+        return sampled
+
 
 ''' Helper functions '''
 
@@ -98,12 +170,21 @@ def atan2(dy, dx):
         return math.copysign(1, dy) * math.pi / 2
 
 
+def delta_trans_array(x1, y1, x2, y2):
+    return np.hypot(x2 - x1, y2 - y1)
+
+
+def delta_rot1_array(x1, y1, x2, y2, angle):
+    # note: angle should be in radians, np.arctan2 gives the same results as atan2 (including atan2(0, 0) = 0)
+    return np.arctan2(y2 - y1, x2 - x1) - angle
+
+
 ''' Probability distributions '''
 
 
 def prob_normal_dist(a, b):
     # standard deviation cant be zero, otherwise we'll encounter division by zero
-    if b == 0: b = numpy.finfo(float).eps
+    if b == 0: b = np.finfo(float).eps
 
     var = float(b) ** 2
     denom = math.sqrt(2 * math.pi * var)
@@ -113,12 +194,23 @@ def prob_normal_dist(a, b):
 
 def prob_triang_dist(a, b):
     # standard deviation cant be zero, otherwise we'll encounter division by zero
-    if b == 0: b = numpy.finfo(float).eps
+    if b == 0: b = np.finfo(float).eps
 
     tmp = (1 / (math.sqrt(6) * b)) - (math.fabs(a) / (6 * b ** 2))
     return max(0, tmp)
 
 
+def prob_normal_dist_array(a, b):
+    b = np.where(b == 0, np.finfo(float).eps, b)
+    var = b ** 2
+    return np.exp(-(a ** 2 / (2 * var))) / np.sqrt(2 * math.pi * var)
+
+
+def prob_triang_dist_array(a, b):
+    b = np.where(b == 0, np.finfo(float).eps, b)
+    return np.maximum(0, (1 / (math.sqrt(6) * b)) - (np.abs(a) / (6 * b ** 2)))
+
+
 ''' Sampling functions '''
 
 
@@ -128,3 +220,34 @@ def sample_normal_dist(b):
 
 def sample_triang_dist(b):
     return math.sqrt(6) * .5 * (random.uniform(-b, b) + random.uniform(-b, b))
+
+
+def sample_normal_dist_array(b, rng):
+    # Exact normal samples instead of the sum of 12 uniform samples
+    return rng.normal(0, b)
+
+
+def sample_triang_dist_array(b, rng):
+    return math.sqrt(6) * .5 * (rng.uniform(-b, b) + rng.uniform(-b, b))
+
+
+# Array versions of the probability and sampling functions (see Odometry.get_prob_array)
+ARRAY_FUNCTIONS = {
+    prob_normal_dist: prob_normal_dist_array,
+    prob_triang_dist: prob_triang_dist_array,
+    sample_normal_dist: sample_normal_dist_array,
+    sample_triang_dist: sample_triang_dist_array,
+}
+
+
+def array_function(func, sampling=False):
+    """
+        Returns the array version of a probability or sampling function
+        Other functions are applied element by element (sampling functions then use the random module)
+    """
+    if func in ARRAY_FUNCTIONS:
+        return ARRAY_FUNCTIONS[func]
+    vectorized = np.vectorize(func, otypes=[float])
+    if sampling:
+        return lambda b, rng: vectorized(b)
+    return vectorized
@@ -0,0 +1,155 @@
+""" Particle Filter """
+import numpy as np
+from bot import odometry as od
+
+__author__ = "Olve Drageset, Andre Gramlich"
+
+DEFAULT_PARTICLES = 1000
+RANGE_NOISE = 0.1  # Standard deviation of a beacon distance measurement relative to the distance (see Robot)
+BEARING_NOISE = 5  # Standard deviation (degrees) of a beacon bearing in the measurement model
+RESAMPLE_THRESHOLD = 0.5  # Resample when the effective number of particles drops below this fraction
+INJECTION = 0.05  # Fraction of the particles that is drawn from the beacon measurements every step
+
+
+class ParticleFilter:
+    """
+        Monte Carlo localization of a robot pose (x, y, theta)
+
+        Every step the particles are moved with the odometry motion model (Odometry.sample_motion_model_array) and
+        weighted with the range and bearing likelihoods of the connected beacons. When the effective number of
+        particles gets low, the particles are resampled with low variance (systematic) resampling.
+        All operations are vectorized over the particles, resampling works on preallocated buffers.
+
+        The odometry does not know about wall collisions, so the particles can lose the robot. Every step a small
+        fraction of the particles is replaced with poses drawn from the measurement of the closest beacon (sensor
+        resetting), the other beacons weight them.
+
+        The pose estimate is the weighted mean of the particles (circular mean for the angle).
+    """
+
+    def __init__(self, n_particles=DEFAULT_PARTICLES, odometry=None, pose=(0, 0, 0), spread=(0, 0, 0),
+                 range_noise=RANGE_NOISE, bearing_noise=BEARING_NOISE, resample_threshold=RESAMPLE_THRESHOLD,
+                 injection=INJECTION, seed=None):
+        self.n_particles = n_particles
+        self.odometry = odometry if odometry is not None else od.Odometry()
+        self.range_noise = range_noise
+        self.bearing_noise = bearing_noise
+        self.resample_threshold = resample_threshold
+        self.n_injected = int(injection * n_particles)
+        self.rng = np.random.default_rng(seed)
+
+        self.particles = np.empty((n_particles, 3))
+        self.weights = np.empty(n_particles)
+
+        # Buffers
+        self._resampled = np.empty((n_particles, 3))
+        self._cumulative = np.empty(n_particles)
+        self._offsets = np.arange(n_particles) / n_particles
+        self._positions = np.empty(n_particles)
+        self._log_weights = np.empty(n_particles)
+
+        self.reset(pose, spread)
+
+    def reset(self, pose=(0, 0, 0), spread=(0, 0, 0)):
+        """
+            Spread the particles around a pose (normal distribution with standard deviations spread)
+            and give them equal weights
+        """
+        self.particles[:] = self.rng.normal(pose, spread, (self.n_particles, 3))
+        self.particles[:, 2] %= 360
+        self.weights.fill(1 / self.n_particles)
+
+    def predict(self, ut):
+        """
+            Move all particles with the odometry motion model
+            ut: odometry poses before and after the move [(x, y, theta), (x, y, theta)]
+        """
+        self.odometry.sample_motion_model_array(ut, self.particles, self.rng, out=self.particles)
+
+    def inject(self, beacons):
+        """
+            Replace random particles with poses that match the distance and bearing of the closest beacon
+            Only done with at least 2 beacons, a single beacon can not tell the injected poses apart
+        """
+        if self.n_injected == 0 or len(beacons) < 2:
+            return
+        closest = min(beacons, key=lambda beacon: beacon.distance)
+        indices = self.rng.choice(self.n_particles, self.n_injected, replace=False)
+
+        # Any heading is possible, the beacon is seen at angle + bearing from the robot
+        angles = self.rng.uniform(0, 360, self.n_injected)
+        distances = self.rng.normal(closest.distance, max(self.range_noise * closest.distance, 1), self.n_injected)
+        directions = np.radians(angles + self.rng.normal(closest.bearing, self.bearing_noise, self.n_injected))
+        self.particles[indices, 0] = closest.x - distances * np.cos(directions)
+        self.particles[indices, 1] = closest.y - distances * np.sin(directions)
+        self.particles[indices, 2] = angles
+        self.weights[indices] = 1 / self.n_particles
+        self.weights /= self.weights.sum()
+
+    def update(self, beacons):
+        """
+            Weight the particles with the likelihood of the beacon measurements
+            beacons: Beacon objects with a measured distance and bearing (relative to the robot angle)
+        """
+        if len(beacons) == 0:
+            return
+        measured = np.array([(beacon.x, beacon.y, beacon.distance, beacon.bearing) for beacon in beacons])
+        beacon_x, beacon_y, distance, bearing = (column[:, None] for column in measured.T)
+
+        # Expected distance and bearing of every beacon (rows) from every particle (columns)
+        dx = beacon_x - self.particles[:, 0]
+        dy = beacon_y - self.particles[:, 1]
+        expected_distance = np.hypot(dx, dy)
+        expected_bearing = np.degrees(np.arctan2(dy, dx)) - self.particles[:, 2]
+
+        range_sd = np.maximum(self.range_noise * distance, 1)
+        range_error = (distance - expected_distance) / range_sd
+        bearing_error = ((bearing - expected_bearing + 180) % 360 - 180) / self.bearing_noise
+
+        # Log weights avoid underflow when many beacons are visible
+        log_weights = self._log_weights
+        with np.errstate(divide='ignore'):
+            np.log(self.weights, out=log_weights)
+        log_weights -= 0.5 * ((range_error ** 2).sum(axis=0) + (bearing_error ** 2).sum(axis=0))
+        log_weights -= log_weights.max()
+        np.exp(log_weights, out=self.weights)
+        self.weights /= self.weights.sum()
+
+    def effective_particles(self):
+        """
+            Returns the effective number of particles 1 / sum(w^2)
+        """
+        return 1 / np.dot(self.weights, self.weights)
+
+    def resample(self):
+        """
+            Low variance resampling: one random offset, n_particles evenly spaced positions in the cumulative weights
+        """
+        np.cumsum(self.weights, out=self._cumulative)
+        self._cumulative[-1] = 1  # Rounding errors could leave the last positions without a particle
+        np.add(self._offsets, self.rng.uniform(0, 1 / self.n_particles), out=self._positions)
+        indices = np.searchsorted(self._cumulative, self._positions, side='right')
+        np.take(self.particles, indices, axis=0, out=self._resampled)
+        self.particles, self._resampled = self._resampled, self.particles
+        self.weights.fill(1 / self.n_particles)
+
+    def estimate(self):
+        """
+            Returns the weighted mean pose (x, y, theta) of the particles
+        """
+        x, y = np.dot(self.weights, self.particles[:, :2])
+        angles = np.radians(self.particles[:, 2])
+        angle = np.degrees(np.arctan2(np.dot(self.weights, np.sin(angles)), np.dot(self.weights, np.cos(angles))))
+        return x, y, angle % 360
+
+    def step(self, ut, beacons):
+        """
+            Predict with the odometry ut, inject particles, weight with the beacon measurements and resample if needed
+            Returns the estimated pose
+        """
+        self.predict(ut)
+        self.inject(beacons)
+        self.update(beacons)
+        if self.effective_particles() < self.resample_threshold * self.n_particles:
+            self.resample()
+        return self.estimate()
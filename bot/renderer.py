@@ -0,0 +1,249 @@
+""" RENDERER MODULE """
+import threading
+import time
+import numpy as np
+from bot import trigonometry as tri
+
+__author__ = 'Camiel Kerkhofs'
+
+# pygame is only imported when a Renderer is created, headless simulations never load it
+pygame = None
+BLACK = (0, 0, 0)
+GRAY = (244, 245, 247)
+WHITE = (255, 255, 255)
+BLUE = (66, 134, 244)
+RED = (226, 123, 120)
+GREEN = (34, 139, 34)
+ORANGE = (255, 165, 0)
+TRANSPARENT = (255, 0, 255)  # Color key of the static layer
+
+MAX_RENDER_FPS = 60  # Frame rate cap of the render thread
+DRAW_KALMAN_HISTORY = True
+HISTORY_LENGTH = 10  # Number of drawn estimates of the Kalman (or particle) filter
+DEBUG_POSITION = (830, 50)  # Position of the first line of debug output
+DEBUG_LINE_HEIGHT = 18
+LEGEND_POSITION = (830, 550)
+
+
+class Frame:
+    """
+        Snapshot of the simulation state that is drawn (see Environment.capture and Environment.draw)
+    """
+
+    def __init__(self, grid_shape):
+        self.grid = np.zeros(grid_shape)  # Dirt grid
+        self.pose = (0, 0, 0)  # Actual pose of the robot
+        self.beacon_pose = (0, 0, 0)
+        self.odometry_pose = (None, None, None)
+        self.belief_pose = (0, 0, 0)  # Kalman or particle filter estimate
+        self.particles = None  # Positions (n, 2) of the drawn particles (particle filter only)
+        self.debug = []  # Lines of debug output
+
+
+class Renderer:
+    """
+        Draws the frames of an Environment on a pygame surface, everything that does not change is drawn once
+            static layer: walls, beacons and the legend
+            background: the dirt grid with the static layer on top. Only the rectangle around the cells that changed
+                since the last frame is redrawn, from an array of the grid (pygame.surfarray) instead of a rectangle
+                per cell
+            text: every character is rendered once, the debug output is put together from these glyphs
+            history: the last HISTORY_LENGTH estimates of the filter are kept in a ring buffer
+        The moving parts (robot, estimates, particles) and the debug output are drawn on top every frame.
+    """
+
+    def __init__(self, surface, font, walls, beacons, dirt_grid, radius, filter_name='Kalman'):
+        global pygame
+        if pygame is None:
+            import pygame as pygame_module
+            pygame = pygame_module
+        self.surface = surface
+        self.font = font
+        self.radius = radius
+        self.size = self.width, self.height = surface.get_size()
+        self.glyphs = {}
+
+        # Static layer, transparent where nothing is drawn
+        self.static = pygame.Surface(self.size)
+        self.static.fill(TRANSPARENT)
+        self.static.set_colorkey(TRANSPARENT)
+        for start, end in walls:
+            pygame.draw.line(self.static, BLACK, start, end)
+        for x, y in beacons:
+            pygame.draw.circle(self.static, RED, (x, y), 5, 0)
+        legend = [(BLUE, 'Actual position', 0),
+                  (ORANGE, 'Beacon position', 7),
+                  (RED, 'Odometry position', 7),
+                  (GREEN, filter_name + ' position', 0)]
+        x, y = LEGEND_POSITION
+        for color, label, width in legend:
+            pygame.draw.circle(self.static, color, (x, y), int(radius / 2), width)
+            self.static.blit(font.render(label, False, BLACK), (x + 40, y - 15))
+            y += int(radius) + 10
+
+        # Background: dirt grid and static layer, the grid cell of every pixel row and column
+        self.background = pygame.Surface(self.size, 0, 32)
+        self.background.fill(GRAY)
+        self.background.blit(self.static, (0, 0))
+        self.colors = np.array([self.background.map_rgb(GRAY), self.background.map_rgb(WHITE)])
+        self.cleaned = np.zeros((dirt_grid.grid_size, dirt_grid.grid_size), dtype=bool)
+        self.pixel_rows = np.minimum((np.arange(self.height) / dirt_grid.tile_height).astype(int),
+                                     dirt_grid.grid_size - 1)
+        self.pixel_columns = np.minimum((np.arange(self.width) / dirt_grid.tile_width).astype(int),
+                                        dirt_grid.grid_size - 1)
+
+        # Ring buffer of the last estimates
+        self.history = np.zeros((HISTORY_LENGTH, 3))
+        self.history_size = 0
+        self.history_index = 0
+
+    def draw(self, frame):
+        """
+            Draw a Frame and update the display
+        """
+        self.update_background(frame.grid)
+        surface = self.surface
+        surface.blit(self.background, (0, 0))
+
+        # Robot
+        self.draw_pose(frame.pose, BLUE, self.radius, 0)
+
+        # Beacon triangulation output and odometry measurement
+        self.draw_pose(frame.beacon_pose, ORANGE, 15, 7)
+        if frame.odometry_pose[0] is not None:
+            self.draw_pose(frame.odometry_pose, RED, 15, 7)
+
+        # Particles
+        if frame.particles is not None:
+            for x, y in frame.particles.tolist():
+                pygame.draw.circle(surface, GREEN, (x, y), 1, 0)
+
+        # Kalman (or particle filter) output(s)
+        self.history[self.history_index] = frame.belief_pose
+        self.history_index = (self.history_index + 1) % HISTORY_LENGTH
+        self.history_size = min(self.history_size + 1, HISTORY_LENGTH)
+        # Oldest first, the newest estimate is drawn on top
+        oldest = self.history_index - self.history_size
+        for age in range(self.history_size):
+            if age == self.history_size - 1 or DRAW_KALMAN_HISTORY:
+                self.draw_pose(self.history[(oldest + age) % HISTORY_LENGTH], GREEN, 15, 7)
+
+        # Debug metrics
+        x, y = DEBUG_POSITION
+        for index, info in enumerate(frame.debug):
+            self.draw_text(info, (x, y + index * DEBUG_LINE_HEIGHT))
+
+        pygame.display.update()
+
+    def draw_pose(self, pose, color, radius, width):
+        position = (int(pose[0]), int(pose[1]))
+        pygame.draw.circle(self.surface, color, position, radius, width)
+        pygame.draw.line(self.surface, BLACK, position, tri.line_endpoint(position, pose[2], radius), 2)
+
+    def draw_text(self, text, position):
+        """
+            Draw a line of text from the cached glyphs
+        """
+        x, y = position
+        glyphs = self.glyphs
+        for character in text:
+            glyph = glyphs.get(character)
+            if glyph is None:
+                glyph = glyphs[character] = self.font.render(character, False, BLACK)
+            self.surface.blit(glyph, (x, y))
+            x += glyph.get_width()
+
+    def update_background(self, grid):
+        """
+            Redraw the rectangle of the background around the cells that were cleaned (or reset) since the last frame
+        """
+        cleaned = grid != 0
+        changed = cleaned != self.cleaned
+        if not changed.any():
+            return
+        rows = np.flatnonzero(changed.any(axis=1))
+        columns = np.flatnonzero(changed.any(axis=0))
+        self.cleaned[...] = cleaned
+
+        # Pixels of the changed cells
+        top, bottom = np.searchsorted(self.pixel_rows, (rows[0], rows[-1] + 1))
+        left, right = np.searchsorted(self.pixel_columns, (columns[0], columns[-1] + 1))
+        if top >= bottom or left >= right:
+            return
+        rectangle = pygame.Rect(left, top, right - left, bottom - top)
+        cells = cleaned[self.pixel_rows[top:bottom, None], self.pixel_columns[None, left:right]]
+        pixels = self.colors[cells.astype(np.intp)]
+        pygame.surfarray.blit_array(self.background.subsurface(rectangle), pixels.T)
+        self.background.blit(self.static, rectangle.topleft, rectangle)
+
+
+class RenderThread(threading.Thread):
+    """
+        Draws frames on a separate thread, so the simulation does not wait for the drawing
+            draw: function that draws a Frame
+            grid_shape: shape of the dirt grid of the frames
+
+        The simulation captures its state into the back buffer (publish) and the buffers are swapped, the thread
+        draws the front buffer at most max_fps times per second. While the thread draws, the simulation keeps
+        capturing into the back buffer and the newest one is swapped in after the drawing, so frames are never
+        drawn half updated and the simulation never waits for the thread. States in between two frames are skipped.
+    """
+
+    def __init__(self, draw, grid_shape, max_fps=MAX_RENDER_FPS, clock=time.monotonic):
+        super().__init__(daemon=True)
+        self.draw = draw
+        self.interval = 1 / max_fps
+        self.clock = clock
+        self.front = Frame(grid_shape)
+        self.back = Frame(grid_shape)
+        self.lock = threading.Lock()
+        self.new_frame = threading.Event()
+        self.drawing = False
+        self.stopped = False
+        self.published = -np.inf  # Time of the last captured frame
+        self.frames = 0  # Number of drawn frames
+
+    def publish(self, capture):
+        """
+            Capture a new frame with capture(frame) unless the last one is younger than the frame interval
+        """
+        now = self.clock()
+        if now - self.published < self.interval:
+            return
+        self.published = now
+        capture(self.back)
+        with self.lock:
+            if not self.drawing:
+                self.front, self.back = self.back, self.front
+                self.new_frame.set()
+
+    def run(self):
+        deadline = self.clock()
+        while True:
+            self.new_frame.wait()
+            with self.lock:
+                if self.stopped:
+                    return
+                self.new_frame.clear()
+                self.drawing = True
+                frame = self.front
+            try:
+                self.draw(frame)
+                self.frames += 1
+            finally:
+                with self.lock:
+                    self.drawing = False
+
+            # Frame rate cap
+            deadline = max(deadline + self.interval, self.clock())
+            time.sleep(max(deadline - self.clock(), 0))
+
+    def stop(self):
+        """
+            Stop the thread after the frame it is drawing (waits for it)
+        """
+        with self.lock:
+            self.stopped = True
+            self.new_frame.set()
+        if self.is_alive():
+            self.join()
@@ -4,6 +4,8 @@ from bot import trigonometry as tri
 from bot import beacon as bc
 from bot import odometry as od
 from bot import kalman as kal
+from bot import particle as pf
+from bot import spatial as spatial
 import numpy as np
 import random
 
@@ -11,10 +13,18 @@ __author__ = 'Camiel Kerkhofs, Steffen Schneider, Olve Drageset'
 
 COLLISION_TOLERANCE = 0.001
 BEACON_COLLISION_TOLERANCE = 5
+MAX_COLLISION_UPDATES = 100  # Upper bound on the number of position corrections in a single sensor update
+MAX_DELTA_T = 200  # Largest static delta_t (ms) of a simulation without continuous collision detection
+SWEEP_CHORDS = 8  # With continuous collision detection the arc of a move is swept as this many straight pieces
+LOCALIZATION_METHODS = ['kalman', 'particle']
+# Use the covariance of the beacon pose as the sensor noise of the kalman filter. The odometry noise of the filter does
+# not cover wall collisions, so with the (larger) real covariance the filter follows the odometry too long.
+KALMAN_BEACON_COVARIANCE = False
 
 
 class Robot:
-    def __init__(self):
+    def __init__(self, n_sensors=12, localization='kalman', n_particles=pf.DEFAULT_PARTICLES,
+                 continuous_collision=False):
         # Odometry
         self.odometry = od.Odometry()
 
@@ -35,21 +45,42 @@ class Robot:
 
         """
          Infrared sensors
-         For each sensor we have (A, B, C) where:
+         self.sensors is an (n_sensors, 4) array; for each sensor we have [A, B, Cx, Cy] where:
             - A is the linear distance measure between 0 and sensor_max
             - B is the transformed distance measure given by (sensor_max - A) ^ dist_transformation_factor
-            - C is the position (x,y) of the intersection
+            - Cx, Cy is the position (x,y) of the intersection
+         The sensors are spread evenly around the robot, sensor 0 points in the direction the robot is facing
         """
         self.sensor_max = 500
         self.dist_transformation_factor = 2
-        self.sensors = [(0, 0, (self.posx, self.posy))] * 12
+        self.n_sensors = n_sensors
+        self.sensor_angles = np.arange(n_sensors) * (360 / n_sensors)
+        self.sensors = np.zeros((n_sensors, 4))
+        self.sensors[:, 2:4] = (self.posx, self.posy)
         self.connected_beacons = []
         self.num_collisions = 0
         self.max_activation = self.sensor_max ** self.dist_transformation_factor
         self.beacon_dist_noise = 0.1
-        self.sigma = np.array([[0, 0, 0],
-                               [0, 0, 0],
-                               [0, 0, 0]])
+        self.beacon_covariance = None
+        self.kalman = kal.KalmanFilter((self.bel_posx, self.bel_posy, self.bel_angle))
+        self.sigma = self.kalman.sigma  # Updated in place by the filter
+
+        # Localization: 'kalman' (kalman filter of odometry and the triangulated beacon position) or
+        # 'particle' (monte carlo localization with beacon distances and bearings)
+        if localization not in LOCALIZATION_METHODS:
+            raise ValueError('Unknown localization method ' + str(localization) + ', use one of ' +
+                             str(LOCALIZATION_METHODS))
+        self.localization = localization
+
+        # Continuous collision detection: the robot is swept along the arc of each move and slides along the walls
+        # it touches (see spatial.sweep_circles), so it can not tunnel through walls with any delta_time
+        self.continuous_collision = continuous_collision
+        self._walls = None  # Last walls given to the robot and their spatial index (see wall_index)
+        self._wall_index = None
+        self.particle_filter = None
+        if localization == 'particle':
+            self.particle_filter = pf.ParticleFilter(n_particles, self.odometry,
+                                                     (self.bel_posx, self.bel_posy, self.bel_angle))
 
     def reset(self):
         self.posx = self.prev_bel_posx = self.bel_posx = self.beacon_posx = self.initial_posx
@@ -63,18 +94,21 @@ class Robot:
         self.vel_left = 0
         self.vel_right = 0
 
-        self.sensors = [(0, 0, (self.posx, self.posy))] * 12
+        self.sensors.fill(0)
+        self.sensors[:, 2:4] = (self.posx, self.posy)
         self.connected_beacons = []
         self.num_collisions = 0
 
-        self.sigma = np.array([[0, 0, 0],
-                               [0, 0, 0],
-                               [0, 0, 0]])
+        self.kalman.reset((self.bel_posx, self.bel_posy, self.bel_angle))
+        if self.particle_filter is not None:
+            self.particle_filter.reset((self.bel_posx, self.bel_posy, self.bel_angle))
 
     def set_robot_initial_position(self, x, y, angle):
         self.posx = self.prev_bel_posx = self.bel_posx = self.beacon_posx = self.initial_posx = x
         self.posy = self.prev_bel_posy = self.bel_posy = self.beacon_posy = self.initial_posy = y
         self.angle = self.prev_bel_angle = self.bel_angle = self.beacon_angle = self.initial_angle = angle
+        if self.particle_filter is not None:
+            self.particle_filter.reset((x, y, angle))
 
     def set_robot_position(self, x, y, angle):
         self.posx = x
@@ -120,14 +154,16 @@ class Robot:
         self.vel_left = left
         self.vel_right = right
 
-    def move_robot(self, delta_time, beacons, walls):
+    def move_robot(self, delta_time, beacons, walls, visibility=None, contact_free=False):
         """
             move the robot using the given delta time
+            visibility: optional spatial.VisibilityGrid of the beacons to speed up the line of sight checks
+            contact_free: the move does not touch a wall (see time_to_contact), so any delta_time is safe
             vel_right and vel_left are switched on purpose to compensate for the pygame coordinate system (y-axis is flipped, with 0,0 point being top left)
-            After the move has been processed, we also update the kalman filter
+            After the move has been processed, we also update the kalman filter (or the particle filter)
         """
 
-        if delta_time >= self.radius * 10:
+        if delta_time >= self.radius * 10 and not self.continuous_collision and not contact_free:
             # Delta_t exceeds robot radius; wall detection becomes unreliable at this point
             raise ValueError('movement delta_time of ' + str(
                 delta_time) + 'ms exceeds robot radius. This might be caused by a high time_dilation or a screen drag. (Do not drag the screen!)')
@@ -140,6 +176,8 @@ class Robot:
         # calculate new pose based on current pose, and right and left wheel velocities
         new_pose = kin.bot_calc_coordinate(
             self.posx, self.posy, self.angle, left_velocity, right_velocity, delta_time / 10, self.radius * 2)
+        if self.continuous_collision and not contact_free:
+            new_pose = self.sweep(left_velocity, right_velocity, delta_time, walls, new_pose[2])
 
         # get the change is pose
         delta_pose = (new_pose[0] - self.posx, new_pose[1] - self.posy, new_pose[2] - self.angle)
@@ -162,7 +200,7 @@ class Robot:
         self.od_posx, self.od_posy, self.od_angle = pos
 
         # Get estimated new position from beacon data
-        Z_t = self.update_beacons(beacons, walls)
+        Z_t = self.update_beacons(beacons, walls, visibility)
 
         # Mu at t-1
         mu_t_minus_1 = (self.prev_bel_posx, self.prev_bel_posy, self.prev_bel_angle)
@@ -170,8 +208,18 @@ class Robot:
         # All theta values are preprocessed in order to prevent unexpected
         # behavior when theta values are close to the 0 degree bearing
 
-        # Execute Kalman filter using odometry and beacon position
-        mu_t, self.sigma = kal.kalman_filter(mu_t_minus_1, self.sigma, U_t, Z_t)
+        if self.particle_filter is not None:
+            # Move the particles with the measured odometry and weight them with the beacon measurements
+            mu_t = self.particle_filter.step([mu_t_minus_1, (od_tmp_posx, od_tmp_posy, od_tmp_angle)],
+                                             self.connected_beacons)
+        else:
+            # Execute Kalman filter using odometry and beacon position (and covariance)
+            # Without a beacon position only the prediction is done
+            self.kalman.mu[:] = mu_t_minus_1
+            self.kalman.predict(U_t)
+            if Z_t is not None:
+                self.kalman.correct(Z_t, self.beacon_covariance if KALMAN_BEACON_COVARIANCE else None)
+            mu_t = self.kalman.mu
 
         # Update believed pos
         self.set_robot_believed_position(mu_t[0], mu_t[1], mu_t[2])
@@ -227,25 +275,61 @@ class Robot:
 
         return change_in_x, change_in_y, change_in_theta, sample_pos
 
-    def update_beacons(self, beacons, walls):
+    def sweep(self, left_velocity, right_velocity, delta_time, walls, angle):
+        """
+            Returns the pose after moving along the arc of the wheel velocities without entering the walls
+            (the heading does not depend on the walls, it is the given angle)
+        """
+        fractions = np.linspace(0, 1, SWEEP_CHORDS + 1)[:, None]
+        xs, ys, _ = kin.bot_calc_coordinates(np.array([self.posx]), np.array([self.posy]), np.array([self.angle]),
+                                             left_velocity, right_velocity, delta_time / 10 * fractions,
+                                             self.radius * 2)
+        positions, touched = spatial.sweep_circles(self.wall_index(walls), np.stack((xs, ys), axis=-1), self.radius,
+                                                   COLLISION_TOLERANCE)
+        if touched[0]:
+            self.num_collisions += 1
+        return positions[0, 0], positions[0, 1], angle
+
+    def time_to_contact(self, walls, delta_time):
+        """
+            Returns the time (ms, at most delta_time) the robot can move with its current wheel velocities before it
+            touches a wall (see spatial.arc_time_of_impact)
+        """
+        # Wheel velocities are switched like in move_robot
+        left_velocity = float(format(self.vel_right, '.5f'))
+        right_velocity = float(format(self.vel_left, '.5f'))
+        speed = kin.total_velocity(left_velocity, right_velocity)
+        rotation_rate = kin.rotation_rate_by_velocities(left_velocity, right_velocity, self.radius * 2)
+        return spatial.arc_time_of_impact(self.wall_index(walls), (self.posx, self.posy), self.angle, speed, rotation_rate,
+                                          self.radius, delta_time / 10, COLLISION_TOLERANCE) * 10
+
+    def wall_index(self, walls):
+        """
+            Returns the walls as a spatial index (see spatial.as_index)
+            The index of a plain list of walls is built once and reused while the robot gets the same list, so the
+            list must not be changed in place.
+        """
+        if walls is not self._walls:
+            self._wall_index = spatial.as_index(walls)
+            self._walls = walls
+        return self._wall_index
+
+    def update_beacons(self, beacons, walls, visibility=None):
         """
 			Update all beacon connections given a set of beacons and a set of walls
+			visibility: optional spatial.VisibilityGrid of the same beacons (same order), gives the same result
 		"""
 
         # Find beacons that are connected to the robot by a direct line of sight
+        # Walls closer than BEACON_COLLISION_TOLERANCE to a beacon do not block it
+        if visibility is not None:
+            visible = visibility.visible((self.posx, self.posy), COLLISION_TOLERANCE, BEACON_COLLISION_TOLERANCE)
+        else:
+            walls = self.wall_index(walls)
+            visible = walls.line_of_sight((self.posx, self.posy), [(beacon.x, beacon.y) for beacon in beacons],
+                                          COLLISION_TOLERANCE, BEACON_COLLISION_TOLERANCE)
         connected_beacons = []  # [beacon_x, beacon_y, distance, bearing]
-        for beacon in beacons:
-            # Check collision points for each wall
-            connected = True
-            for wall in walls:
-                intersect = tri.line_intersect(wall[0], wall[1], (self.posx, self.posy), (beacon.x, beacon.y),
-                                               COLLISION_TOLERANCE)
-                if intersect:
-                    # Determine beacon distance to intersect
-                    distance = tri.line_distance((beacon.x, beacon.y), (intersect[0], intersect[1]))
-                    if distance > BEACON_COLLISION_TOLERANCE:
-                        # print('Beacon ' + str(beacon) + ' intersects with wall ' + str(wall) + ' at point ' + str(intersect) + '. distance: ' + str(distance))
-                        connected = False
+        for beacon, connected in zip(beacons, visible):
             if connected:
                 # Get noisy distance measure from robot to beacon
                 distance_real = tri.line_distance((beacon.x, beacon.y), (self.posx, self.posy))
@@ -263,53 +347,81 @@ class Robot:
                 connected_beacons.append(bc.Beacon(beacon.x, beacon.y, distance_noisy, bearing))
         self.connected_beacons = connected_beacons
 
-        X = tri.triangulate_beacons(connected_beacons)
-        self.set_robot_beacon_position(X[0], X[1], X[2])
+        # Least squares pose (and its covariance) from the distances and bearings, None with fewer than 2 beacons
+        X, self.beacon_covariance = tri.multilaterate_beacons(connected_beacons, self.beacon_dist_noise)
+        if X is not None:
+            self.set_robot_beacon_position(X[0], X[1], X[2])
         return X
 
-    def update_sensors(self, walls):
+    def update_sensors(self, walls, field=None):
         """
-			Update all infrared sensor values given a set of bounding lines (walls)
+			Update all infrared sensor values given a set of bounding lines (walls), a spatial.WallGrid or RayTable
+			All sensor rays are cast at once and written into self.sensors
+			With a RayTable the collisions are tested with the exact rays of its WallGrid (see RayTable)
+			field: optional spatial.DistanceField, wall contacts (also between the sensor rays) are resolved with the
+			field only and the sensors are cast once at the resolved position (no repeated sensor updates)
 		"""
 
-        closest_transformed = 0
-        for index, sensor in enumerate(self.sensors):
-            # Determine current sensor endpoint
-            closest_collision = self.sensor_max
-            sensor_angle = ((360 / len(self.sensors)) * index)
-            angle = (self.angle + sensor_angle) % 360
-            sensor_end = tri.line_endpoint((self.posx, self.posy), angle, closest_collision)
-            intersect_wall = 0
-
-            # Check collision points for each wall
-            for wall in walls:
-                intersect = tri.line_intersect(wall[0], wall[1], (self.posx, self.posy), sensor_end,
-                                               COLLISION_TOLERANCE)
-
-                if intersect:
-                    # Determine distance to intersect
-                    distance = tri.line_distance((self.posx, self.posy), (intersect[0], intersect[1]))
-                    if distance < closest_collision:
-                        closest_collision = distance
-                        sensor_end = intersect
-                        intersect_wall = wall
+        walls = self.wall_index(walls)
+        distances = self.sensors[:, 0]
+        transformed = self.sensors[:, 1]
+        points = self.sensors[:, 2:4]
+
+        if field is not None:
+            # A single lookup away from the walls, the robot slides along the walls it touches
+            clearance = self.radius - COLLISION_TOLERANCE
+            if field.distance_at(self.posx, self.posy) - field.error < clearance:
+                positions, touched = field.contacts((self.posx, self.posy), self.radius, COLLISION_TOLERANCE)
+                if touched[0]:
+                    self.num_collisions += 1
+                    self.set_robot_position(positions[0, 0], positions[0, 1], self.angle)
+            angles = (self.angle + self.sensor_angles) % 360
+            walls.cast_rays((self.posx, self.posy), angles, self.sensor_max, COLLISION_TOLERANCE, distances, points)
+            np.subtract(self.sensor_max, distances, out=transformed)
+            np.power(transformed, self.dist_transformation_factor, out=transformed)
+            return transformed.max()
+
+        # A ray table only gives the sensor activations, collisions are tested with exact rays near the walls
+        table = walls if isinstance(walls, spatial.RayTable) else None
+        collision_distances, collision_points = distances, points
+
+        # Repeat the sensor update until no sensor conflicts with the (corrected) robot position
+        closest_transformed = None
+        first_collision = None
+        for _ in range(MAX_COLLISION_UPDATES):
+            angles = (self.angle + self.sensor_angles) % 360
+            walls.cast_rays((self.posx, self.posy), angles, self.sensor_max, COLLISION_TOLERANCE, distances, points)
 
             # Transform linear distance measure and update sensor value
-            transformed_distance = (self.sensor_max - closest_collision) ** self.dist_transformation_factor
-            self.sensors[index] = [closest_collision, transformed_distance, sensor_end]
-            if transformed_distance > closest_transformed:
-                closest_transformed = transformed_distance
+            np.subtract(self.sensor_max, distances, out=transformed)
+            np.power(transformed, self.dist_transformation_factor, out=transformed)
 
-            # Handle wall collisions, apply motion only parallel to wall, rest motion perpendicular to wall
-            if closest_collision < self.radius - COLLISION_TOLERANCE:
-                self.num_collisions += 1
-
-                # The robot is moved back along the angle of the current (infringing) sensor using the illegal distance
-                illegal_distance = (self.radius - closest_collision) + self.radius
-                corrected_position = tri.line_endpoint((sensor_end[0], sensor_end[1]), angle, -illegal_distance)
-                self.set_robot_position(corrected_position[0], corrected_position[1], self.angle)
-
-                # Restart sensor update to find potential sensors that might conflict with the new position
-                self.update_sensors(walls)
+            if table is not None:
+                if not table.near_walls((self.posx, self.posy), self.radius - COLLISION_TOLERANCE)[0]:
+                    break
+                collision_distances, collision_points = table.walls.cast_rays(
+                    (self.posx, self.posy), angles, self.sensor_max, COLLISION_TOLERANCE)
 
+            # Handle wall collisions, apply motion only parallel to wall, rest motion perpendicular to wall
+            colliding = collision_distances < self.radius - COLLISION_TOLERANCE
+            if not colliding.any():
+                break
+            index = colliding.argmax()
+            self.num_collisions += 1
+
+            # The closest activation is measured up to the first infringing sensor, before the position is corrected
+            if first_collision is None:
+                first_collision = index
+                closest_transformed = transformed[:index + 1].max()
+
+            # The robot is moved back along the angle of the current (infringing) sensor using the illegal distance
+            illegal_distance = (self.radius - collision_distances[index]) + self.radius
+            corrected_position = tri.line_endpoint(collision_points[index], angles[index], -illegal_distance)
+            self.set_robot_position(corrected_position[0], corrected_position[1], self.angle)
+
+        # Sensors after the first infringing sensor are measured at the corrected position
+        if first_collision is None:
+            return transformed.max()
+        if first_collision + 1 < self.n_sensors:
+            closest_transformed = max(closest_transformed, transformed[first_collision + 1:].max())
         return closest_transformed
@@ -0,0 +1,112 @@
+""" SCHEDULER MODULE """
+import time
+
+__author__ = 'Steffen Schneider'
+
+MAX_CATCH_UP = 5    # Upper bound on the number of steps run at once to catch up with the clock (the rest is dropped)
+RATE_INTERVAL = 1   # Seconds between two measurements of the updates and frames per second
+PAUSE_INTERVAL = 0.05  # Seconds a paused simulation sleeps between two checks for events
+TIME_TOLERANCE = 1e-6  # Simulation ms a step may be short (rounding errors of the clock)
+
+
+class FixedStepScheduler:
+    """
+        Fixed timestep scheduler of a simulation
+            step: simulation time (ms) of a single update
+            time_dilation: simulation ms per real ms, 0 runs the updates as fast as possible (static time mode)
+
+        The real time that passed (monotonic clock, multiplied by the time dilation) is collected in an accumulator
+        and every full step in it is one update. When the simulation falls behind, at most max_catch_up updates run
+        at once and the rest of the time is dropped (the simulation slows down instead of spiraling). Until the next
+        step is due the scheduler sleeps (a single sleep until the deadline, no polling).
+        Every update advances the simulation time by exactly one step, with or without a clock, so realtime and
+        static simulations with the same step are the same.
+    """
+
+    def __init__(self, step, time_dilation=0, max_catch_up=MAX_CATCH_UP, clock=time.monotonic, sleep=time.sleep):
+        self.step = step
+        self.time_dilation = time_dilation
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+        self.sleep = sleep
+        self.reset()
+
+    def reset(self):
+        """
+            Restart the clock, the counters and the measured rates
+        """
+        self.start = self.last = self.clock()
+        self.accumulator = 0  # Simulation time (ms) that passed but was not simulated yet
+        self.updates = 0
+        self.frames = 0
+        self.dropped = 0  # Simulation time (ms) that was dropped by the catch-up limit
+        self.updates_per_second = 0
+        self.frames_per_second = 0
+        # Updates and frames are measured separately (frames can be counted by a render thread)
+        self._update_rate = [self.start, 0]
+        self._frame_rate = [self.start, 0]
+
+    @property
+    def time(self):
+        """
+            Simulation time (ms) of the updates so far
+        """
+        return self.updates * self.step
+
+    def elapsed(self):
+        """
+            Real time (ms) since the start
+        """
+        return (self.clock() - self.start) * 1000
+
+    def due(self):
+        """
+            Returns the number of updates to run now, waits until at least one update is due
+        """
+        if self.time_dilation == 0:
+            return 1
+        self.accumulate()
+        # A sleep can end a little early (and rounding errors must not keep us waiting)
+        while self.accumulator < self.step - TIME_TOLERANCE:
+            self.sleep((self.step - self.accumulator) / (1000 * self.time_dilation))
+            self.accumulate()
+        steps = int((self.accumulator + TIME_TOLERANCE) // self.step)
+        self.accumulator -= steps * self.step
+        if steps > self.max_catch_up:
+            self.dropped += (steps - self.max_catch_up) * self.step
+            steps = self.max_catch_up
+        return steps
+
+    def accumulate(self):
+        now = self.clock()
+        self.accumulator += (now - self.last) * 1000 * self.time_dilation
+        self.last = now
+
+    def pause(self):
+        """
+            Wait while the simulation is paused, the paused time is not simulated
+        """
+        self.sleep(PAUSE_INTERVAL)
+        self.last = self.clock()
+
+    def count_update(self):
+        self.updates += 1
+        self.updates_per_second = self.measure(self._update_rate, self.updates_per_second)
+
+    def count_frame(self):
+        self.frames += 1
+        self.frames_per_second = self.measure(self._frame_rate, self.frames_per_second)
+
+    def measure(self, rate, current):
+        """
+            Count an update or frame of rate = [start of the interval, count], returns the rate per second that was
+            measured over the last RATE_INTERVAL seconds
+        """
+        rate[1] += 1
+        now = self.clock()
+        interval = now - rate[0]
+        if interval < RATE_INTERVAL:
+            return current
+        per_second = rate[1] / interval
+        rate[0], rate[1] = now, 0
+        return per_second
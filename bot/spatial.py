@@ -0,0 +1,1136 @@
+""" SPATIAL INDEX MODULE """
+import json
+import math
+import os
+import numpy as np
+from bot import trigonometry as tri
+
+__author__ = 'Steffen Schneider'
+
+INDEX_THRESHOLD = 32           # Maps with fewer walls are not indexed
+BRUTE_FORCE_PAIRS = 16000      # Queries with fewer ray/wall pairs test all walls at once (less overhead)
+WALLS_PER_CELL = 2      # Target average number of walls per grid cell when the cell size is chosen automatically
+MIN_CELL_SIZE = 16
+VISIBILITY_CELL_SIZE = 8       # Cell size of the beacon visibility grid
+VISIBILITY_MARGIN = 1.0        # Safety margin (pixels) of the conservative visibility tests
+VISIBILITY_CHUNK = 1 << 20     # Maximum number of cell/wall pairs tested at once while building a visibility grid
+TARGET_TOLERANCE = 5           # Walls closer than this to a beacon do not block it (see Robot.update_beacons)
+RAY_TABLE_RESOLUTION = 4       # Distance (pixels) between the positions of a ray distance table
+RAY_TABLE_ANGLE_RESOLUTION = 2  # Angle (degrees) between the rays of a ray distance table
+RAY_TABLE_ACCURACY_RAYS = 20000  # Number of random rays that measure the accuracy of a new ray distance table
+DISTANCE_FIELD_CELL_SIZE = 2   # Distance (pixels) between the nodes of a distance field
+DISTANCE_FIELD_MAX_DISTANCE = 128  # Distances of a distance field are capped (walls only update the nodes near them)
+MAX_SPHERE_TRACING_STEPS = 64  # Upper bound on the number of steps of a sphere traced ray
+MAX_CONTACT_UPDATES = 4        # Upper bound on the number of pushes that resolve the wall contacts of a robot
+MAX_SLIDES = 3                 # Upper bound on the number of wall contacts of a swept circle per path segment
+
+# States of a beacon in a visibility grid cell
+HIDDEN = 0
+VISIBLE = 1
+UNKNOWN = 2
+
+
+class WallGrid:
+    """
+        Uniform grid over a set of walls, built once per map
+
+        Every cell stores the indices of the walls that pass through it (compressed sparse row layout: the walls of
+        cell c are cell_walls[cell_start[c]:cell_start[c + 1]]). Ray queries walk the cells along each ray (DDA
+        traversal) and only test the walls in those cells. The cells of all rays of a query are found in one
+        vectorized pass, so the cost of a query depends on the walls near the rays instead of all walls of the map.
+
+        Maps with fewer than 'threshold' walls are not indexed. Queries with fewer than 'brute_force_pairs' ray/wall
+        pairs test all walls at once (see trigonometry.cast_rays). Both paths return the same result.
+    """
+
+    def __init__(self, walls, cell_size=None, threshold=INDEX_THRESHOLD, brute_force_pairs=BRUTE_FORCE_PAIRS,
+                 margin=1.0, state=None, directions=None, lengths=None, normals=None):
+        self.segments = tri.as_segments(walls)
+        self.n_walls = len(self.segments)
+        self.indexed = self.n_walls >= threshold
+        self.brute_force_pairs = brute_force_pairs
+
+        # Wall directions, lengths and unit normals (0 for walls without length), shared by all queries and the
+        # sweeps. A CompiledMap passes its precomputed arrays.
+        if directions is None:
+            directions = np.stack((self.segments[:, 2] - self.segments[:, 0],
+                                   self.segments[:, 3] - self.segments[:, 1]), axis=1)
+        if lengths is None:
+            lengths = np.sqrt((directions ** 2).sum(axis=1))
+        if normals is None:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                normals = np.nan_to_num(np.stack((-directions[:, 1], directions[:, 0]), axis=1) / lengths[:, None])
+        self.wall_dx = np.ascontiguousarray(directions[:, 0])
+        self.wall_dy = np.ascontiguousarray(directions[:, 1])
+        self.wall_length = lengths
+        # Unit directions of the walls
+        self.wall_ux = np.ascontiguousarray(normals[:, 1])
+        self.wall_uy = np.ascontiguousarray(-normals[:, 0])
+
+        if state is not None:
+            self.indexed = 'cell_start' in state
+            if self.indexed:
+                self.set_grid(float(state['cell_size']), state['lower'], state['shape'])
+                self.cell_start = state['cell_start']
+                self.cell_walls = state['cell_walls']
+        elif self.indexed:
+            self.build(cell_size, margin)
+
+    def __len__(self):
+        return self.n_walls
+
+    def state(self):
+        """
+            Returns the grid as a dict of arrays, WallGrid(walls, state=grid.state()) restores it without rebuilding
+        """
+        if not self.indexed:
+            return {}
+        return {'cell_size': np.array(self.cell_size), 'lower': self.lower, 'shape': self.shape,
+                'cell_start': self.cell_start, 'cell_walls': self.cell_walls}
+
+    def set_grid(self, cell_size, lower, shape):
+        self.cell_size = cell_size
+        self.lower = np.asarray(lower, dtype=float)
+        self.shape = np.asarray(shape, dtype=int)
+        self.columns, self.rows = int(self.shape[0]), int(self.shape[1])
+        self.upper = self.lower + self.shape * cell_size
+
+    def build(self, cell_size, margin):
+        """
+            Assign the walls to the grid cells
+            A wall is stored in every cell within 'margin' of the wall (covers the tolerance of the ray queries)
+        """
+        segments = self.segments
+        x_min = min(segments[:, 0].min(), segments[:, 2].min()) - margin
+        y_min = min(segments[:, 1].min(), segments[:, 3].min()) - margin
+        x_max = max(segments[:, 0].max(), segments[:, 2].max()) + margin
+        y_max = max(segments[:, 1].max(), segments[:, 3].max()) + margin
+        if cell_size is None:
+            # Roughly WALLS_PER_CELL walls per cell on average, but never smaller than the average wall
+            area = (x_max - x_min) * (y_max - y_min)
+            cell_size = max(math.sqrt(area * WALLS_PER_CELL / self.n_walls), self.wall_length.mean(), MIN_CELL_SIZE)
+        self.set_grid(cell_size, (x_min, y_min), (max(int(math.ceil((x_max - x_min) / cell_size)), 1),
+                                                  max(int(math.ceil((y_max - y_min) / cell_size)), 1)))
+
+        # Cells within the bounding box of each wall that lie close enough to the wall
+        half_diagonal = cell_size * math.sqrt(0.5) + margin
+        cells = []
+        walls = []
+        ends = self.cells_of(segments.reshape(-1, 2, 2).transpose(2, 0, 1))
+        first = ends.min(axis=2)
+        last = ends.max(axis=2)
+        for index, (x1, y1, x2, y2) in enumerate(segments):
+            j, i = np.mgrid[first[1, index]:last[1, index] + 1, first[0, index]:last[0, index] + 1]
+            j, i = j.ravel(), i.ravel()
+            center_x = x_min + (i + 0.5) * cell_size
+            center_y = y_min + (j + 0.5) * cell_size
+            near = point_segment_distance(center_x, center_y, x1, y1, x2, y2) <= half_diagonal
+            cells.append(j[near] * self.columns + i[near])
+            walls.append(np.full(np.count_nonzero(near), index))
+        cells = np.concatenate(cells)
+        walls = np.concatenate(walls)
+
+        order = np.argsort(cells, kind='stable')
+        self.cell_walls = walls[order]
+        self.cell_start = np.zeros(self.rows * self.columns + 1, dtype=int)
+        np.cumsum(np.bincount(cells, minlength=self.rows * self.columns), out=self.cell_start[1:])
+
+    def cast_rays(self, origin, angles, length, tolerance=0.001, distances=None, points=None):
+        """
+            Same as trigonometry.cast_rays, against the walls of this grid
+        """
+        if not self.indexed or np.size(angles) * self.n_walls < self.brute_force_pairs:
+            return tri.cast_rays(origin, angles, length, self.segments, tolerance, distances, points)
+
+        origin = np.asarray(origin, dtype=float)
+        rad = np.radians(angles)
+        cos = np.cos(rad)
+        sin = np.sin(rad)
+        shape = cos.shape
+        ox = np.broadcast_to(origin[..., 0, None], shape)
+        oy = np.broadcast_to(origin[..., 1, None], shape)
+        length = np.broadcast_to(length, shape)
+
+        closest = self.closest_hits(ox.ravel(), oy.ravel(), (length * cos).ravel(), (length * sin).ravel(),
+                                    tolerance).reshape(shape)
+        if distances is None:
+            distances = np.empty(shape)
+        if points is None:
+            points = np.empty(shape + (2,))
+        np.multiply(closest, length, out=distances)
+        points[..., 0] = ox + distances * cos
+        points[..., 1] = oy + distances * sin
+        return distances, points
+
+    def closest_hits(self, ox, oy, dx, dy, tolerance=0.001):
+        """
+            Intersect the segments o + t * d (0 <= t < 1) with the walls
+            Returns the smallest t of a wall hit for every segment (1 if no wall is hit)
+        """
+        closest = np.ones(len(ox))
+        segments, cells = self.traverse(ox, oy, dx, dy)
+
+        # Walls of the traversed cells, grouped by segment (a wall can be tested more than once)
+        starts = self.cell_start[cells]
+        counts = self.cell_start[cells + 1] - starts
+        total = counts.sum()
+        if total == 0:
+            return closest
+        group_start = np.cumsum(counts) - counts
+        pairs = np.repeat(segments, counts)
+        walls = self.cell_walls[np.arange(total) + np.repeat(starts - group_start, counts)]
+        t = self.intersect(ox[pairs], oy[pairs], dx[pairs], dy[pairs], walls, tolerance)
+
+        # Closest hit of every segment that has walls in its cells
+        pair_counts = np.bincount(pairs, minlength=len(ox))
+        tested = pair_counts > 0
+        closest[tested] = np.minimum.reduceat(t, (np.cumsum(pair_counts) - pair_counts)[tested])
+        return closest
+
+    def traverse(self, ox, oy, dx, dy):
+        """
+            Returns the cells traversed by the segments o + t * d (0 <= t <= 1) as two flat arrays (segment, cell),
+            grouped by segment and ordered along the segment
+
+            All cell boundary crossings of a segment are computed at once (DDA traversal without stepping): the
+            crossings with the vertical and horizontal grid lines are merged and every interval between two
+            crossings lies in one cell.
+        """
+        # x and y are handled at once, axis 0 of every array is the coordinate axis
+        o = np.stack((ox, oy))
+        d = np.stack((dx, dy))
+        lower = self.lower[:, None]
+
+        # Clip the segments to the grid bounds (slab method)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_d = 1 / d
+            t1 = (lower - o) * inv_d
+            t2 = (self.upper[:, None] - o) * inv_d
+            t_enter = np.fmax(np.fmax.reduce(np.minimum(t1, t2)), 0)
+            t_leave = np.fmin(np.fmin.reduce(np.maximum(t1, t2)), 1)
+        inside = t_enter <= t_leave
+        t_leave = np.where(inside, t_leave, t_enter)
+
+        # First and last cell of each segment and the grid lines crossed in between (inf if there is no crossing)
+        enter = self.cells_of(o + t_enter * d)
+        n_crossings = np.abs(self.cells_of(o + t_leave * d) - enter)
+        k = np.arange(n_crossings.max())
+        forward = d > 0
+        lines = (enter + forward)[..., None] + np.where(forward, 1, -1)[..., None] * k
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(k < n_crossings[..., None],
+                         (lower[..., None] + lines * self.cell_size - o[..., None]) * inv_d[..., None], np.inf)
+        crossings = np.concatenate((t_enter[:, None], t[0], t[1], t_leave[:, None]), axis=1)
+        crossings.sort(axis=1)
+
+        # The cell of each interval (taken at its midpoint)
+        valid = (np.arange(crossings.shape[1] - 1) <= n_crossings.sum(axis=0)[:, None]) & inside[:, None]
+        middle = (crossings[:, :-1] + np.minimum(crossings[:, 1:], t_leave[:, None])) / 2
+        middle[~valid] = 0
+        cells = self.cells_of(o[..., None] + middle * d[..., None])
+        segments = np.broadcast_to(np.arange(len(ox))[:, None], valid.shape)
+        return segments[valid], (cells[1] * self.columns + cells[0])[valid]
+
+    def cells_of(self, points):
+        """
+            Returns the grid cells (column, row) of points given as (2, ...) arrays, clipped to the grid
+        """
+        cells = ((points - self.lower.reshape((2,) + (1,) * (points.ndim - 1))) // self.cell_size).astype(int)
+        np.maximum(cells, 0, out=cells)
+        np.minimum(cells, self.shape.reshape((2,) + (1,) * (points.ndim - 1)) - 1, out=cells)
+        return cells
+
+    def intersect(self, ox, oy, dx, dy, walls, tolerance):
+        """
+            Returns t of the intersection of each segment o + t * d with the given wall (1 if they do not intersect)
+            Same test as trigonometry.cast_rays
+        """
+        s_x = self.wall_dx[walls]
+        s_y = self.wall_dy[walls]
+        w_x = self.segments[walls, 0] - ox
+        w_y = self.segments[walls, 1] - oy
+        u_tolerance = tolerance / np.maximum(self.wall_length[walls], tolerance)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_denom = 1 / (dx * s_y - dy * s_x)
+            t = (w_x * s_y - w_y * s_x) * inv_denom
+            u = (w_x * dy - w_y * dx) * inv_denom
+        hit = (t >= 0) & (t < 1) & (u >= -u_tolerance) & (u <= 1 + u_tolerance)
+        t[~hit] = 1
+        return t
+
+    def line_of_sight(self, origin, targets, tolerance=0.001, target_tolerance=0):
+        """
+            Returns for every target point whether the line from origin to the target is free of walls
+            Walls closer than target_tolerance to the target do not block the line of sight
+        """
+        targets = np.asarray(targets, dtype=float).reshape(-1, 2)
+        d_x = targets[:, 0] - origin[0]
+        d_y = targets[:, 1] - origin[1]
+        length = np.sqrt(d_x ** 2 + d_y ** 2)
+        angles = np.degrees(np.arctan2(d_y, d_x))
+        distances, _ = self.cast_rays(origin, angles, length, tolerance)
+        return distances >= length - target_tolerance
+
+
+class VisibilityGrid:
+    """
+        Which beacons are visible from which part of a static map, computed once per map (see maps.CompiledMap)
+
+        For every cell of a uniform grid and every beacon the grid stores whether the beacon is VISIBLE from every
+        point in the cell, HIDDEN from every point in the cell, or UNKNOWN (the cell is close to a visibility
+        boundary). Both tests are conservative, a cell is only VISIBLE or HIDDEN when the exact line of sight test
+        (WallGrid.line_of_sight) gives that result for every point in the cell:
+            - VISIBLE: no wall (clipped to the outside of the target_tolerance disk around the beacon) enters the
+              triangle from the beacon that contains the cell and every line from the cell to the beacon
+            - HIDDEN: a single wall separates the cell from the disk of radius target_tolerance around the beacon and
+              spans every line between them
+        Queries look up the cell of the origin and only run the exact test for UNKNOWN beacons (and origins outside
+        the grid), so the result is identical to the exact test.
+    """
+
+    def __init__(self, walls, beacons, cell_size=VISIBILITY_CELL_SIZE, tolerance=0.001,
+                 target_tolerance=TARGET_TOLERANCE, state=None):
+        self.walls = as_index(walls)
+        self.beacons = np.asarray(beacons, dtype=float).reshape(-1, 2)
+        self.tolerance = tolerance
+        self.target_tolerance = target_tolerance
+        if state is not None:
+            self.cell_size = float(state['cell_size'])
+            self.lower = np.asarray(state['lower'], dtype=float)
+            self.table = state['table']
+        else:
+            self.build(cell_size)
+        self.rows, self.columns = self.table.shape[:2]
+
+    def state(self):
+        """
+            Returns the grid as a dict of arrays, VisibilityGrid(walls, beacons, state=grid.state()) restores it
+        """
+        return {'cell_size': np.array(self.cell_size), 'lower': self.lower, 'table': self.table}
+
+    def build(self, cell_size):
+        """
+            Classify every (cell, beacon) pair as VISIBLE, HIDDEN or UNKNOWN
+        """
+        segments = self.walls.segments
+        points = np.concatenate((segments[:, :2], segments[:, 2:], self.beacons))
+        self.cell_size = cell_size
+        self.lower = points.min(axis=0) - cell_size
+        columns, rows = np.ceil((points.max(axis=0) + cell_size - self.lower) / cell_size).astype(int)
+        self.table = np.full((rows, columns, len(self.beacons)), UNKNOWN, dtype=np.uint8)
+        if len(self.beacons) == 0:
+            return
+
+        center_y, center_x = np.mgrid[0:rows, 0:columns] + 0.5
+        centers = np.column_stack((center_x.ravel(), center_y.ravel())) * cell_size + self.lower
+        radius = cell_size * math.sqrt(0.5) + VISIBILITY_MARGIN
+        chunk = max(VISIBILITY_CHUNK // max(len(segments), 1), 1)
+        for index, beacon in enumerate(self.beacons):
+            for start in range(0, len(centers), chunk):
+                cells = centers[start:start + chunk]
+                self.table.reshape(-1, len(self.beacons))[start:start + chunk, index] = self.classify(
+                    cells, beacon, radius)
+
+    def classify(self, centers, beacon, radius):
+        """
+            Returns the state of a beacon for (n, 2) cell centers, every point within radius of a center is covered
+        """
+        states = np.full(len(centers), UNKNOWN, dtype=np.uint8)
+        margin = VISIBILITY_MARGIN
+        target_tolerance = self.target_tolerance
+        to_beacon = beacon - centers
+        distance = np.sqrt((to_beacon ** 2).sum(axis=1))
+        if self.walls.n_walls == 0:
+            states[:] = VISIBLE
+            return states
+
+        # cx, cy: cell centers (column), walls and wall pieces (row)
+        cx, cy = centers[:, 0, None], centers[:, 1, None]
+        wall_length = self.walls.wall_length
+
+        # VISIBLE: no wall enters the cone from the beacon around the cell. Hits closer than target_tolerance to the
+        # beacon never block, so the walls are clipped to the outside of that disk first.
+        pieces = clip_outside_circle(self.walls.segments, beacon, target_tolerance - margin, margin)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            axis = -to_beacon / distance[:, None]
+            normal = np.column_stack((-axis[:, 1], axis[:, 0]))
+            spread = radius / np.sqrt(np.maximum(distance ** 2 - radius ** 2, 0))
+            reach = distance + radius
+
+            # Triangle (beacon, left, right) that contains the cell disk and every line from it to the beacon
+            left = beacon + reach[:, None] * (axis + spread[:, None] * normal)
+            right = beacon + reach[:, None] * (axis - spread[:, None] * normal)
+            triangle = [(beacon[0], beacon[1]), (left[:, 0, None], left[:, 1, None]),
+                        (right[:, 0, None], right[:, 1, None])]
+            x1, y1, x2, y2 = (pieces[:, i] for i in range(4))
+            entering = point_in_triangle(x1, y1, *triangle) | point_in_triangle(x2, y2, *triangle)
+            for (ax, ay), (bx, by) in zip(triangle, triangle[1:] + triangle[:1]):
+                entering |= segments_cross(ax, ay, bx, by, x1, y1, x2, y2)
+        valid = distance > radius + target_tolerance
+        states[valid & ~entering.any(axis=1)] = VISIBLE
+
+        x1, y1, x2, y2 = (self.walls.segments[:, i] for i in range(4))
+        # HIDDEN: one wall separates the cell (disk of radius) from the beacon (disk of target_radius) and covers
+        # every line between them. Along the wall (coordinate s), the crossing points are a mix of points of the 2
+        # disks with weight fraction on the cell side.
+        target_radius = target_tolerance + margin
+        unit_x, unit_y = self.walls.wall_ux, self.walls.wall_uy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            side_cell = (cx - x1) * -unit_y + (cy - y1) * unit_x
+            side_beacon = (beacon[0] - x1) * -unit_y + (beacon[1] - y1) * unit_x
+            sign = np.sign(side_cell)
+            side_cell = side_cell * sign
+            side_beacon = -side_beacon * sign
+            separated = (side_cell - radius > margin) & (side_beacon - target_radius > margin)
+
+            s_cell = (cx - x1) * unit_x + (cy - y1) * unit_y
+            s_beacon = (beacon[0] - x1) * unit_x + (beacon[1] - y1) * unit_y
+            fraction_low = (side_beacon - target_radius) / (side_cell + radius + side_beacon - target_radius)
+            fraction_high = (side_beacon + target_radius) / (side_cell - radius + side_beacon + target_radius)
+            s_min = np.minimum((1 - fraction_low) * (s_beacon - target_radius) + fraction_low * (s_cell - radius),
+                               (1 - fraction_high) * (s_beacon - target_radius) + fraction_high * (s_cell - radius))
+            s_max = np.maximum((1 - fraction_low) * (s_beacon + target_radius) + fraction_low * (s_cell + radius),
+                               (1 - fraction_high) * (s_beacon + target_radius) + fraction_high * (s_cell + radius))
+            blocking = separated & (s_min > margin) & (s_max < wall_length - margin)
+        states[blocking.any(axis=1)] = HIDDEN
+        return states
+
+    def visible(self, origin, tolerance=None, target_tolerance=None):
+        """
+            Returns for every beacon whether the line from origin to the beacon is free of walls
+            (same result as WallGrid.line_of_sight(origin, beacons, tolerance, target_tolerance))
+        """
+        if tolerance is None:
+            tolerance = self.tolerance
+        if target_tolerance is None:
+            target_tolerance = self.target_tolerance
+        column = int((origin[0] - self.lower[0]) // self.cell_size)
+        row = int((origin[1] - self.lower[1]) // self.cell_size)
+        if (tolerance > self.tolerance or target_tolerance != self.target_tolerance or
+                not (0 <= row < self.rows and 0 <= column < self.columns)):
+            return self.walls.line_of_sight(origin, self.beacons, tolerance, target_tolerance)
+
+        states = self.table[row, column]
+        visible = states == VISIBLE
+        unknown = states == UNKNOWN
+        if unknown.any():
+            visible[unknown] = self.walls.line_of_sight(origin, self.beacons[unknown], tolerance, target_tolerance)
+        return visible
+
+
+class RayTable:
+    """
+        Precomputed ray distances of a static map, for sensor queries where speed matters more than accuracy
+        (e.g. screening runs of the genetic algorithm)
+
+        The table holds the distance to the closest wall (up to 'length') of rays cast from the nodes of a grid over
+        the walls: table[row, column, k] is the ray from lower + (column, row) * resolution at angle
+        k * angle_resolution (the last angle repeats the first one, so interpolation never wraps around).
+        cast_rays interpolates the 8 surrounding entries (trilinear) and has the same interface as
+        WallGrid.cast_rays, so a table can be used wherever the sensors take a WallGrid.
+        Origins outside the table, longer rays and larger tolerances use the exact ray caster (walls).
+
+        Accuracy compared with the exact ray caster:
+            - The distance of rays with the same angle that hit the same wall is linear in the origin, so the
+              interpolation between positions is exact when the 8 entries hit the same wall.
+            - Along the angle the distance is d = h / cos(phi) (h: distance of the wall, phi: angle of incidence).
+              The linear interpolation error is at most angle_resolution^2 / 8 * d * (1 + 2 * tan(phi)^2) (radians),
+              e.g. 0.08 px at normal incidence and 0.5 px at 60 degrees for d = 500 and 2 degree steps.
+            - Within one resolution (or angle_resolution) of a wall end, a corner, the end of the range or the wall
+              the origin is next to, the entries hit different walls and the error is up to the difference of their
+              distances (these rays are the few percent with errors of more than a pixel).
+        The error of random rays is measured when the table is built and stored in 'accuracy' (see measure_accuracy).
+
+        The table only replaces the sensor readings: the robots test their wall collisions with the exact ray caster
+        wherever a wall can be closer than the collision distance (near_walls, a lookup in the distance field of the
+        map if one is given), so the robots collide with the walls as they do with exact rays.
+
+        Tables saved to disk are memory-mapped: every process that loads the same file (and pickled tables, which
+        are loaded again from their file) shares a single copy in the page cache.
+    """
+
+    def __init__(self, walls, table, lower, resolution, angle_resolution, length, tolerance=0.001, accuracy=None,
+                 path=None, field=None):
+        self.walls = as_index(walls)
+        self.field = field  # Optional DistanceField of the walls for near_walls
+        self.segments = self.walls.segments
+        self.table = table
+        self.lower = np.asarray(lower, dtype=float)
+        self.resolution = float(resolution)
+        self.angle_resolution = float(angle_resolution)
+        self.length = float(length)
+        self.tolerance = tolerance
+        self.accuracy = accuracy
+        self.path = path
+        self.rows, self.columns = table.shape[:2]
+        self.n_angles = table.shape[2] - 1
+
+        # Flat table index = position . strides + angle, offsets of the 8 entries around a ray (corner, angle)
+        self._flat = table.reshape(-1)
+        self._strides = np.array([table.shape[2], self.columns * table.shape[2]])
+        self._last_cell = np.array([self.columns - 1, self.rows - 1])
+        corners = np.array([0, 1, self.columns, self.columns + 1]) * table.shape[2]
+        self._offsets = (corners[:, None] + np.arange(2)).reshape(4, 2, 1)
+
+    def __reduce__(self):
+        if self.path is not None:
+            # Worker processes map the file instead of unpickling a copy of the table
+            return RayTable.load, (self.walls, self.path, self.field)
+        return RayTable, (self.walls, self.table, self.lower, self.resolution, self.angle_resolution, self.length,
+                          self.tolerance, self.accuracy, None, self.field)
+
+    @classmethod
+    def build(cls, walls, length, resolution=RAY_TABLE_RESOLUTION, angle_resolution=RAY_TABLE_ANGLE_RESOLUTION,
+              tolerance=0.001, path=None, field=None):
+        """
+            Cast the rays of every grid node over the bounding box of the walls
+            With a path, the table is written to path (.npy, parameters in path + '.json') and memory-mapped
+        """
+        walls = as_index(walls)
+        segments = walls.segments
+        points = np.concatenate((segments[:, :2], segments[:, 2:])) if len(segments) else np.zeros((1, 2))
+        lower = points.min(axis=0)
+        columns, rows = (np.ceil((points.max(axis=0) - lower) / resolution).astype(int) + 2).tolist()
+        n_angles = max(int(round(360 / angle_resolution)), 1)
+        angle_resolution = 360 / n_angles
+        shape = (rows, columns, n_angles + 1)
+        if path is not None:
+            table = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=shape)
+        else:
+            table = np.empty(shape, dtype=np.float32)
+
+        xs = lower[0] + np.arange(columns) * resolution
+        angles = np.broadcast_to(np.arange(n_angles) * angle_resolution, (columns, n_angles))
+        for row in range(rows):
+            origins = np.column_stack((xs, np.full(columns, lower[1] + row * resolution)))
+            table[row, :, :n_angles] = walls.cast_rays(origins, angles, length, tolerance)[0]
+        table[:, :, n_angles] = table[:, :, 0]
+
+        ray_table = cls(walls, table, lower, resolution, angle_resolution, length, tolerance, field=field)
+        ray_table.accuracy = ray_table.measure_accuracy()
+        if path is not None:
+            table.flush()
+            with open(path + '.json', 'w') as file:
+                json.dump({'lower': lower.tolist(), 'resolution': resolution, 'angle_resolution': angle_resolution,
+                           'length': length, 'tolerance': tolerance, 'accuracy': ray_table.accuracy}, file)
+            return cls.load(walls, path, field)
+        return ray_table
+
+    @classmethod
+    def load(cls, walls, path, field=None):
+        """
+            Memory-map a table that was saved by build()
+        """
+        with open(path + '.json', 'r') as file:
+            parameters = json.load(file)
+        table = np.load(path, mmap_mode='r')
+        return cls(walls, table, parameters['lower'], parameters['resolution'], parameters['angle_resolution'],
+                   parameters['length'], parameters['tolerance'], parameters['accuracy'], path=os.path.abspath(path),
+                   field=field)
+
+    def near_walls(self, origins, clearance):
+        """
+            Returns for the (n, 2) origins whether a wall can be closer than clearance (always without a field)
+            Sensor rays from the other origins can not be shorter than clearance.
+        """
+        origins = np.asarray(origins, dtype=float).reshape(-1, 2)
+        if self.field is None:
+            return np.ones(len(origins), dtype=bool)
+        return self.field.distance(origins) - self.field.error < clearance
+
+    def measure_accuracy(self, n_rays=RAY_TABLE_ACCURACY_RAYS, clearance=0, seed=0):
+        """
+            Returns the absolute error (mean, median, 99th percentile and maximum in pixels) of random rays in the
+            table compared with the exact ray caster. Origins closer than clearance to a wall are skipped (robots
+            never get closer than their radius).
+        """
+        rng = np.random.default_rng(seed)
+        origins = rng.uniform(self.lower, self.lower + self._last_cell * self.resolution, (n_rays, 2))
+        if clearance > 0 and self.walls.n_walls > 0:
+            x1, y1, x2, y2 = (self.walls.segments[:, i] for i in range(4))
+            distance = point_segment_distance(origins[:, 0, None], origins[:, 1, None], x1, y1, x2, y2).min(axis=1)
+            origins = origins[distance > clearance]
+        angles = rng.uniform(0, 360, (len(origins), 1))
+        errors = np.abs(self.cast_rays(origins, angles, self.length, self.tolerance)[0] -
+                        self.walls.cast_rays(origins, angles, self.length, self.tolerance)[0])
+        return {'mean': float(errors.mean()), 'median': float(np.median(errors)),
+                'p99': float(np.percentile(errors, 99)), 'max': float(errors.max())}
+
+    def cast_rays(self, origin, angles, length, tolerance=0.001, distances=None, points=None):
+        """
+            Same as WallGrid.cast_rays, interpolated from the table (length: a length or one length per ray)
+        """
+        origin = np.asarray(origin, dtype=float)
+        cell = (origin - self.lower) / self.resolution
+        cell_index = cell.astype(int)
+        if (np.any(np.asarray(length) > self.length) or tolerance > self.tolerance or cell.min() < 0 or
+                (cell_index >= self._last_cell).any()):
+            return self.walls.cast_rays(origin, angles, length, tolerance, distances, points)
+        cell_weight = cell - cell_index
+        column_weight = cell_weight[..., 0, None]
+        row_weight = cell_weight[..., 1, None]
+
+        # Weights (corner, angle, ...) of the 4 cell corners at the 2 angles around each ray
+        position = np.remainder(angles, 360) / self.angle_resolution
+        angle_index = position.astype(int)
+        angle_weight = position - angle_index
+        weights = np.empty((4, 2) + angle_weight.shape)
+        weights[:, 1] = angle_weight
+        weights[:, 0] = 1 - angle_weight
+        weights[0::2] *= 1 - column_weight
+        weights[1::2] *= column_weight
+        weights[:2] *= 1 - row_weight
+        weights[2:] *= row_weight
+
+        first = np.dot(cell_index, self._strides)[..., None] + angle_index
+        entries = np.take(self._flat, first + self._offsets.reshape((4, 2) + (1,) * first.ndim))
+        np.multiply(weights, entries, out=weights)
+
+        if distances is None:
+            distances = np.empty(angle_weight.shape)
+        if points is None:
+            points = np.empty(angle_weight.shape + (2,))
+        weights.reshape((8,) + angle_weight.shape).sum(axis=0, out=distances)
+        np.minimum(distances, length, out=distances)
+        rad = np.radians(angles)
+        points[..., 0] = origin[..., 0, None] + distances * np.cos(rad)
+        points[..., 1] = origin[..., 1, None] + distances * np.sin(rad)
+        return distances, points
+
+
+class DistanceField:
+    """
+        Distance to the closest wall on a uniform grid of nodes over a static map, computed once per map
+        (see maps.CompiledMap)
+
+        The walls are line segments without an inside, so the field is the unsigned distance, capped at
+        max_distance (far from the walls the field is a lower bound). It is 1-Lipschitz, so the bilinear
+        interpolation between the nodes (distance()) is off by at most error = cell_size / sqrt(2).
+        Every node also stores its closest wall:
+            - contacts(): robots are only tested against the walls closest to the 4 nodes around them when the field
+              says they are within error of their radius, so the cost of a contact check does not depend on the
+              number of walls and contacts between the sensor rays are found as well
+            - cast_rays(): sphere tracing, every ray advances by the lower bound of the distance to the closest wall.
+              Within a cell of a wall the rest of the ray is intersected with the walls closest to the nodes around
+              it, so the distances are the ones of the exact ray caster unless a wall end is closer than a cell to
+              another wall that is not closest to any of those nodes.
+    """
+
+    def __init__(self, walls, cell_size=DISTANCE_FIELD_CELL_SIZE, margin=None,
+                 max_distance=DISTANCE_FIELD_MAX_DISTANCE, state=None):
+        self.walls = as_index(walls)
+        self.segments = self.walls.segments
+        if state is not None:
+            self.cell_size = float(state['cell_size'])
+            self.lower = np.asarray(state['lower'], dtype=float)
+            self.distances = state['distances']
+            self.closest = state['closest']
+        else:
+            self.build(cell_size, 2 * cell_size if margin is None else margin, max_distance)
+        self.rows, self.columns = self.distances.shape
+        self.upper = self.lower + (np.array([self.columns, self.rows]) - 1) * self.cell_size
+        endpoints = self.walls.segments.reshape(-1, 2)
+        self.margin = 0.0  # Distance of the walls to the border of the field
+        if len(endpoints):
+            self.margin = float(min((endpoints.min(axis=0) - self.lower).min(),
+                                    (self.upper - endpoints.max(axis=0)).min()))
+        self.error = self.cell_size * math.sqrt(0.5)
+        self._flat_distances = self.distances.reshape(-1)
+        self._flat_closest = self.closest.reshape(-1)
+        self._corners = np.array([0, 1, self.columns, self.columns + 1])
+        self._strides = np.array([1, self.columns])
+        self._last_cell = np.array([self.columns - 1, self.rows - 1])
+
+    def state(self):
+        """
+            Returns the field as a dict of arrays, DistanceField(walls, state=field.state()) restores it
+        """
+        return {'cell_size': np.array(self.cell_size), 'lower': self.lower, 'distances': self.distances,
+                'closest': self.closest}
+
+    def build(self, cell_size, margin, max_distance):
+        """
+            Measure the distance of the nodes within max_distance of each wall
+        """
+        segments = self.walls.segments
+        points = np.concatenate((segments[:, :2], segments[:, 2:])) if len(segments) else np.zeros((1, 2))
+        self.cell_size = cell_size
+        self.lower = points.min(axis=0) - margin
+        columns, rows = (np.ceil((points.max(axis=0) + margin - self.lower) / cell_size).astype(int) + 1).tolist()
+        self.distances = np.full((rows, columns), max_distance, dtype=np.float32)
+        self.closest = np.zeros((rows, columns), dtype=np.int32)
+
+        for index, (x1, y1, x2, y2) in enumerate(segments.tolist()):
+            first_column, first_row = np.maximum((np.minimum((x1, y1), (x2, y2)) - max_distance - self.lower) //
+                                                 cell_size, 0).astype(int)
+            last_column, last_row = np.minimum((np.maximum((x1, y1), (x2, y2)) + max_distance - self.lower) //
+                                               cell_size + 2, (columns, rows)).astype(int)
+            xs = self.lower[0] + np.arange(first_column, last_column) * cell_size
+            ys = self.lower[1] + np.arange(first_row, last_row) * cell_size
+            distances = point_segment_distance(xs[None, :], ys[:, None], x1, y1, x2, y2)
+            window = self.distances[first_row:last_row, first_column:last_column]
+            closer = distances < window
+            window[closer] = distances[closer]
+            self.closest[first_row:last_row, first_column:last_column][closer] = index
+
+    def cells(self, points):
+        """
+            Returns the flat index of the lower left node of the cell of each point, the weights of the point in the
+            cell and whether the point is inside the field
+        """
+        cell = (points - self.lower) / self.cell_size
+        cell_index = cell.astype(int)
+        inside = ((cell >= 0) & (cell_index < self._last_cell)).all(axis=-1)
+        np.minimum(cell_index, self._last_cell - 1, out=cell_index)
+        np.maximum(cell_index, 0, out=cell_index)
+        return np.dot(cell_index, self._strides), cell - cell_index, inside
+
+    def interpolate(self, first, weights):
+        """
+            Returns the bilinear interpolation of the distances at the nodes around the points (see cells)
+        """
+        corners = np.take(self._flat_distances, first[..., None] + self._corners)
+        column_weight, row_weight = weights[..., 0], weights[..., 1]
+        bottom = corners[..., 0] + column_weight * (corners[..., 1] - corners[..., 0])
+        top = corners[..., 2] + column_weight * (corners[..., 3] - corners[..., 2])
+        return bottom + row_weight * (top - bottom)
+
+    def distance_at(self, x, y):
+        """
+            Same as distance() for a single point, without array overhead
+        """
+        column = (x - self.lower[0]) / self.cell_size
+        row = (y - self.lower[1]) / self.cell_size
+        if not (0 <= column < self.columns - 1 and 0 <= row < self.rows - 1):
+            return float(self.distance((x, y)))
+        column_index, row_index = int(column), int(row)
+        column_weight, row_weight = column - column_index, row - row_index
+        (d00, d01), (d10, d11) = self.distances[row_index:row_index + 2, column_index:column_index + 2].tolist()
+        bottom = d00 + column_weight * (d01 - d00)
+        top = d10 + column_weight * (d11 - d10)
+        return bottom + row_weight * (top - bottom)
+
+    def distance(self, points):
+        """
+            Returns the interpolated distance of the (..., 2) points to the closest wall (off by at most error)
+            Points outside the field are measured against all walls.
+        """
+        points = np.asarray(points, dtype=float)
+        first, weights, inside = self.cells(points)
+        distances = self.interpolate(first, weights)
+        if not inside.all():
+            outside = points[~inside]
+            x1, y1, x2, y2 = (self.walls.segments[:, i] for i in range(4))
+            distances[~inside] = point_segment_distance(outside[:, 0, None], outside[:, 1, None],
+                                                        x1, y1, x2, y2).min(axis=1, initial=np.inf)
+        return distances
+
+    def closest_points(self, points):
+        """
+            Returns the exact distance of the (n, 2) points to the closest of the walls closest to the 4 nodes
+            around them (or all walls outside the field) and the closest points on those walls
+        """
+        first, _, inside = self.cells(points)
+        walls = np.take(self._flat_closest, first[:, None] + self._corners)
+        if not inside.all():
+            walls = np.where(inside[:, None, None], walls[:, :, None], np.arange(self.walls.n_walls))
+            walls = walls.reshape(len(points), -1)
+        x1, y1 = self.walls.segments[walls, 0], self.walls.segments[walls, 1]
+        d_x, d_y = self.walls.wall_dx[walls], self.walls.wall_dy[walls]
+        squared_length = d_x ** 2 + d_y ** 2
+        px, py = points[:, 0, None], points[:, 1, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(squared_length > 0, ((px - x1) * d_x + (py - y1) * d_y) / squared_length, 0)
+        t = np.clip(t, 0, 1)
+        closest_x, closest_y = x1 + t * d_x, y1 + t * d_y
+        distances = np.sqrt((px - closest_x) ** 2 + (py - closest_y) ** 2)
+        best = distances.argmin(axis=1)
+        rows = np.arange(len(points))
+        return distances[rows, best], np.stack((closest_x[rows, best], closest_y[rows, best]), axis=1)
+
+    def contacts(self, positions, radius, tolerance=0.001):
+        """
+            Push robots (circles of radius at the (n, 2) positions) out of the walls they touch, along the line from
+            the closest point on the wall. Returns the new positions and whether each robot touched a wall.
+        """
+        positions = np.array(positions, dtype=float).reshape(-1, 2)
+        touched = np.zeros(len(positions), dtype=bool)
+        if self.walls.n_walls == 0:
+            return positions, touched
+        candidates = np.flatnonzero(self.distance(positions) - self.error < radius - tolerance)
+        for _ in range(MAX_CONTACT_UPDATES):
+            if len(candidates) == 0:
+                break
+            distances, closest = self.closest_points(positions[candidates])
+            inside = distances < radius - tolerance
+            candidates, distances, closest = candidates[inside], distances[inside, None], closest[inside]
+            touched[candidates] = True
+            # A robot centered on a wall is pushed out along the wall normal
+            with np.errstate(divide='ignore', invalid='ignore'):
+                directions = np.where(distances > 0, (positions[candidates] - closest) / distances, 0)
+            positions[candidates] = closest + directions * radius
+        return positions, touched
+
+    def cast_rays(self, origin, angles, length, tolerance=0.001, distances=None, points=None):
+        """
+            Same as WallGrid.cast_rays, sphere traced through the field (see DistanceField)
+        """
+        origin = np.asarray(origin, dtype=float)
+        rad = np.radians(angles)
+        cos = np.cos(rad)
+        sin = np.sin(rad)
+        shape = cos.shape
+        origins = np.broadcast_to(origin[..., None, :], shape + (2,)).reshape(-1, 2)
+        directions = np.stack((cos, sin), axis=-1).reshape(-1, 2)
+        ox, oy = origins[:, 0], origins[:, 1]
+        dx, dy = directions[:, 0], directions[:, 1]
+        segments = self.walls.segments
+        u_tolerance = tolerance / np.maximum(self.walls.wall_length, tolerance)
+
+        t = np.zeros(dx.shape)
+        active = np.arange(len(t))
+        for _ in range(MAX_SPHERE_TRACING_STEPS):
+            ray_points = np.empty((len(active), 2))
+            np.multiply(t[active, None], directions[active], out=ray_points)
+            ray_points += origins[active]
+            first, weights, inside = self.cells(ray_points)
+            step = self.interpolate(first, weights)
+            step -= self.error
+            near = step < self.cell_size
+            if not inside.all():
+                # All walls are at least margin inside the field
+                outside = ray_points[~inside]
+                box = np.maximum(np.maximum(self.lower - outside, outside - self.upper), 0)
+                step[~inside] = np.sqrt((box ** 2).sum(axis=1)) + self.margin
+                near &= inside
+
+            # Close to a wall: intersect the rest of the ray with the walls closest to the 4 nodes around it
+            hit = np.zeros(len(active), dtype=bool)
+            if near.any():
+                walls = np.take(self._flat_closest, first[near, None] + self._corners)
+                near_active = active[near]
+                w_x = segments[walls, 0] - ox[near_active, None]
+                w_y = segments[walls, 1] - oy[near_active, None]
+                s_x = self.walls.wall_dx[walls]
+                s_y = self.walls.wall_dy[walls]
+                r_x, r_y = dx[near_active, None], dy[near_active, None]
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    inv_denom = 1 / (r_x * s_y - r_y * s_x)
+                    wall_t = (w_x * s_y - w_y * s_x) * inv_denom
+                    wall_u = (w_x * r_y - w_y * r_x) * inv_denom
+                hits = (wall_t >= 0) & (wall_u >= -u_tolerance[walls]) & (wall_u <= 1 + u_tolerance[walls])
+                wall_t = np.where(hits, wall_t, np.inf).min(axis=1)
+                hit[near] = wall_t < np.inf
+                t[near_active] = np.where(hit[near], wall_t, t[near_active] + np.maximum(step[near], self.cell_size))
+            t[active[~near]] += step[~near]
+
+            active = active[~hit & (t[active] < length)]
+            if len(active) == 0:
+                break
+
+        if distances is None:
+            distances = np.empty(shape)
+        if points is None:
+            points = np.empty(shape + (2,))
+        np.minimum(t.reshape(shape), length, out=distances)
+        points[..., 0] = origin[..., 0, None] + distances * cos
+        points[..., 1] = origin[..., 1, None] + distances * sin
+        return distances, points
+
+
+def sweep_circles(walls, path, radius, tolerance=0.001, max_slides=MAX_SLIDES):
+    """
+        Move circles along paths without entering the walls (continuous collision detection)
+            path: (n_points, n, 2) points of the paths of n circles (the circles start at path[0])
+            radius: radius of the circles
+
+        The path segments are swept against the walls near the path (see time_of_impact). At the first contact the
+        circle stops and slides: the straight way to the end of the path without the part into the wall is swept
+        again, up to max_slides times. Every move is swept, so a circle can never tunnel through a wall.
+        Returns the final positions (n, 2) and whether each circle touched a wall
+    """
+    walls = wall_index(walls)
+    segments = walls.segments
+    path = np.asarray(path, dtype=float)
+    positions = path[-1].copy()
+    touched = np.zeros(len(positions), dtype=bool)
+    if len(segments) == 0:
+        return positions, touched
+
+    # Broad phase: a path stays within 'reach' of the mean of its points, circles without a wall within reach +
+    # radius of it end at the end of their path
+    center = path.mean(axis=0)
+    reach = np.sqrt(((path - center) ** 2).sum(axis=-1)).max(axis=0)
+    x1, y1, x2, y2 = (segments[:, i] for i in range(4))
+    near = point_segment_distance(center[:, 0, None], center[:, 1, None], x1, y1, x2, y2) < (
+        reach + radius + tolerance)[:, None]
+    circles = np.flatnonzero(near.any(axis=1))
+    if len(circles) == 0:
+        return positions, touched
+    near_walls = np.flatnonzero(near[circles].any(axis=0))
+
+    positions[circles], touched[circles] = sweep_path(walls, near_walls, path[:, circles], radius, tolerance,
+                                                      max_slides)
+    return positions, touched
+
+
+def sweep_path(walls, subset, path, radius, tolerance, max_slides):
+    """
+        Narrow phase of sweep_circles: all path segments are swept at once (against the walls of the WallGrid with
+        the indices in subset) from their planned start points, the circles stop at the first contact and slide
+        towards the end of their path from there
+    """
+    starts, displacements = path[:-1], np.diff(path, axis=0)
+    n_segments, n_circles = starts.shape[:2]
+    t, normals = time_of_impact(walls, starts.reshape(-1, 2), displacements.reshape(-1, 2), radius, tolerance,
+                                subset)
+    hit = (t < 1).reshape(n_segments, n_circles)
+    touched = hit.any(axis=0)
+    positions = path[-1].copy()
+    if not touched.any():
+        return positions, touched
+
+    # Segments before the first contact are free, the circle moves to the contact
+    circles = np.flatnonzero(touched)
+    first = hit[:, circles].argmax(axis=0) * n_circles + circles
+    positions[circles] = starts.reshape(-1, 2)[first] + displacements.reshape(-1, 2)[first] * t[first, None]
+    normals = normals[first]
+
+    # Slide: keep the part of the rest of the path that does not go into the wall
+    for _ in range(max_slides):
+        remaining = path[-1, circles] - positions[circles]
+        into = np.minimum((remaining * normals).sum(axis=1), 0)
+        remaining -= into[:, None] * normals
+        t, normals = time_of_impact(walls, positions[circles], remaining, radius, tolerance, subset)
+        positions[circles] += remaining * t[:, None]
+        sliding = t < 1
+        circles, normals = circles[sliding], normals[sliding]
+        if len(circles) == 0:
+            break
+    return positions, touched
+
+
+def time_of_impact(walls, positions, displacements, radius, tolerance=0.001, subset=None):
+    """
+        Returns the fraction t (0 <= t <= 1, 1 without a contact) of the (n, 2) displacements that circles at the
+        (n, 2) positions can move before they touch a wall, and the normals (n, 2) of the walls at the contacts
+
+        The circle touches a wall when its center enters the capsule of the wall (the points within radius of it):
+        the 2 sides of the wall moved by radius and the circles of radius around its end points. Only displacements
+        towards the wall count, so circles that touch a wall can move away from it or along it.
+        walls: WallGrid (or anything with one, see wall_index), only the walls with the indices in subset if given
+    """
+    walls = wall_index(walls)
+    subset = slice(None) if subset is None else subset
+    px, py = positions[:, 0, None], positions[:, 1, None]
+    dx, dy = displacements[:, 0, None], displacements[:, 1, None]
+    segments = walls.segments[subset]
+    x1, y1, x2, y2 = (segments[:, i] for i in range(4))
+    length = walls.wall_length[subset]
+    unit_x, unit_y = walls.wall_ux[subset], walls.wall_uy[subset]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Sides: the distance to the wall line shrinks by 'approach' per unit of t
+        height = (px - x1) * -unit_y + (py - y1) * unit_x
+        approach = np.where(height < 0, -1, 1) * (dx * unit_y - dy * unit_x)
+        height = np.abs(height)
+        t_side = np.where(height > radius, (height - radius) / approach, 0)
+        along = (px + t_side * dx - x1) * unit_x + (py + t_side * dy - y1) * unit_y
+        times = np.where((approach > 0) & (along >= 0) & (along <= length) & (length > 0), t_side, np.inf)
+
+        # End points: |p + t d - e| = radius, the first root
+        a = dx ** 2 + dy ** 2
+        for ex, ey in ((x1, y1), (x2, y2)):
+            fx, fy = px - ex, py - ey
+            b = fx * dx + fy * dy
+            c = fx ** 2 + fy ** 2 - radius ** 2
+            discriminant = b ** 2 - a * c
+            t_end = np.where(c > 0, (-b - np.sqrt(np.maximum(discriminant, 0))) / a, 0)
+            np.minimum(times, np.where((b < 0) & (discriminant >= 0), t_end, np.inf), out=times)
+
+    # Closest contact of each circle, the normal points from the closest point of the wall to the contact
+    rows = np.arange(len(positions))
+    wall = times.argmin(axis=1)
+    t = np.minimum(times[rows, wall], 1)
+    contact_x = positions[:, 0] + t * displacements[:, 0]
+    contact_y = positions[:, 1] + t * displacements[:, 1]
+    along = np.clip((contact_x - x1[wall]) * unit_x[wall] + (contact_y - y1[wall]) * unit_y[wall], 0, length[wall])
+    normals = np.stack((contact_x - x1[wall] - along * unit_x[wall], contact_y - y1[wall] - along * unit_y[wall]),
+                       axis=1)
+    norm = np.sqrt((normals ** 2).sum(axis=1))
+    step = np.sqrt((displacements ** 2).sum(axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normals = np.where(norm[:, None] > 0, normals / norm[:, None], 0)
+        # Stop a little before the contact, so the circle does not end up inside the wall by rounding errors
+        t = np.where(t < 1, np.maximum(t - tolerance / step, 0), 1)
+    return t, normals
+
+
+def arc_time_of_impact(walls, position, angle, speed, rotation_rate, radius, duration, tolerance=0.001):
+    """
+        Returns the time (0 <= t <= duration, duration without a contact) a circle at position can move along the arc
+        of a differential drive before it touches a wall
+            angle: heading in degrees, speed: speed of the center, rotation_rate: change of the heading in radians
+            (both per unit of time, see kinematics.bot_calc_coordinate)
+
+        The center moves on a circle around the ICC, so the contacts are the intersections of that circle with the
+        capsules of the walls (2 lines and 2 circles each, see time_of_impact) where the center enters the capsule.
+        These are solved in closed form, so the cost does not depend on the duration. Without a contact during the
+        first turn around the ICC there is none later either.
+    """
+    walls = wall_index(walls)
+    segments = walls.segments
+    x, y = position
+    heading = math.radians(angle)
+    if speed == 0 or len(segments) == 0 or duration <= 0:
+        # Turning on the spot never touches a wall
+        return duration
+    if rotation_rate == 0:
+        displacement = np.array([[math.cos(heading), math.sin(heading)]]) * speed * duration
+        t, _ = time_of_impact(walls, np.array([[x, y]], dtype=float), displacement, radius, tolerance)
+        return t[0] * duration
+
+    # Center of rotation (ICC) and radius of the arc of the center
+    icc_distance = speed / rotation_rate
+    cx, cy = x - icc_distance * math.sin(heading), y + icc_distance * math.cos(heading)
+    arc_radius = abs(icc_distance)
+    start = math.atan2(y - cy, x - cx)
+    direction = 1 if rotation_rate > 0 else -1
+
+    # Only the walls whose capsule reaches the ring of the arc
+    x1, y1, x2, y2 = (segments[:, i] for i in range(4))
+    farthest = np.sqrt(np.maximum((x1 - cx) ** 2 + (y1 - cy) ** 2, (x2 - cx) ** 2 + (y2 - cy) ** 2))
+    closest = point_segment_distance(cx, cy, x1, y1, x2, y2)
+    near = (closest <= arc_radius + radius) & (farthest >= arc_radius - radius)
+    if not near.any():
+        return duration
+    x1, y1, x2, y2 = x1[near], y1[near], x2[near], y2[near]
+    length = walls.wall_length[near]
+    unit_x, unit_y = walls.wall_ux[near], walls.wall_uy[near]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normal_x, normal_y = -unit_y, unit_x
+
+        # Sides: normal . (c + arc_radius (cos p, sin p) - a) = +-radius, so cos(p - normal angle) = k
+        height = (cx - x1) * normal_x + (cy - y1) * normal_y
+        normal_angle = np.arctan2(normal_y, normal_x)
+        side = np.array([1, 1, -1, -1])[:, None]
+        cos_offset = (side * radius - height) / arc_radius
+        offset = np.arccos(np.clip(cos_offset, -1, 1))
+        phase = normal_angle + np.array([1, -1, 1, -1])[:, None] * offset
+        points_x = cx + arc_radius * np.cos(phase)
+        points_y = cy + arc_radius * np.sin(phase)
+        along = (points_x - x1) * unit_x + (points_y - y1) * unit_y
+        # The center enters the capsule when it moves towards the wall
+        velocity = direction * (-np.sin(phase) * normal_x + np.cos(phase) * normal_y)
+        contacts = [phase[(np.abs(cos_offset) <= 1) & (length > 0) & (along >= 0) & (along <= length) &
+                          (side * velocity < 0)]]
+
+        # End points: intersections of the arc with the circles of radius around the end points
+        for ex, ey, first in ((x1, y1, True), (x2, y2, False)):
+            distance = np.sqrt((ex - cx) ** 2 + (ey - cy) ** 2)
+            cos_offset = (arc_radius ** 2 - radius ** 2 + distance ** 2) / (2 * distance * arc_radius)
+            offset = np.arccos(np.clip(cos_offset, -1, 1))
+            phase = np.arctan2(ey - cy, ex - cx) + np.array([1, -1])[:, None] * offset
+            points_x = cx + arc_radius * np.cos(phase)
+            points_y = cy + arc_radius * np.sin(phase)
+            along = (points_x - x1) * unit_x + (points_y - y1) * unit_y
+            beyond = along <= 0 if first else along >= length
+            velocity = direction * (-np.sin(phase) * (points_x - ex) + np.cos(phase) * (points_y - ey))
+            contacts.append(phase[(np.abs(cos_offset) <= 1) & (distance > 0) & beyond & (velocity < 0)])
+
+    phases = np.concatenate(contacts)
+    if len(phases) == 0:
+        return duration
+
+    # Angle the center turns until each contact (an entry right at the start is a contact at 0)
+    turn = np.remainder(direction * (phases - start), 2 * math.pi)
+    turn[turn > 2 * math.pi - 1e-9] = 0
+    t = turn.min() / abs(rotation_rate)
+    if t >= duration:
+        return duration
+    # Stop a little before the contact, so the circle does not end up inside the wall by rounding errors
+    return max(t - tolerance / abs(speed), 0)
+
+
+def clip_outside_circle(segments, center, radius, extension=0):
+    """
+        Returns the pieces of the (n, 4) segments outside the circle as (2 * n, 4) segments (empty pieces collapse to
+        a point far away). Every piece is extended by 'extension' at both ends.
+    """
+    x1, y1, x2, y2 = (segments[:, i] for i in range(4))
+    d_x, d_y = x2 - x1, y2 - y1
+    length = np.sqrt(d_x ** 2 + d_y ** 2)
+    f_x, f_y = x1 - center[0], y1 - center[1]
+    a = d_x ** 2 + d_y ** 2
+    b = f_x * d_x + f_y * d_y
+    c = f_x ** 2 + f_y ** 2 - max(radius, 0) ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        root = np.sqrt(np.maximum(b ** 2 - a * c, 0))
+        enter = np.where((b ** 2 - a * c > 0) & (a > 0), (-b - root) / a, 2)
+        leave = np.where((b ** 2 - a * c > 0) & (a > 0), (-b + root) / a, 2)
+        grow = np.where(length > 0, extension / length, 0)
+    # Piece before the circle: [0, min(enter, 1)], piece after the circle: [max(leave, 0), 1]
+    starts = np.concatenate((np.zeros_like(enter), np.where(leave < 2, np.maximum(leave, 0), 1)))
+    ends = np.concatenate((np.where(enter < 2, np.minimum(enter, 1), 1), np.ones_like(leave)))
+    empty = ends <= starts
+    empty[len(segments):] |= leave >= 2  # Segments that miss the circle are kept whole in the first piece only
+    grow = np.concatenate((grow, grow))
+    starts, ends = starts - grow, ends + grow
+    x1, y1, d_x, d_y = (np.concatenate((v, v)) for v in (x1, y1, d_x, d_y))
+    pieces = np.column_stack((x1 + starts * d_x, y1 + starts * d_y, x1 + ends * d_x, y1 + ends * d_y))
+    pieces[empty] = np.inf
+    return pieces
+
+
+def point_in_triangle(px, py, a, b, c):
+    """
+        Returns whether the points are inside the triangles a, b, c (or on their border, arrays are broadcast)
+    """
+    def side(p, q):
+        return (q[0] - p[0]) * (py - p[1]) - (q[1] - p[1]) * (px - p[0])
+    s1, s2, s3 = side(a, b), side(b, c), side(c, a)
+    return ((s1 >= 0) & (s2 >= 0) & (s3 >= 0)) | ((s1 <= 0) & (s2 <= 0) & (s3 <= 0))
+
+
+def segments_cross(ax1, ay1, ax2, ay2, bx1, by1, bx2, by2):
+    """
+        Returns whether the segments a and b intersect (touching counts, arrays are broadcast)
+    """
+    a_dx, a_dy = ax2 - ax1, ay2 - ay1
+    b_dx, b_dy = bx2 - bx1, by2 - by1
+    side_b1 = a_dx * (by1 - ay1) - a_dy * (bx1 - ax1)
+    side_b2 = a_dx * (by2 - ay1) - a_dy * (bx2 - ax1)
+    side_a1 = b_dx * (ay1 - by1) - b_dy * (ax1 - bx1)
+    side_a2 = b_dx * (ay2 - by1) - b_dy * (ax2 - bx1)
+    return (side_b1 * side_b2 <= 0) & (side_a1 * side_a2 <= 0)
+
+
+def point_segment_distance(px, py, x1, y1, x2, y2):
+    """
+        Returns the distance of the points (px, py) to the segments from (x1, y1) to (x2, y2) (arrays are broadcast)
+    """
+    d_x = x2 - x1
+    d_y = y2 - y1
+    squared_length = d_x ** 2 + d_y ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(squared_length > 0, ((px - x1) * d_x + (py - y1) * d_y) / squared_length, 0)
+    t = np.clip(t, 0, 1)
+    return np.sqrt((px - x1 - t * d_x) ** 2 + (py - y1 - t * d_y) ** 2)
+
+
+def wall_index(walls):
+    """
+        Return the WallGrid of the walls (the wall geometry of ray tables and distance fields)
+    """
+    index = as_index(walls)
+    return index if isinstance(index, WallGrid) else index.walls
+
+
+def as_index(walls):
+    """
+        Return the walls as a WallGrid; grids, ray tables and distance fields are returned as is
+        A list of walls is indexed on every call, callers that query the same walls repeatedly keep the index
+        (see Robot.wall_index)
+    """
+    if isinstance(walls, (WallGrid, RayTable, DistanceField)):
+        return walls
+    return WallGrid(walls)
@@ -1,113 +1,97 @@
 ''' TRIGONOMETRY MODULE '''
 import math
+import numpy as np
 
 __author__ = 'Camiel Kerkhofs'
 
 
-def triangulate_beacons(beacons):
+BEACON_RANGE_NOISE = 0.1  # Standard deviation of a beacon distance relative to the distance (see Robot.update_beacons)
+BEACON_BEARING_NOISE = 1  # Standard deviation (degrees) assumed for a beacon bearing
+MULTILATERATION_ITERATIONS = 1  # Gauss-Newton iterations after the closed form estimate
+
+
+def multilaterate_beacons(beacons, range_noise=BEACON_RANGE_NOISE, bearing_noise=BEACON_BEARING_NOISE,
+                          iterations=MULTILATERATION_ITERATIONS):
     """
-        Given a set of beacons and the distance to each beacon, finds the point where they all intersect.
+        Least squares estimate of the robot pose from the distances and bearings to a set of beacons
 
         We assume the real position of each beacon is known from an internal map.
         All other information is relative to the robot and is noisy (distance and bearing to each beacon).
-            input: [(beacon_1.x, beacon_1.y, bearing, distance), ..., (beacon_n.x, beacon_n.y, bearing, distance)]
+            input: Beacon objects with a distance and a bearing (relative to the robot angle),
+                or an (n_beacons, 4) array of [x, y, distance, bearing]
+
+        In the robot frame, beacon i is at distance_i * (cos(bearing_i), sin(bearing_i)). Aligning these points with
+        the known beacon positions (a weighted 2d rigid alignment) gives the position and angle of the robot in closed
+        form. A few Gauss-Newton iterations on the distance and bearing residuals (weighted by their noise) refine the
+        estimate. Every step is linear in the number of beacons and there is no mirror ambiguity.
+            returns (pose, covariance): pose is an array (x, y, theta), covariance is the 3x3 covariance of the pose
+            (x and y in pixels, theta in degrees; None without iterations).
+            With fewer than 2 beacons the pose is unknown: returns (None, None)
+    """
+    if not isinstance(beacons, np.ndarray):
+        beacons = [(beacon.x, beacon.y, beacon.distance, beacon.bearing) for beacon in beacons]
+    measured = np.asarray(beacons, dtype=float).reshape(-1, 4)
+    if len(measured) < 2:
+        return None, None
+    x, y, distances, bearings = measured.T
+
+    # Closed form: rotation and translation that map the beacons in the robot frame onto the map
+    # Far beacons have noisier distances, so they get lower weights
+    range_sd = np.maximum(range_noise * distances, 1)
+    weights = range_sd ** -2
+    weights /= weights.sum()
+    radians = np.radians(bearings)
+    local_x = distances * np.cos(radians)
+    local_y = distances * np.sin(radians)
+    mean_local_x, mean_local_y, mean_x, mean_y = np.dot((local_x, local_y, x, y), weights)
+    local_x_centered = local_x - mean_local_x
+    local_y_centered = local_y - mean_local_y
+    x_centered = x - mean_x
+    y_centered = y - mean_y
+    theta = math.atan2(np.dot(weights, local_x_centered * y_centered - local_y_centered * x_centered),
+                       np.dot(weights, local_x_centered * x_centered + local_y_centered * y_centered))
+    cos, sin = math.cos(theta), math.sin(theta)
+    pose = np.array([mean_x - cos * mean_local_x + sin * mean_local_y,
+                     mean_y - sin * mean_local_x - cos * mean_local_y,
+                     math.degrees(theta)])
+
+    # Gauss-Newton on the whitened distance and bearing residuals (unknowns x, y and theta in degrees)
+    # The covariance is the inverse of the information matrix at the last linearization point
+    jacobian = np.zeros((2 * len(measured), 3))
+    residuals = np.empty(2 * len(measured))
+    jacobian[1::2, 2] = -1 / bearing_noise
+    information = None
+    for _ in range(iterations):
+        dx = x - pose[0]
+        dy = y - pose[1]
+        squared_distances = np.maximum(dx * dx + dy * dy, 1e-18)
+        expected_distances = np.sqrt(squared_distances)
+        expected_bearings = np.degrees(np.arctan2(dy, dx)) - pose[2]
+        residuals[0::2] = (distances - expected_distances) / range_sd
+        residuals[1::2] = ((bearings - expected_bearings + 180) % 360 - 180) / bearing_noise
+        scale = -1 / (expected_distances * range_sd)
+        jacobian[0::2, 0] = dx * scale
+        jacobian[0::2, 1] = dy * scale
+        scale = (180 / math.pi / bearing_noise) / squared_distances
+        jacobian[1::2, 0] = dy * scale
+        jacobian[1::2, 1] = -dx * scale
+        information = np.linalg.inv(jacobian.T @ jacobian)
+        pose += information @ (jacobian.T @ residuals)
+
+    pose[2] %= 360
+    return pose, information
 
-        By triangulating the beacons using their known location and the robots orientation towards them
-        we can find a noisy estimate of the real x, y and theta values of the robot.
-            returns tuple (x, y, theta)
-    """
 
-    if len(beacons) < 3:
+def triangulate_beacons(beacons):
+    """
+        Given a set of beacons and the distance and bearing to each beacon, estimates the pose of the robot.
+            returns tuple (x, y, theta), or False when fewer than 2 beacons are visible
+        See multilaterate_beacons for the pose covariance.
+    """
+    pose, _ = multilaterate_beacons(beacons)
+    if pose is None:
         return False
-
-    # Triangulate connected beacons
-    inner_points = []
-    for index, beacon in enumerate(beacons):
-        # Triangulate the beacon with all other beacons
-        for index_2, beacon_2 in enumerate(beacons):
-            if index_2 > index:
-                # Distance between beacon 1 and robot
-                d1 = beacon.distance
-
-                # Distance between beacon 2 and robot
-                d2 = beacon_2.distance
-
-                # Angle between d1 and d2 relative to the robot
-                angle = abs(beacon_2.bearing - beacon.bearing)
-                if angle > 180:
-                    angle = 360-angle
-
-                # Distance between the 2 beacons
-                a = law_of_cosines(d1, d2, angle)
-
-                # Robot position relative to the 2 beacons
-                x = (a**2 + d1**2 - d2**2) / (2*a)
-                y = math.sqrt(d1**2 - x**2)
-
-                # We assume the position of the beacons is derived from an internal map.
-                # We use the position of beacon 1 and beacon 2 to get the angle between these beacons
-                # Real angle of the 2 beacons
-                beacon_angle = line_angle((beacon_2.x, beacon_2.y), (beacon.x, beacon.y))
-
-                # Get the 2 possible robot positions from x, y, beacon1 and the angle between the 2 beacons
-                x_endpoint = line_endpoint((beacon.x, beacon.y), beacon_angle, x)
-                xy_endpoint_pos = line_endpoint(x_endpoint, beacon_angle+90, y)
-                xy_endpoint_neg = line_endpoint(x_endpoint, beacon_angle-90, y)
-
-                # Append the possible endpoints to the list
-                inner_points.append([(round(xy_endpoint_pos[0]), round(xy_endpoint_pos[1])), (round(xy_endpoint_neg[0]), round(xy_endpoint_neg[1]))])
-
-    # Filter all possible inner points.
-    # Determine whether X or X' is valid given all other beacon observations (this is why we need at least 3 beacons)
-    believe_point = None
-    believe_points = []
-    for i in range(len(inner_points)):
-
-        # First loop execution: find initial believe point using the first 2 beacon pairs
-        if len(believe_points) == 0 and i+1 < len(inner_points):
-            p1 = inner_points[i]
-            p2 = inner_points[i+1]
-
-            # The 2 points that are closest to each other in the 2x2 matrix are the correct X/X' point
-            dist_diffs = [
-                line_distance(p1[0], p2[0]),
-                line_distance(p1[0], p2[1]),
-                line_distance(p1[1], p2[0]),
-                line_distance(p1[1], p2[1])
-            ]
-            temp = dist_diffs.index(min(dist_diffs))
-            if temp < 2:
-                believe_point = p1[0]
-                believe_points.append(p1[0])
-                if temp == 0:
-                    believe_points.append(p2[0])
-                elif temp == 1:
-                    believe_points.append(p2[1])
-            elif temp < 4:
-                believe_point = p1[1]
-                believe_points.append(p1[1])
-                if temp == 2:
-                    believe_points.append(p2[0])
-                elif temp == 3:
-                    believe_points.append(p2[1])
-
-        # Compare other beacon observations to the believe point
-        else:
-            if line_distance(inner_points[i][0], believe_point) < line_distance(inner_points[i][1], believe_point):
-                believe_points.append(inner_points[i][0])
-            else:
-                believe_points.append(inner_points[i][1])
-
-    # Average the believe points
-    # Due to noisy distance measures, our position estimates can vary.
-    # We take the middle of this area; more beacons = higher accuracy
-    center = get_polygon_center(believe_points)
-
-    # Get the robots real angle using the known beacons and the calculated robot position
-    theta_real = line_angle((beacons[0].x, beacons[0].y), (center[0], center[1]))  # angle between beacon 1 and robot
-    theta = (theta_real - beacons[0].bearing) % 360  # Actual robot pose given its relative angle to beacon 1
-
-    return (center[0], center[1], theta)
+    return tuple(pose.tolist())
 
 
 def line_intersect(a_p1, a_p2, b_p1, b_p2, tolerance = 0.001):
@@ -148,6 +132,71 @@ def line_intersect(a_p1, a_p2, b_p1, b_p2, tolerance = 0.001):
     return x, y
 
 
+def as_segments(walls):
+    """
+        Return the walls as an (n_walls, 4) float array where each row is [x1, y1, x2, y2]
+        Arrays that are already in this format are returned as is
+    """
+    if isinstance(walls, np.ndarray) and walls.ndim == 2 and walls.shape[1] == 4 and walls.dtype == float:
+        return walls
+    return np.asarray(walls, dtype=float).reshape(-1, 4)
+
+
+def cast_rays(origin, angles, length, walls, tolerance=0.001, distances=None, points=None):
+    """
+        Cast a set of rays from 'origin' against all walls at once and return the closest intersection of each ray
+            origin: array (2,) or (n, 2) with the start point of the rays
+            angles: array (n_rays,) or (n, n_rays) with the ray angles in degrees
+            length: maximum length of the rays
+            walls: array (n_walls, 4), see as_segments
+
+        Each ray o + t * r (0 <= t <= 1) is intersected with each wall p + u * s (0 <= u <= 1) in one broadcast
+        operation; the tolerance extends the walls at both ends (like the bounding box tolerance in line_intersect).
+        Rays that do not hit a wall within 'length' end at their endpoint.
+        The results are written into 'distances' (..., n_rays) and 'points' (..., n_rays, 2) if they are given.
+            returns tuple (distances, points)
+    """
+    origin = np.asarray(origin, dtype=float)
+    walls = as_segments(walls)
+    ox = origin[..., 0, None]
+    oy = origin[..., 1, None]
+
+    # Ray directions scaled to the full ray length: shape (..., n_rays)
+    rad = np.radians(angles)
+    cos = np.cos(rad)
+    sin = np.sin(rad)
+    r_x = (length * cos)[..., None]
+    r_y = (length * sin)[..., None]
+
+    # Wall start relative to the ray origin and wall direction: shape (..., 1, n_walls)
+    s_x = walls[:, 2] - walls[:, 0]
+    s_y = walls[:, 3] - walls[:, 1]
+    w_x = (walls[:, 0] - ox)[..., None, :]
+    w_y = (walls[:, 1] - oy)[..., None, :]
+    u_tolerance = tolerance / np.maximum(np.sqrt(s_x ** 2 + s_y ** 2), tolerance)
+
+    # Solve o + t * r = p + u * s for every ray/wall pair: shape (..., n_rays, n_walls)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv_denom = 1 / (r_x * s_y - r_y * s_x)
+        t = (w_x * s_y - w_y * s_x) * inv_denom
+        u = (w_x * r_y - w_y * r_x) * inv_denom
+
+    # Parallel walls give inf/nan and never pass these checks
+    hit = (t >= 0) & (t < 1) & (u >= -u_tolerance) & (u <= 1 + u_tolerance)
+    t[~hit] = 1
+
+    # Closest wall for each ray, rays without a hit keep their full length
+    closest = t.min(axis=-1) if walls.shape[0] > 0 else np.ones(cos.shape)
+    if distances is None:
+        distances = np.empty(cos.shape)
+    if points is None:
+        points = np.empty(cos.shape + (2,))
+    np.multiply(closest, length, out=distances)
+    points[..., 0] = ox + distances * cos
+    points[..., 1] = oy + distances * sin
+    return distances, points
+
+
 def line_endpoint(start, angle, distance):
     """
         Return the endpoint of a line that goes from point 'start' at angle 'angle' for distance 'distance'
@@ -1,10 +1,16 @@
 from bot import odometry as od
 import matplotlib.pyplot as plt
+import numpy as np
 import argparse
 
 # get cli arguments
 parser = argparse.ArgumentParser()
 parser.add_argument("-n", "--noise", help='noise weights', action='store')
+parser.add_argument("-s", "--samples", help='number of sampled paths', action='store', type=int, default=200)
+parser.add_argument("-p", "--probability", help='plot the probability of the first move instead of samples',
+                    action='store_true')
+parser.add_argument("-r", "--resolution", help='grid resolution of the probability plot', action='store', type=int,
+                    default=500)
 args = parser.parse_args()
 
 # default noise values
@@ -17,33 +23,41 @@ print("noise parameters: ", noise )
 
 odometry = od.Odometry()
 
-u_t1 = [(0, 0, 0), (2, 0, 0)]
-u_t2 = [(2, 0, 0), (4, 0, 0)]
-u_t3 = [(4, 0, 0), (6, 0, 0)]
-u_t4 = [(6, 0, 0), (8, 0, 0)]
-u_t5 = [(8, 0, 0), (10, 0, 0)]
+u_ts = [[(0, 0, 0), (2, 0, 0)],
+        [(2, 0, 0), (4, 0, 0)],
+        [(4, 0, 0), (6, 0, 0)],
+        [(6, 0, 0), (8, 0, 0)],
+        [(8, 0, 0), (10, 0, 0)]]
 
 odometry.set_noise_params( noise )
 #odometry.set_sample_func( od.sample_triang_dist )
-
-positions = []
-for x in range(0, 200):
-    pos1 = odometry.sample_motion_model(u_t1, u_t1[0])
-    pos2 = odometry.sample_motion_model(u_t2, pos1)
-    pos3 = odometry.sample_motion_model(u_t3, pos2)
-    pos4 = odometry.sample_motion_model(u_t4, pos3)
-    pos5 = odometry.sample_motion_model(u_t5, pos4)
-    positions.append(pos1)
-    positions.append(pos2)
-    positions.append(pos3)
-    positions.append(pos4)
-    positions.append(pos5)
-
-xs = [x[0] for x in positions]
-ys = [x[1] for x in positions]
-
-# plot
-plt.scatter(0, 0, c='r')
-plt.scatter(xs, ys, c='b', alpha=0.3)
-plt.axis([0, 15, -5, 5])
-plt.show()
\ No newline at end of file
+#odometry.set_prob_func( od.prob_triang_dist )
+
+if args.probability:
+    # probability of ending up at each (x, y) (facing right) after the first move
+    xs, ys = np.meshgrid(np.linspace(0, 4, args.resolution), np.linspace(-2, 2, args.resolution))
+    p2 = np.stack((xs, ys, np.zeros_like(xs)), axis=-1)
+    prob = odometry.get_prob_array(u_ts[0][0], p2, u_ts[0])
+
+    plt.imshow(prob, extent=(0, 4, -2, 2), origin='lower', cmap='viridis')
+    plt.colorbar()
+    plt.scatter(0, 0, c='r')
+    plt.show()
+else:
+    # sample all paths at once, one move at a time
+    rng = np.random.default_rng()
+    poses = np.zeros((args.samples, 3))
+    positions = []
+    for u_t in u_ts:
+        poses = odometry.sample_motion_model_array(u_t, poses, rng)
+        positions.append(poses[:, :2])
+    positions = np.concatenate(positions)
+
+    # plot
+    plt.scatter(0, 0, c='r')
+    if len(positions) > 10000:
+        plt.hist2d(positions[:, 0], positions[:, 1], bins=500, range=[[0, 15], [-5, 5]], cmap='Blues', cmin=1)
+    else:
+        plt.scatter(positions[:, 0], positions[:, 1], c='b', alpha=0.3)
+    plt.axis([0, 15, -5, 5])
+    plt.show()
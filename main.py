@@ -1,7 +1,39 @@
 import argparse
+import threading
+import numpy as np
 
 from bot import environment as env
+from bot import batch_environment as batch
 from bot import genetic as gen
+from bot import fitness as fit
+
+# Genetic algorithm settings
+RECURRENCE = True
+GRAPHICS = False        # Enable/Disable graphics rendering
+RENDER_THREAD = False   # Draw the graphics on a separate thread (capped frame rate, the simulation does not wait)
+TIME_DILATION = 0       # Simulation speed factor. 0 = as fast as possible
+SIMULATION_TIME = 90    # Simulation time in seconds
+DELTA_T = 200           # delta_t used when updating the robot position
+FITNESS_FUNC_ID = 2     # ID of the desired fitness function (See Environment.fitness())
+MAP = 'default'         # Name of a map in the maps/ directory or path to a map file
+LOCALIZATION = 'kalman'  # Localization of the robot: 'kalman' or 'particle' (does not change the fitness)
+PARTICLES = 1000        # Number of particles of the particle filter
+START_POSES = [(400, 175, 0),    # Start in the middle
+               (80, 80, 45),     # Start in corner
+               (400, 550, 270)]  # Start next to a wall
+EVALUATION = 'serial'   # Evaluation backend of the genetic algorithm (serial, thread or process)
+WORKERS = None          # Number of evaluation workers, defaults to the number of cpus
+FITNESS_CACHE_SIZE = 100000  # Maximum number of cached costs (see genetic.FitnessCache)
+PRUNE_RANK = None       # e.g. 10: stop simulations that can not beat the cost of the 10th best individual
+RAY_TABLE = None        # e.g. (4, 2): sensors read a precomputed 4 px / 2 degree distance table (faster screening)
+DISTANCE_FIELD = False  # Resolve wall contacts with the distance field of the map (also contacts between sensor rays)
+CONTINUOUS_COLLISION = False  # Sweep the robot along its path, so delta_t can go above bot.MAX_DELTA_T without tunneling
+EVENT_DRIVEN = False    # Jump between decisions of the neural net and wall contacts instead of fixed steps (no batches)
+ERROR_REPORT_INTERVAL = 0  # Updates between two printed reports of the localization errors, 0 = no reports
+RECORD_ARCHIVE = None   # e.g. 'weights/records.bin': keep the fitness statistics of every simulation to re-score them
+
+# Every thread (and every worker process) keeps its own warm environment
+_worker = threading.local()
 
 
 def num_of_weights(nr_of_input_nodes=13,
@@ -45,11 +77,128 @@ def load_weights_from_file(path):
     return weights_float
 
 
+
+def scenario():
+    """
+        Everything besides the gene that determines the cost of an individual (key of the fitness cache)
+    """
+    scenario = {'start_poses': START_POSES, 'delta_t': DELTA_T, 'fitness_id': FITNESS_FUNC_ID,
+                'simulation_time': SIMULATION_TIME, 'recurrence': RECURRENCE, 'map': MAP}
+    if RAY_TABLE is not None:
+        # Approximate sensors give other costs (without a table the key stays the same as before)
+        scenario['ray_table'] = RAY_TABLE
+    if DISTANCE_FIELD:
+        scenario['distance_field'] = True
+    if CONTINUOUS_COLLISION:
+        scenario['continuous_collision'] = True
+    if EVENT_DRIVEN:
+        scenario['event_driven'] = True
+    return scenario
+
+
+def get_environment():
+    """
+        Returns the Environment of the current thread/process
+    """
+    if getattr(_worker, 'environment', None) is None:
+        _worker.environment = env.Environment(map_name=MAP, localization=LOCALIZATION, n_particles=PARTICLES,
+                                              ray_table=RAY_TABLE, distance_field=DISTANCE_FIELD,
+                                              continuous_collision=CONTINUOUS_COLLISION, event_driven=EVENT_DRIVEN,
+                                              render_thread=RENDER_THREAD,
+                                              error_report_interval=ERROR_REPORT_INTERVAL)
+    return _worker.environment
+
+
+def get_batch_environment():
+    """
+        Returns the BatchEnvironment of the current thread/process
+    """
+    if getattr(_worker, 'batch_environment', None) is None:
+        _worker.batch_environment = batch.BatchEnvironment.from_environment(get_environment())
+    return _worker.batch_environment
+
+
+def costfunc(gene, threshold=None):
+    """
+        Cost of a single individual (cost is accumulated using 3 different simulations; see START_POSES)
+        With a threshold, the simulations stop as soon as the total cost can not get below the threshold anymore.
+        The remaining simulations are assumed to reach their maximum fitness, the result is a PrunedCost.
+    """
+    environment = get_environment()
+    max_fitness = environment.max_fitness(SIMULATION_TIME, DELTA_T, FITNESS_FUNC_ID)
+    cost = 0
+    records = []
+    for index, (start_x, start_y, start_angle) in enumerate(START_POSES):
+        remaining_fitness = max_fitness * (len(START_POSES) - index - 1)
+        prune_threshold = None
+        if threshold is not None:
+            # Fitness this simulation needs so the total cost can still get below the threshold
+            prune_threshold = cost - threshold - remaining_fitness
+        cost -= environment.simulate(GRAPHICS, TIME_DILATION, SIMULATION_TIME, weights=gene, static_delta_t=DELTA_T, recurrence=RECURRENCE, start_x=start_x, start_y=start_y, start_angle=start_angle, fitness_id=FITNESS_FUNC_ID, prune_threshold=prune_threshold)
+        records.append(environment.fitness_record())
+        if environment.pruned:
+            archive_records(records)
+            return gen.PrunedCost(cost - remaining_fitness)
+    archive_records(records)
+    return cost
+
+
+def population_costfunc(genes):
+    """
+        Same cost as costfunc, but all individuals are simulated in lockstep
+    """
+    batch_environment = get_batch_environment()
+    costs = np.zeros(len(genes))
+    records = []
+    for start_x, start_y, start_angle in START_POSES:
+        costs -= batch_environment.simulate(genes, SIMULATION_TIME, static_delta_t=DELTA_T, recurrence=RECURRENCE, start_x=start_x, start_y=start_y, start_angle=start_angle, fitness_id=FITNESS_FUNC_ID)
+        records.append(batch_environment.fitness_records())
+    archive_records(records)
+    return costs
+
+
+def genetic_algorithm(gene_length, evaluation=EVALUATION, workers=WORKERS, cache_path=None, **settings):
+    """
+        Run the genetic algorithm with the settings of this file (settings override the GenAlg arguments)
+        The simulations are batched (population_costfunc) unless they are event driven or pruned: the population
+        cost function gets no prune threshold.
+    """
+    batched = not EVENT_DRIVEN and PRUNE_RANK is None
+    arguments = dict(cost_function=costfunc,
+                     population_cost_function=population_costfunc if batched else None,
+                     gene_length=gene_length,
+                     verbose=False,
+                     plot=True,
+                     max_generations=30,
+                     pop_size=30,
+                     elite_rate=0.15,
+                     mutation_rate=0.075,
+                     value_range=[-5, 5],
+                     crossover_function=gen.two_point_crossover,
+                     evaluation=evaluation,
+                     workers=workers,
+                     fitness_cache=gen.FitnessCache(scenario(), FITNESS_CACHE_SIZE, cache_path),
+                     prune_rank=PRUNE_RANK)
+    arguments.update(settings)
+    return gen.GenAlg(**arguments)
+
+
+def archive_records(records):
+    """
+        Append the fitness records of the simulations to the RECORD_ARCHIVE (see fitness.RecordArchive)
+    """
+    if RECORD_ARCHIVE is not None:
+        fit.RecordArchive(RECORD_ARCHIVE).append(np.concatenate(records))
+
+
 if __name__ == "__main__":
-    environment = env.Environment()
+    environment = get_environment()
 
     parser = argparse.ArgumentParser()
-    parser.add_argument("-m", "--mode", help='execution mode', action='store')
+    parser.add_argument("-m", "--mode", help='execution mode: 1 runs the best performing model (default), 2 starts a new evolution', action='store')
+    parser.add_argument("-e", "--evaluation", help='evaluation backend (serial, thread or process)', action='store', default=EVALUATION)
+    parser.add_argument("-w", "--workers", help='number of evaluation workers', action='store', type=int, default=WORKERS)
+    parser.add_argument("-c", "--cache", help='json file that keeps the fitness cache between runs', action='store')
     args = parser.parse_args()
 
     simulation = None
@@ -58,7 +207,8 @@ if __name__ == "__main__":
             simulation = False
         elif args.mode == '2':
             simulation = True
-    simulation = False
+    else:
+        simulation = False
     while simulation is None:
         print("=================================")
         print("Please select the execution mode:")
@@ -72,47 +222,24 @@ if __name__ == "__main__":
             print('\nRunning a new simulation.. (Might open a new window in the background)')
             simulation = True
 
-    recurrence = True
-
     if not simulation:
         """
             Load weights from a previous simulation:
         """
         weights = load_weights_from_file('weights/saved/dt200_180sec_cost3/gen5_cost-21245_avg-5821')
-        print("Simulation fitness result: " + str(environment.simulate(True, 4, 0, weights=weights, static_delta_t=200, recurrence=recurrence, fitness_id=3, start_x=400, start_y=225, start_angle=40)))
+        print("Simulation fitness result: " + str(environment.simulate(True, 4, 0, weights=weights, static_delta_t=200, recurrence=RECURRENCE, fitness_id=3, start_x=400, start_y=225, start_angle=40)))
 
     else:
         """
             Start the genetic algorithm
         """
-        def costfunc(gene):
-            cost = 0                # Total cost for this individual (cost is accumulated using 3 different simulations; see below)
-            graphics = False        # Enable/Disable graphics rendering
-            time_dilation = 0       # Simulation speed factor. 0 = as fast as possible
-            simulation_time = 90    # Simulation time in seconds
-            delta_t = 200           # delta_t used when updating the robot position
-            fitness_func_id = 2     # ID of the desired fitness function (See Environment.fitness())
-            cost -= environment.simulate(graphics, time_dilation, simulation_time, weights=gene, static_delta_t=delta_t, recurrence=recurrence, start_x=400, start_y=175, start_angle=0, fitness_id=fitness_func_id) # Start in the middle
-            cost -= environment.simulate(graphics, time_dilation, simulation_time, weights=gene, static_delta_t=delta_t, recurrence=recurrence, start_x=80, start_y=80, start_angle=45, fitness_id=fitness_func_id)  # Start in corner
-            cost -= environment.simulate(graphics, time_dilation, simulation_time, weights=gene, static_delta_t=delta_t, recurrence=recurrence, start_x=400, start_y=550, start_angle=270, fitness_id=fitness_func_id)  # Start next to a wall
-            return cost
-
         gene_length = num_of_weights(nr_of_input_nodes=13,
                                      nr_of_hidden_layers=1,
                                      nr_of_hidden_layer_nodes=6,
                                      nr_of_output_nodes=2,
-                                     recurrence=recurrence)
+                                     recurrence=RECURRENCE)
 
-        genetic_algorithm = gen.GenAlg(cost_function=costfunc,
-                                       gene_length=gene_length,
-                                       verbose=False,
-                                       plot=True,
-                                       max_generations=30,
-                                       pop_size=30,
-                                       elite_rate=0.15,
-                                       mutation_rate=0.075,
-                                       value_range=[-5, 5],
-                                       crossover_function=gen.two_point_crossover)
+        genetic_algorithm(gene_length, args.evaluation, args.workers, args.cache)
 
 
     # Some untrained manual runs:
@@ -120,4 +247,4 @@ if __name__ == "__main__":
     # print("Simulation fitness result: " + str(environment.simulate(True, 1, 20)))
 
     # Simulate a 90 second game at x20 speed without graphics, without movement model
-    # print("Simulation fitness result: " + str(environment.simulate(True, 20, 90)))
\ No newline at end of file
+    # print("Simulation fitness result: " + str(environment.simulate(True, 20, 90)))
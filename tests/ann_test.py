@@ -46,6 +46,13 @@ class TestANN(unittest.TestCase):
         for i in range(0, len(mat1)):
             npt.assert_almost_equal(mat1[i], mat2[i])
 
+    def testTranslationIsView(self):
+        array = np.arange(14, dtype=float)
+        net = nn.NeuralNet(weights=array, nr_of_input_nodes=4, hidden_layers=1, hidden_layer_nodes=2,
+                           nr_of_outputs=3, recurrence=False)
+        for matrix in net.weights_as_mat():
+            self.assertTrue(np.shares_memory(matrix, array))
+
     def testFlatten(self):
         array = [0., 1., 2., 3., 4., 5., 6., 7., 8., 9., 10., 11.]
         mat1 = [np.array([[0., 1., 2., 3.], [4., 5., 6., 7.]]), np.array([[8., 9.], [10., 11.]])]
@@ -0,0 +1,97 @@
+import unittest
+import random
+from bot import environment as env
+from bot import batch_environment as batch
+from bot import spatial as spatial
+
+__author__ = 'Camiel Kerkhofs'
+
+ENVIRONMENT = env.Environment()
+
+
+def random_genes(seed, n_genes=4):
+    random.seed(seed)
+    return [[random.uniform(-5, 5) for _ in range(102)] for _ in range(n_genes)]
+
+
+class TestBatchEnvironment(unittest.TestCase):
+
+    def test_same_fitness_as_environment(self):
+        genes = random_genes(7)
+        batch_environment = batch.BatchEnvironment.from_environment(ENVIRONMENT)
+
+        for start_x, start_y, start_angle in [(400, 175, 0), (80, 80, 45)]:
+            for fitness_id in range(1, 6):
+                fitness = batch_environment.simulate(genes, 10, static_delta_t=200, recurrence=True, start_x=start_x,
+                                                     start_y=start_y, start_angle=start_angle, fitness_id=fitness_id)
+                for gene, batch_fitness in zip(genes, fitness):
+                    expected = ENVIRONMENT.simulate(False, 0, 10, weights=gene, static_delta_t=200, recurrence=True,
+                                                    start_x=start_x, start_y=start_y, start_angle=start_angle,
+                                                    fitness_id=fitness_id)
+                    self.assertAlmostEqual(expected, batch_fitness, delta=1e-9 * max(1, abs(expected)))
+
+    def test_distance_field(self):
+        genes = random_genes(5)
+        environment = env.Environment(distance_field=True)
+        batch_environment = batch.BatchEnvironment.from_environment(environment)
+        fitness = batch_environment.simulate(genes, 10, static_delta_t=200, start_x=80, start_y=80, start_angle=45,
+                                             fitness_id=2)
+        for gene, batch_fitness in zip(genes, fitness):
+            expected = environment.simulate(False, 0, 10, weights=gene, static_delta_t=200, start_x=80, start_y=80,
+                                            start_angle=45, fitness_id=2)
+            self.assertAlmostEqual(expected, batch_fitness, delta=1e-9 * max(1, abs(expected)))
+        self.assertGreater(batch_environment.num_collisions.sum(), 0)
+
+    def test_ray_table(self):
+        # The sensors read the (coarse) table, the collisions keep the robots out of the walls like exact rays
+        genes = random_genes(5, 8)
+        environment = env.Environment(ray_table=(10, 10))
+        batch_environment = batch.BatchEnvironment.from_environment(environment)
+        segments = environment.wall_segments
+        clearance = environment.robot.radius - 1
+        closest = []
+
+        def update_sensors():
+            closest_transformed = type(batch_environment).update_sensors(batch_environment)
+            closest.append(spatial.point_segment_distance(
+                batch_environment.posx[:, None], batch_environment.posy[:, None], *segments.T).min())
+            return closest_transformed
+
+        batch_environment.update_sensors = update_sensors
+        batch_environment.simulate(genes, 30, static_delta_t=200, start_x=80, start_y=80, start_angle=45, fitness_id=2)
+        self.assertGreater(batch_environment.num_collisions.sum(), 0)
+        self.assertGreater(min(closest), clearance)
+
+        for gene in genes[:2]:
+            environment.simulate(False, 0, 30, weights=gene, static_delta_t=200, start_x=80, start_y=80,
+                                 start_angle=45, fitness_id=2)
+            robot = environment.robot
+            self.assertGreater(spatial.point_segment_distance(robot.posx, robot.posy, *segments.T).min(), clearance)
+
+    def test_delta_t_limit(self):
+        batch_environment = batch.BatchEnvironment.from_environment(ENVIRONMENT)
+        with self.assertRaisesRegex(ValueError, 'limit of 200ms, continuous_collision=True lifts it'):
+            batch_environment.simulate([[0] * 102], 10, static_delta_t=250)
+        with self.assertRaisesRegex(ValueError, 'limit of 200ms, continuous_collision=True lifts it'):
+            ENVIRONMENT.simulate(False, 0, 10, weights=[0] * 102, static_delta_t=250)
+
+    def test_continuous_collision(self):
+        # With continuous collision detection long steps are allowed, and the batch is still the same
+        genes = random_genes(13)
+        environment = env.Environment(continuous_collision=True)
+        batch_environment = batch.BatchEnvironment.from_environment(environment)
+        fitness = batch_environment.simulate(genes, 20, static_delta_t=1000, start_x=400, start_y=550, start_angle=270,
+                                             fitness_id=2)
+        for gene, batch_fitness in zip(genes, fitness):
+            expected = environment.simulate(False, 0, 20, weights=gene, static_delta_t=1000, start_x=400, start_y=550,
+                                            start_angle=270, fitness_id=2)
+            self.assertAlmostEqual(expected, batch_fitness, delta=1e-9 * max(1, abs(expected)))
+
+    def test_event_driven(self):
+        # Batches use fixed steps, event driven environments can not be batched
+        with self.assertRaises(ValueError):
+            batch.BatchEnvironment.from_environment(env.Environment(event_driven=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
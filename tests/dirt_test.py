@@ -0,0 +1,69 @@
+import unittest
+import numpy as np
+from bot import dirt as dirt
+
+__author__ = 'Camiel Kerkhofs'
+
+
+class TestDirt(unittest.TestCase):
+    def test_stencil(self):
+        stencil = dirt.footprint_stencil(30, 8, 6)
+        self.assertEqual(stencil.shape, (11, 7))
+        self.assertTrue(stencil[5, 3])
+        self.assertFalse(stencil[0, 0])
+        np.testing.assert_array_equal(stencil, stencil[::-1, ::-1])
+
+    def test_clean(self):
+        grid = dirt.DirtGrid(128, (1024, 768), 30)
+        cells = np.count_nonzero(grid.stencil)
+        self.assertEqual(grid.clean(500, 400, 2), cells * 2)
+        self.assertEqual(np.count_nonzero(grid.grid), cells)
+
+        # Cells that are already clean are not cleaned again
+        self.assertEqual(grid.clean(500, 400, 2), 0)
+
+        # The footprint is cropped at the edge of the grid
+        self.assertLess(grid.clean(0, 0, 1), cells)
+        self.assertEqual(grid.clean(-100, -100, 1), 0)
+
+        grid.reset()
+        self.assertEqual(np.count_nonzero(grid.grid), 0)
+
+    def test_clean_batch(self):
+        x = np.array([500, 0, 1020, 300])
+        y = np.array([400, 0, 760, 300])
+        value = np.array([1, 2, 3, 0.5])
+        grid = dirt.DirtGrid(128, (1024, 768), 30)
+        batch = dirt.DirtGrid(128, (1024, 768), 30, n_grids=len(x))
+        for step in range(2):
+            cleaned = batch.clean_batch(x + step * 10, y, value)
+            for index in range(len(x)):
+                grid.reset()
+                expected = 0
+                for previous in range(step + 1):
+                    expected = grid.clean(x[index] + previous * 10, y[index], value[index])
+                self.assertAlmostEqual(cleaned[index], expected)
+                np.testing.assert_array_equal(batch.grid[index], grid.grid)
+
+    def test_clean_path(self):
+        x = np.array([500, 505, 510, 1020, -100])
+        y = np.array([400, 402, 404, 760, 300])
+        grid = dirt.DirtGrid(128, (1024, 768), 30)
+        expected = sum(grid.clean(x[i], y[i], 2) for i in range(len(x)))
+        path = dirt.DirtGrid(128, (1024, 768), 30)
+        self.assertAlmostEqual(path.clean_path(x, y, 2), expected)
+        np.testing.assert_array_equal(path.grid, grid.grid)
+        self.assertEqual(path.clean_cells, grid.clean_cells)
+
+    def test_resolution(self):
+        # The amount of dirt in the environment does not depend on the grid resolution
+        path = [(100 + i * 7, 200 + i * 3) for i in range(100)]
+        totals = []
+        for grid_size in [128, 512]:
+            grid = dirt.DirtGrid(grid_size, (1024, 768), 30)
+            totals.append(sum(grid.clean(x, y, 1) for x, y in path))
+        self.assertAlmostEqual(totals[0], totals[1], delta=totals[0] * 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
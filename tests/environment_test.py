@@ -0,0 +1,56 @@
+import unittest
+import random
+from bot import environment as env
+
+__author__ = 'Camiel Kerkhofs'
+
+ENVIRONMENT = env.Environment()
+
+
+class TestEnvironment(unittest.TestCase):
+
+    def test_prune(self):
+        random.seed(11)
+        gene = [random.uniform(-5, 5) for _ in range(102)]
+        for fitness_id in range(1, 5):
+            fitness = ENVIRONMENT.simulate(False, 0, 10, weights=gene, static_delta_t=200, start_x=400, start_y=175,
+                                           fitness_id=fitness_id)
+            self.assertFalse(ENVIRONMENT.pruned)
+            max_fitness = ENVIRONMENT.max_fitness(10, 200, fitness_id)
+            self.assertGreaterEqual(max_fitness, fitness)
+
+            # Thresholds below the final fitness never stop the simulation
+            self.assertEqual(fitness, ENVIRONMENT.simulate(False, 0, 10, weights=gene, static_delta_t=200, start_x=400,
+                                                           start_y=175, fitness_id=fitness_id,
+                                                           prune_threshold=fitness))
+            self.assertFalse(ENVIRONMENT.pruned)
+
+            bound = ENVIRONMENT.simulate(False, 0, 10, weights=gene, static_delta_t=200, start_x=400, start_y=175,
+                                         fitness_id=fitness_id, prune_threshold=max_fitness + 1)
+            self.assertTrue(ENVIRONMENT.pruned)
+            self.assertLess(ENVIRONMENT.updates, 50)
+            self.assertGreaterEqual(bound, fitness)
+            self.assertLess(bound, max_fitness + 1)
+
+    def test_event_driven(self):
+        # An event driven simulation runs to the timeout with one update per decision of the neural net at most
+        # (plus the slides along the walls), without a neural net long free moves take a single update
+        random.seed(17)
+        gene = [random.uniform(-5, 5) for _ in range(102)]
+        environment = env.Environment(event_driven=True)
+        fitness = environment.simulate(False, 0, 20, weights=gene, static_delta_t=1000, start_x=400, start_y=175,
+                                       fitness_id=2)
+        self.assertGreaterEqual(fitness, 0)
+        self.assertEqual(environment.time, 20000)
+        self.assertEqual(environment.n_controls, 20)
+        self.assertLessEqual(environment.updates, 40)
+        environment.simulate(False, 0, 2, static_delta_t=200, start_x=400, start_y=175)
+        self.assertEqual(environment.updates, 1)
+        self.assertGreater(environment.cleaned, 0)
+
+        with self.assertRaises(ValueError):
+            environment.simulate(False, 1, 2, static_delta_t=200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import os
+import random
+import tempfile
+import numpy as np
+from bot import fitness as fit
+from bot import environment as env
+from bot import batch_environment as batch
+
+__author__ = 'Steffen Schneider'
+
+ENVIRONMENT = env.Environment()
+
+
+class TestFitness(unittest.TestCase):
+
+    def test_rescore(self):
+        # A simulation recorded under one fitness function is re-scored under the others without simulating again
+        random.seed(4)
+        gene = [random.uniform(-5, 5) for _ in range(102)]
+        ENVIRONMENT.simulate(False, 0, 10, weights=gene, static_delta_t=200, start_x=400, start_y=175, fitness_id=2)
+        record = ENVIRONMENT.fitness_record()
+        self.assertEqual(record['gene'][0], fit.gene_digest(gene))
+        for fitness_id in range(1, 6):
+            expected = ENVIRONMENT.simulate(False, 0, 10, weights=gene, static_delta_t=200, start_x=400, start_y=175,
+                                            fitness_id=fitness_id)
+            self.assertEqual(fit.score(record, fitness_id)[0], expected)
+
+        # Other formulas are functions of the records
+        cleaned_per_update = fit.score(record, lambda records: records['cleaned'] / records['updates'])
+        self.assertAlmostEqual(cleaned_per_update[0], record['cleaned'][0] / record['updates'][0])
+
+    def test_zero_wheel_fitness(self):
+        # Fitness 5 divides by the wheel evaluation, a robot that never drives scores 0 instead of inf or nan
+        records = np.zeros(2, dtype=fit.RECORD_DTYPE)
+        records['gene'] = b'a', b'b'
+        records['cleaned'] = 4, 0
+        records['updates'] = records['n_controls'] = 10
+        np.testing.assert_array_equal(fit.score(records, 5), [0, 0])
+        np.testing.assert_array_equal(fit.costs(records, 5)[1], [0, 0])
+        records['wheel_fitness'] = 2
+        np.testing.assert_array_equal(fit.score(records, 5), [2, 0])
+
+    def test_archive_costs(self):
+        random.seed(5)
+        genes = [[random.uniform(-5, 5) for _ in range(102)] for _ in range(4)]
+        batch_environment = batch.BatchEnvironment.from_environment(ENVIRONMENT)
+        expected = np.zeros(len(genes))
+        with tempfile.TemporaryDirectory() as directory:
+            archive = fit.RecordArchive(os.path.join(directory, 'records.bin'))
+            self.assertEqual(len(archive.load()), 0)
+            for start_x, start_y in ((400, 175), (200, 300)):
+                expected -= batch_environment.simulate(genes, 10, start_x=start_x, start_y=start_y, fitness_id=3)
+                archive.append(batch_environment.fitness_records())
+            # Repeated simulations count once, genes with a pruned simulation are left out
+            records = archive.load()
+            archive.append(records[:2])
+            pruned = records[:1].copy()
+            pruned['gene'] = fit.gene_digest([0] * 102)
+            pruned['pruned'] = True
+            archive.append(pruned)
+
+            digests, costs = fit.costs(archive.load(), 3)
+        self.assertEqual(len(digests), len(genes))
+        order = [list(digests).index(fit.gene_digest(gene)) for gene in genes]
+        np.testing.assert_allclose(costs[order], expected, rtol=1e-12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import unittest
+import tempfile
+from bot import genetic as gen
+
+__author__ = 'Olve Drageset'
+
+
+def cost_function(gene):
+    if gene[0] > 4.5:
+        raise IndexError('simulated failure')
+    return sum((g - 1) ** 2 for g in gene)
+
+
+evaluated_genes = []
+
+
+def counting_cost_function(gene):
+    evaluated_genes.append(tuple(gene))
+    return cost_function(gene)
+
+
+def pruning_cost_function(gene, threshold=None):
+    cost = cost_function(gene)
+    if threshold is not None and cost > threshold:
+        # Report a lower bound of the cost, like a simulation that was stopped early
+        return gen.PrunedCost(threshold + (cost - threshold) / 2)
+    return cost
+
+
+def population_cost_function(genes):
+    return [cost_function(gene) for gene in genes]
+
+
+class TestGenAlg(unittest.TestCase):
+
+    def setUp(self):
+        self.weights_directory = gen.WEIGHTS_DIRECTORY
+        self.tmp = tempfile.TemporaryDirectory()
+        gen.WEIGHTS_DIRECTORY = self.tmp.name + '/weights'
+
+    def tearDown(self):
+        gen.WEIGHTS_DIRECTORY = self.weights_directory
+        self.tmp.cleanup()
+
+    def run_algorithm(self, **kwargs):
+        genetic_algorithm = gen.GenAlg(gene_length=6, pop_size=12, max_generations=3, verbose=False, seed=42,
+                                       crossover_function=gen.two_point_crossover, **kwargs)
+        return [(individual.gene, individual.cost) for individual in genetic_algorithm.pop.pop]
+
+    def test_backends_identical(self):
+        serial = self.run_algorithm(cost_function=cost_function)
+        self.assertEqual(serial, self.run_algorithm(cost_function=cost_function, evaluation='thread', workers=3))
+        self.assertEqual(serial, self.run_algorithm(cost_function=cost_function, evaluation='process', workers=2))
+        self.assertEqual(serial, self.run_algorithm(population_cost_function=population_cost_function,
+                                                    evaluation='process', workers=2))
+
+    def test_failure_isolated(self):
+        evaluator = gen.Evaluator(cost_function=cost_function, backend='process', workers=2, failure_cost=99)
+        try:
+            self.assertEqual(evaluator.evaluate([[5, 1], [2, 1], [1, 1]]), [99, 1, 0])
+        finally:
+            evaluator.close()
+
+    def test_fitness_cache(self):
+        serial = self.run_algorithm(cost_function=cost_function)
+        del evaluated_genes[:]
+        cache = gen.FitnessCache(scenario={'fitness_id': 1})
+        self.assertEqual(serial, self.run_algorithm(cost_function=counting_cost_function, fitness_cache=cache))
+
+        # No gene is evaluated twice (only failed evaluations are not cached)
+        successful = [gene for gene in evaluated_genes if gene[0] <= 4.5]
+        self.assertEqual(len(successful), len(set(successful)))
+        self.assertGreater(cache.hits, 0)
+        self.assertEqual(cache.misses, len(evaluated_genes))
+
+    def test_fitness_cache_zero_cost(self):
+        # A real cost equal to the failure cost is cached, failures are not
+        del evaluated_genes[:]
+        evaluator = gen.Evaluator(cost_function=counting_cost_function, failure_cost=0,
+                                  cache=gen.FitnessCache(scenario={'fitness_id': 4}))
+        genes = [[1, 1], [5, 1]]
+        for _ in range(2):
+            costs = evaluator.evaluate(genes)
+            self.assertEqual(costs, [0, 0])
+            self.assertNotIsInstance(costs[0], gen.FailedCost)
+            self.assertIsInstance(costs[1], gen.FailedCost)
+        self.assertEqual(evaluated_genes, [(1, 1), (5, 1), (5, 1)])
+
+    def test_fitness_cache_lru(self):
+        path = self.tmp.name + '/cache/fitness.json'
+        cache = gen.FitnessCache(scenario={'delta_t': 200}, max_size=2, path=path)
+        for gene, cost in [([1, 2], 1.5), ([2, 3], 2.5), ([3, 4], 3.5)]:
+            cache.put(cache.key(gene), cost)
+        self.assertIsNone(cache.get(cache.key([1, 2])))
+        self.assertEqual(cache.get(cache.key([2, 3])), 2.5)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # Other scenarios do not share entries
+        self.assertNotEqual(cache.key([2, 3]), gen.FitnessCache(scenario={'delta_t': 100}).key([2, 3]))
+
+        cache.save()
+        loaded = gen.FitnessCache(scenario={'delta_t': 200}, max_size=2, path=path)
+        self.assertEqual(loaded.get(loaded.key([3, 4])), 3.5)
+        self.assertEqual(len(loaded), 2)
+
+    def test_prune(self):
+        cache = gen.FitnessCache(scenario={'fitness_id': 1})
+        pruned = self.run_algorithm(cost_function=pruning_cost_function, prune_rank=3, fitness_cache=cache)
+        self.assertTrue(any(isinstance(cost, gen.PrunedCost) for _, cost in pruned))
+        self.assertFalse(any(isinstance(cost, gen.PrunedCost) for cost in cache.entries.values()))
+
+        # Individuals that beat the threshold keep their real cost
+        for gene, cost in pruned:
+            if gene[0] <= 4.5 and not isinstance(cost, gen.PrunedCost):
+                self.assertEqual(cost, cost_function(gene))
+
+    def test_elitism_duplicates(self):
+        genetic_algorithm = gen.GenAlg(cost_function=cost_function, gene_length=6, pop_size=12, max_generations=0,
+                                       mutation_rate=1, verbose=False, seed=42)
+        elites = [gen.Individual([1] * 6, 0), gen.Individual([1] * 6, 0), gen.Individual([2] * 6, 6)]
+        genetic_algorithm.pop.pop[:3] = elites
+        genetic_algorithm.reproduce(gen.two_point_crossover, elite_rate=0.25)
+
+        # Elites with the same gene are carried into the next generation once
+        carried = [individual for individual in genetic_algorithm.pop.pop if any(individual is e for e in elites)]
+        self.assertEqual(sorted(individual.gene for individual in carried), [[1] * 6, [2] * 6])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            gen.Evaluator(cost_function=cost_function, backend='gpu')
+
+
+if __name__ == '__main__':
+    unittest.main()
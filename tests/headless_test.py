@@ -0,0 +1,27 @@
+import unittest
+import subprocess
+import sys
+
+__author__ = 'Steffen Schneider'
+
+HEADLESS_RUN = '''
+import sys
+import main
+from bot import genetic
+environment = main.get_environment()
+environment.simulate(False, 0, 1, weights=[0.1] * 102, static_delta_t=200, recurrence=True)
+print('loaded:' + ','.join(module for module in ('pygame', 'matplotlib') if module in sys.modules))
+'''
+
+
+class TestHeadless(unittest.TestCase):
+
+    def test_no_graphics_modules(self):
+        # Run in a fresh interpreter, other tests might have loaded the graphics modules already
+        output = subprocess.run([sys.executable, '-c', HEADLESS_RUN], check=True, stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout
+        self.assertEqual(output.strip().split('\n')[-1], 'loaded:')
+
+
+if __name__ == '__main__':
+    unittest.main()
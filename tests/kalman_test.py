@@ -0,0 +1,59 @@
+import unittest
+import pickle
+import numpy as np
+from bot import kalman as kal
+
+__author__ = 'Olve Drageset'
+
+
+def reference_step(mu, sigma, u, z, sensor_noise=kal.SENSOR_NOISE):
+    mu_bar = np.asarray(mu, dtype=float) + u
+    mu_bar[2] %= 360
+    sigma_bar = sigma + kal.ODOMETRY_NOISE
+    gain = sigma_bar @ np.linalg.inv(sigma_bar + sensor_noise)
+    innovation = z - mu_bar
+    innovation[2] = (innovation[2] + 180) % 360 - 180
+    mu_t = mu_bar + gain @ innovation
+    mu_t[2] %= 360
+    return mu_t, sigma_bar - gain @ sigma_bar
+
+
+class TestKalman(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        self.mu = rng.uniform(0, 360, (6, 3))
+        factors = rng.normal(size=(6, 3, 3))
+        self.sigma = factors @ factors.swapaxes(1, 2)
+        self.u = rng.normal(0, 3, (6, 3))
+        self.z = rng.uniform(0, 360, (6, 3))
+
+    def test_step(self):
+        kalman = kal.KalmanFilter(self.mu[0])
+        mu, sigma = self.mu[0], np.zeros((3, 3))
+        for u, z in zip(self.u, self.z):
+            mu, sigma = reference_step(mu, sigma, u, z)
+            kalman.step(u, z)
+            np.testing.assert_allclose(kalman.mu, mu)
+            np.testing.assert_allclose(kalman.sigma, sigma, atol=1e-15)
+
+    def test_batch(self):
+        sensor_noise = np.full((3, 3), 0.1) + np.eye(3)
+        kalman = kal.KalmanFilter(self.mu, self.sigma)
+        mu, sigma = kalman.step(self.u, self.z, sensor_noise)
+        for i in range(len(self.mu)):
+            expected_mu, expected_sigma = reference_step(self.mu[i], self.sigma[i], self.u[i], self.z[i], sensor_noise)
+            np.testing.assert_allclose(mu[i], expected_mu)
+            np.testing.assert_allclose(sigma[i], expected_sigma, atol=1e-12)
+
+        # The function interface filters batches as well
+        mu, sigma = kal.kalman_filter(self.mu, self.sigma, self.u, self.z)
+        np.testing.assert_allclose(mu[2], reference_step(self.mu[2], self.sigma[2], self.u[2], self.z[2])[0])
+
+    def test_pickle(self):
+        kalman = pickle.loads(pickle.dumps(kal.KalmanFilter(self.mu[:2], self.sigma[:2])))
+        mu, _ = kalman.step(self.u[:2], self.z[:2])
+        np.testing.assert_allclose(mu[1], reference_step(self.mu[1], self.sigma[1], self.u[1], self.z[1])[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+import tempfile
+import main
+from bot import genetic as gen
+
+__author__ = 'Olve Drageset'
+
+
+class TestMain(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = gen.WEIGHTS_DIRECTORY, main.PRUNE_RANK, main.SIMULATION_TIME
+        self.tmp = tempfile.TemporaryDirectory()
+        gen.WEIGHTS_DIRECTORY = self.tmp.name + '/weights'
+
+    def tearDown(self):
+        gen.WEIGHTS_DIRECTORY, main.PRUNE_RANK, main.SIMULATION_TIME = self.settings
+        self.tmp.cleanup()
+
+    def test_prune_rank(self):
+        # With PRUNE_RANK the simulations are not batched, so the prune threshold reaches them
+        main.PRUNE_RANK = 2
+        main.SIMULATION_TIME = 20
+        genetic_algorithm = main.genetic_algorithm(102, pop_size=8, max_generations=1, plot=False, seed=3)
+        self.assertIsNone(genetic_algorithm.population_cost_function)
+        self.assertTrue(any(isinstance(individual.cost, gen.PrunedCost) for individual in genetic_algorithm.pop.pop))
+
+        # A population cost function gets no threshold
+        with self.assertRaises(ValueError):
+            gen.GenAlg(population_cost_function=main.population_costfunc, gene_length=102, prune_rank=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import unittest
+import json
+import os
+import pickle
+import tempfile
+import numpy as np
+from bot import maps as maps
+
+__author__ = 'Steffen Schneider'
+
+
+class TestMaps(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_directory = maps.CACHE_DIRECTORY
+        self.tmp = tempfile.TemporaryDirectory()
+        maps.CACHE_DIRECTORY = os.path.join(self.tmp.name, 'cache')
+        self.path = os.path.join(self.tmp.name, 'test.json')
+        with open(self.path, 'w') as file:
+            json.dump({'name': 'test',
+                       'walls': [[[0, 0], [100, 0]], [[100, 0], [100, 50]], [[0, 0], [30, 40]]],
+                       'beacons': [[0, 0], [100, 50]]}, file)
+
+    def tearDown(self):
+        maps.CACHE_DIRECTORY = self.cache_directory
+        maps._maps.pop(self.path, None)
+        maps._ray_tables.clear()
+        self.tmp.cleanup()
+
+    def test_compile(self):
+        compiled = maps.compile_map(self.path)
+        self.assertEqual(len(compiled), 3)
+        np.testing.assert_array_equal(compiled.endpoints[2], [100, 100, 30])
+        np.testing.assert_array_equal(compiled.segments[1], [100, 0, 100, 50])
+        np.testing.assert_array_equal(compiled.directions[2], [30, 40])
+        np.testing.assert_array_equal(compiled.lengths, [100, 50, 50])
+        np.testing.assert_allclose(compiled.normals[0], [0, 1])
+        # The index (ray casts, sweeps, fields) uses the compiled geometry
+        self.assertIs(compiled.index.wall_length, compiled.lengths)
+        np.testing.assert_array_equal(compiled.index.wall_dx, compiled.directions[:, 0])
+        np.testing.assert_allclose(compiled.index.wall_ux, [1, 0, 0.6])
+        self.assertEqual(compiled.walls[0], [(0, 0), (100, 0)])
+        self.assertEqual([(b.x, b.y) for b in compiled.create_beacons()], [(0, 0), (100, 50)])
+
+    def test_immutable(self):
+        compiled = maps.compile_map(self.path)
+        with self.assertRaises(AttributeError):
+            compiled.name = 'other'
+        with self.assertRaises(ValueError):
+            compiled.segments[0, 0] = 1
+
+    def test_cache(self):
+        compiled = maps.load_map(self.path)
+        self.assertIs(maps.load_map(self.path), compiled)
+        self.assertEqual(len(os.listdir(maps.CACHE_DIRECTORY)), 1)
+
+        # Load the binary file instead of compiling the map again
+        maps._maps.pop(self.path)
+        cached = maps.load_map(self.path)
+        self.assertIsNot(cached, compiled)
+        self.assertEqual(cached.name, 'test')
+        np.testing.assert_array_equal(cached.segments, compiled.segments)
+        np.testing.assert_array_equal(cached.beacons, compiled.beacons)
+        np.testing.assert_array_equal(cached.visibility.table, compiled.visibility.table)
+        self.assertFalse(cached.visibility.table.flags.writeable)
+        np.testing.assert_array_equal(cached.distance_field.distances, compiled.distance_field.distances)
+
+    def test_cache_index(self):
+        # Maps with enough walls store the spatial index in the binary file
+        walls = [[[x, 0], [x, 100]] for x in range(0, 1000, 10)]
+        compiled = maps.CompiledMap('lines', walls, [])
+        self.assertTrue(compiled.index.indexed)
+        path = os.path.join(self.tmp.name, 'lines.npz')
+        compiled.save(path)
+        loaded = maps.CompiledMap.load(path)
+        np.testing.assert_array_equal(loaded.index.cell_walls, compiled.index.cell_walls)
+        angles = np.arange(0, 360, 7.5)
+        np.testing.assert_array_equal(loaded.index.cast_rays((505, 50), angles, 500)[0],
+                                      compiled.index.cast_rays((505, 50), angles, 500)[0])
+
+    def test_ray_table(self):
+        table = maps.load_ray_table(self.path, length=150, resolution=10, angle_resolution=10)
+        self.assertIs(maps.load_ray_table(self.path, length=150, resolution=10, angle_resolution=10), table)
+        self.assertEqual(len([name for name in os.listdir(maps.CACHE_DIRECTORY) if 'rays' in name]), 2)
+
+        # Load the memory-mapped file instead of building the table again
+        maps._ray_tables.clear()
+        cached = maps.load_ray_table(self.path, length=150, resolution=10, angle_resolution=10)
+        self.assertIsNot(cached, table)
+        self.assertIsInstance(cached.table, np.memmap)
+        np.testing.assert_array_equal(cached.table, table.table)
+
+    def test_pickle(self):
+        compiled = maps.compile_map(self.path)
+        copy = pickle.loads(pickle.dumps(compiled))
+        np.testing.assert_array_equal(copy.segments, compiled.segments)
+        self.assertFalse(copy.segments.flags.writeable)
+
+    def test_default_map(self):
+        default = maps.load_map()
+        self.assertEqual(default.walls[4], [(200, 150), (650, 300)])
+        self.assertEqual(len(default.beacons), 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
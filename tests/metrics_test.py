@@ -0,0 +1,57 @@
+import unittest
+import io
+import contextlib
+import numpy as np
+from bot import metrics as metrics
+from bot import environment as env
+
+__author__ = 'Steffen Schneider'
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_running_statistics(self):
+        values = np.random.RandomState(3).uniform(0, 50, (500, 3))
+        statistics = metrics.RunningStatistics()
+        for row in values.tolist():
+            statistics.add(row)
+        self.assertEqual(statistics.count, 500)
+        np.testing.assert_allclose(statistics.mean, values.mean(axis=0))
+        np.testing.assert_allclose(statistics.variance, values.var(axis=0))
+        np.testing.assert_allclose(statistics.std, values.std(axis=0))
+        np.testing.assert_array_equal(statistics.max, values.max(axis=0))
+
+    def test_bounded_history(self):
+        errors = metrics.ErrorMetrics(channels=('kalman',), history_length=4)
+        for index in range(3):
+            errors.add({'kalman': (index, 0, 0)})
+        np.testing.assert_array_equal(errors.history('kalman')[:, 0], [0, 1, 2])
+
+        # Only the latest errors are kept (oldest first), the statistics cover all of them
+        for index in range(3, 10):
+            errors.add({'kalman': (index, 0, 0)})
+        np.testing.assert_array_equal(errors.history('kalman')[:, 0], [6, 7, 8, 9])
+        self.assertEqual(errors.statistics['kalman'].count, 10)
+        self.assertAlmostEqual(errors.statistics['kalman'].mean[0], 4.5)
+
+    def test_report_interval(self):
+        environment = env.Environment(error_report_interval=50)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            environment.simulate(False, 0, 30, static_delta_t=200, start_x=400, start_y=175)
+        # 150 updates: a report of 2 lines per channel every 50 updates
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 3 * 2 * len(metrics.CHANNELS))
+        self.assertTrue(lines[0].startswith('kalman avg_xy deviation'))
+        self.assertEqual(environment.errors.statistics['beacon'].count, environment.updates)
+
+        # Quiet by default
+        environment = env.Environment()
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            environment.simulate(False, 0, 30, static_delta_t=200, start_x=400, start_y=175)
+        self.assertEqual(output.getvalue(), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
 import math
+import numpy as np
 from bot import odometry as od
 
 __author__ = 'Steffen Schneider'
@@ -127,6 +128,31 @@ class TestOdometry(unittest.TestCase):
         self.assertTrue( math.fabs(pose[1]) < .4 )
         self.assertTrue( math.fabs(pose[2]) < 25 )
 
+    def test_array_versions(self):
+        odometry = od.Odometry()
+        odometry.set_noise_params( [.1, .1, .1, .1] )
+        rng = np.random.default_rng(1)
+        p1 = rng.uniform(-5, 5, (50, 3)) % 360
+        p2 = (p1 + rng.normal(0, 1, (50, 3))) % 360
+        u_t = [(0, 0, 0), (1, 0, 0)]
+
+        np.testing.assert_allclose(od.delta_trans_array(p1[:, 0], p1[:, 1], p2[:, 0], p2[:, 1]),
+                                   [od.delta_trans(a[0], a[1], b[0], b[1]) for a, b in zip(p1, p2)])
+        np.testing.assert_allclose(od.delta_rot1_array(p1[:, 0], p1[:, 1], p2[:, 0], p2[:, 1], 1),
+                                   [od.delta_rot1(a[0], a[1], b[0], b[1], 1) for a, b in zip(p1, p2)])
+        for prob_func in [od.prob_normal_dist, od.prob_triang_dist]:
+            odometry.set_prob_func(prob_func)
+            np.testing.assert_allclose(odometry.get_prob_array(p1, p2, u_t),
+                                       [odometry.get_prob(a, b, u_t) for a, b in zip(p1, p2)])
+
+        # Samples of the same generator are reproducible
+        poses = odometry.sample_motion_model_array(u_t, np.zeros((20000, 3)), np.random.default_rng(2))
+        np.testing.assert_array_equal(poses,
+                                      odometry.sample_motion_model_array(u_t, np.zeros((20000, 3)),
+                                                                         np.random.default_rng(2)))
+        self.assertAlmostEqual(poses[:, 0].mean(), 1, delta=.01)
+        self.assertAlmostEqual(poses[:, 1].std(), .1, delta=.01)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import random
+import numpy as np
+from bot import particle as pf
+from bot import beacon as bc
+from bot import robot as bot
+from bot import maps as maps
+
+__author__ = 'Olve Drageset'
+
+
+class TestParticleFilter(unittest.TestCase):
+
+    def test_resample(self):
+        particle_filter = pf.ParticleFilter(1000, spread=(100, 100, 0), seed=1)
+        particle_filter.weights[:] = 0
+        particle_filter.weights[[3, 500]] = [0.25, 0.75]
+        expected = particle_filter.particles[[3, 500]].copy()
+        particle_filter.resample()
+        np.testing.assert_array_equal(np.unique(particle_filter.particles, axis=0), np.sort(expected, axis=0))
+        self.assertEqual((particle_filter.particles == expected[0]).all(axis=1).sum(), 250)
+        self.assertAlmostEqual(particle_filter.effective_particles(), 1000)
+
+    def test_beacon_update(self):
+        # A robot at (100, 100) facing right sees a beacon at (300, 100) straight ahead and one at (100, 400)
+        particle_filter = pf.ParticleFilter(5000, pose=(150, 150, 0), spread=(100, 100, 20), injection=0, seed=2)
+        beacons = [bc.Beacon(300, 100, 200, 0), bc.Beacon(100, 400, 300, 90)]
+        for _ in range(5):
+            particle_filter.step([(0, 0, 0), (0, 0, 0)], beacons)
+        x, y, angle = particle_filter.estimate()
+        self.assertAlmostEqual(x, 100, delta=10)
+        self.assertAlmostEqual(y, 100, delta=10)
+        self.assertLess(min(angle, 360 - angle), 5)
+
+    def test_robot_localization(self):
+        compiled = maps.load_map()
+        beacons = compiled.create_beacons()
+        random.seed(3)
+        robot = bot.Robot(localization='particle', n_particles=2000)
+        robot.particle_filter.rng = np.random.default_rng(3)
+        robot.set_robot_initial_position(400, 175, 0)
+        deviations = []
+        for _ in range(100):
+            robot.set_velocity(0.65, 0.5)
+            robot.move_robot(200, beacons, compiled.index)
+            robot.update_sensors(compiled.index)
+            deviations.append(robot.get_kf_deviation()[:2])
+        self.assertLess(np.median(deviations), 20)
+
+        with self.assertRaises(ValueError):
+            bot.Robot(localization='grid')
+
+
+if __name__ == '__main__':
+    unittest.main()
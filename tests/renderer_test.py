@@ -0,0 +1,76 @@
+import os
+import unittest
+import time
+import numpy as np
+from bot import renderer as ren
+from bot import dirt as dirt
+
+__author__ = 'Camiel Kerkhofs'
+
+
+class TestRenderer(unittest.TestCase):
+
+    def test_render_thread(self):
+        drawn = []
+
+        def draw(frame):
+            # A slow frame, the simulation goes on meanwhile
+            time.sleep(0.01)
+            drawn.append((frame.pose[0], np.unique(frame.grid).tolist()))
+
+        def capture(index):
+            def write(frame):
+                frame.grid.fill(index)
+                frame.pose = (index, 0, 0)
+            return write
+
+        thread = ren.RenderThread(draw, (4, 4), max_fps=200)
+        thread.start()
+        start = time.monotonic()
+        index = 0
+        while time.monotonic() - start < 0.3:
+            index += 1
+            thread.publish(capture(index))
+        thread.stop()
+
+        # Frames are never drawn half captured, they are drawn in order and most states are skipped
+        self.assertGreater(len(drawn), 5)
+        self.assertLess(len(drawn), 60)
+        for pose, grid in drawn:
+            self.assertEqual(grid, [pose])
+        self.assertEqual([pose for pose, _ in drawn], sorted(set(pose for pose, _ in drawn)))
+        self.assertGreater(index, 10 * len(drawn))
+        self.assertFalse(thread.is_alive())
+
+    def test_background(self):
+        # The dirt rectangles of the background are the same as drawing every cell
+        os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+        import pygame
+        pygame.init()
+        surface = pygame.display.set_mode((200, 100))
+        font = pygame.font.SysFont('arial', 12)
+        grid = dirt.DirtGrid(grid_size=10, size=(200, 100))
+        walls = [((0, 0), (199, 0)), ((0, 50), (120, 50))]
+        renderer = ren.Renderer(surface, font, walls, [(100, 20)], grid, 10)
+
+        cells = np.zeros((10, 10))
+        cells[2:4, 3] = 1
+        cells[7, 8] = 1
+        renderer.update_background(cells)
+        expected = pygame.Surface((200, 100), 0, 32)
+        expected.fill(ren.GRAY)
+        for row, column in zip(*np.nonzero(cells)):
+            rectangle = (column * grid.tile_width, row * grid.tile_height, grid.tile_width, grid.tile_height)
+            pygame.draw.rect(expected, ren.WHITE, rectangle)
+        expected.blit(renderer.static, (0, 0))
+        np.testing.assert_array_equal(pygame.surfarray.array2d(renderer.background),
+                                      pygame.surfarray.array2d(expected))
+
+        # Glyphs are rendered once
+        renderer.draw_text('Frames: 100', (0, 0))
+        self.assertEqual(sorted(renderer.glyphs), sorted(set('Frames: 100')))
+        pygame.quit()
+
+
+if __name__ == '__main__':
+    unittest.main()
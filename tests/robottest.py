@@ -1,6 +1,8 @@
 import unittest
 import math
+import numpy as np
 from bot import robot as bot
+from bot import spatial as spatial
 
 __author__ = 'Camiel Kerkhofs'
 
@@ -35,7 +37,115 @@ class TestRobot(unittest.TestCase):
         self.assertAlmostEqual(round(output[3][0]), 500)
         self.assertAlmostEqual(round(output[6][0]), 50)
         self.assertAlmostEqual(round(output[9][0]), 50)
-        
+
+    def test_sensors_configurable(self):
+        walls = [
+            [(50, 50), (750, 50)],
+            [(50, 750), (750, 750)],
+            [(50, 50), (50, 750)],
+            [(750, 50), (750, 750)],
+        ]
+
+        robot = bot.Robot(n_sensors=360)
+        robot.set_robot_position(100, 100, 0)
+        robot.update_sensors(walls)
+        output = robot.sensors
+        self.assertEqual(output.shape, (360, 4))
+        self.assertAlmostEqual(round(output[0][0]), 500)
+        self.assertAlmostEqual(round(output[180][0]), 50)
+        self.assertAlmostEqual(round(output[225][0]), 71)
+        self.assertAlmostEqual(round(output[270][0]), 50)
+        self.assertEqual((round(output[270][2]), round(output[270][3])), (100, 50))
+
+    def test_wall_index(self):
+        walls = [
+            [(50, 50), (750, 50)],
+            [(50, 750), (750, 750)],
+            [(50, 50), (50, 750)],
+            [(750, 50), (750, 750)],
+        ]
+
+        # A list of walls is indexed once, while the robot gets the same list
+        robot = bot.Robot()
+        robot.set_robot_position(100, 100, 0)
+        robot.update_sensors(walls)
+        index = robot.wall_index(walls)
+        self.assertIsInstance(index, spatial.WallGrid)
+        robot.update_beacons([], walls)
+        robot.time_to_contact(walls, 1000)
+        self.assertIs(robot.wall_index(walls), index)
+        self.assertIsNot(robot.wall_index(list(walls)), index)
+
+    def test_time_to_contact(self):
+        walls = [
+            [(50, 50), (750, 50)],
+            [(50, 750), (750, 750)],
+            [(50, 50), (50, 750)],
+            [(750, 50), (750, 750)],
+        ]
+
+        # Straight to the right wall: 620 px at 1 px per 10 ms
+        robot = bot.Robot()
+        robot.set_robot_position(100, 100, 0)
+        robot.set_velocity(1, 1)
+        self.assertAlmostEqual(robot.time_to_contact(walls, 10000), 6200, places=1)
+        self.assertEqual(robot.time_to_contact(walls, 1000), 1000)
+
+        # Turning on the spot or on a small circle in the middle never touches a wall
+        robot.set_velocity(1, -1)
+        self.assertEqual(robot.time_to_contact(walls, 10000), 10000)
+        robot.set_robot_position(400, 400, 0)
+        robot.set_velocity(0.5, 1.5)
+        self.assertEqual(robot.time_to_contact(walls, 10000), 10000)
+
+    def test_distance_field_contacts(self):
+        walls = spatial.WallGrid([(50, 50, 750, 50), (50, 750, 750, 750), (50, 50, 50, 750), (750, 50, 750, 750)])
+        field = spatial.DistanceField(walls)
+
+        # The wall above is between the sensor rays: the rays miss the contact, the field pushes the robot out
+        robot = bot.Robot(n_sensors=4)
+        robot.set_robot_position(100, 75, 45)
+        robot.update_sensors(walls)
+        self.assertEqual((robot.posx, robot.posy, robot.num_collisions), (100, 75, 0))
+
+        calls = []
+
+        def cast_rays(*args, **kwargs):
+            calls.append(args[0])
+            return type(walls).cast_rays(walls, *args, **kwargs)
+
+        walls.cast_rays = cast_rays
+        closest_transformed = robot.update_sensors(walls, field)
+        del walls.cast_rays
+        self.assertEqual(robot.num_collisions, 1)
+        self.assertAlmostEqual(robot.posx, 100)
+        self.assertAlmostEqual(robot.posy, 80)
+
+        # The sensors are cast once, at the resolved position
+        self.assertEqual(len(calls), 1)
+        distances, _ = walls.cast_rays((robot.posx, robot.posy), (45 + robot.sensor_angles) % 360, robot.sensor_max)
+        np.testing.assert_allclose(robot.sensors[:, 0], distances)
+        self.assertAlmostEqual(closest_transformed, robot.sensors[:, 1].max())
+
+    def test_continuous_collision(self):
+        walls = spatial.WallGrid([(50, 50, 750, 50), (50, 750, 750, 750), (50, 50, 50, 750), (750, 50, 750, 750)])
+
+        # A step of 1000 px towards the left wall: without continuous collision detection the step is refused
+        robot = bot.Robot()
+        robot.set_robot_position(400, 400, 180)
+        robot.set_velocity(5, 5)
+        with self.assertRaises(ValueError):
+            robot.move_robot(2000, [], walls)
+
+        # With it, the robot is swept along its path and stops at the wall instead of tunneling through it
+        robot = bot.Robot(continuous_collision=True)
+        robot.set_robot_position(400, 400, 180)
+        robot.set_velocity(5, 5)
+        robot.move_robot(2000, [], walls)
+        self.assertAlmostEqual(robot.posx, 80, places=2)
+        self.assertAlmostEqual(robot.posy, 400)
+        self.assertEqual(robot.num_collisions, 1)
+
  
 if __name__ == '__main__':
     unittest.main()
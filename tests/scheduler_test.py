@@ -0,0 +1,84 @@
+import unittest
+import random
+from bot import scheduler as sched
+from bot import environment as env
+
+__author__ = 'Steffen Schneider'
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestScheduler(unittest.TestCase):
+
+    def test_fixed_steps(self):
+        clock = FakeClock()
+        scheduler = sched.FixedStepScheduler(100, time_dilation=2, clock=clock, sleep=clock.sleep)
+
+        # Nothing is due yet: a single sleep until the deadline (100 simulation ms at 2x are 50 real ms)
+        self.assertEqual(scheduler.due(), 1)
+        self.assertEqual(clock.sleeps, [0.05])
+
+        # 0.17 s later 340 simulation ms passed: 3 steps, the rest stays in the accumulator
+        clock.now += 0.17
+        self.assertEqual(scheduler.due(), 3)
+        self.assertAlmostEqual(scheduler.accumulator, 40)
+        self.assertEqual(len(clock.sleeps), 1)
+
+        # After a long stall only max_catch_up steps run, the rest of the time is dropped
+        clock.now += 10
+        self.assertEqual(scheduler.due(), sched.MAX_CATCH_UP)
+        self.assertAlmostEqual(scheduler.dropped, (200 - sched.MAX_CATCH_UP) * 100)
+
+        # Paused time is not simulated
+        scheduler.pause()
+        clock.now += 0.02
+        self.assertEqual(scheduler.due(), 1)
+        self.assertAlmostEqual(sum(clock.sleeps[-2:]), sched.PAUSE_INTERVAL + (100 - 80) / 2000)
+
+    def test_static_time(self):
+        clock = FakeClock()
+        scheduler = sched.FixedStepScheduler(200, clock=clock, sleep=clock.sleep)
+        for _ in range(10):
+            self.assertEqual(scheduler.due(), 1)
+            scheduler.count_update()
+        self.assertEqual(clock.sleeps, [])
+        self.assertEqual(scheduler.time, 2000)
+
+    def test_rates(self):
+        clock = FakeClock()
+        scheduler = sched.FixedStepScheduler(100, clock=clock, sleep=clock.sleep)
+        # 16 updates and 8 frames per second
+        for index in range(24):
+            clock.now += 1 / 16
+            scheduler.count_update()
+            if index % 2 == 1:
+                scheduler.count_frame()
+        self.assertEqual(scheduler.updates_per_second, 16)
+        self.assertEqual(scheduler.frames_per_second, 8)
+
+    def test_realtime_same_as_static(self):
+        # Realtime simulations run the same fixed steps as static ones
+        random.seed(2)
+        gene = [random.uniform(-5, 5) for _ in range(102)]
+        environment = env.Environment()
+        static = environment.simulate(False, 0, 4, weights=gene, static_delta_t=200, start_x=400, start_y=175)
+        updates = environment.updates
+        realtime = environment.simulate(False, 100, 4, weights=gene, static_delta_t=200, start_x=400, start_y=175)
+        self.assertEqual(static, realtime)
+        self.assertEqual(updates, environment.updates)
+        self.assertGreater(environment.get_elapsed_time(realtime=True), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
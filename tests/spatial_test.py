@@ -0,0 +1,191 @@
+import unittest
+import os
+import pickle
+import tempfile
+import numpy as np
+from bot import spatial as spatial
+from bot import trigonometry as tri
+
+__author__ = 'Steffen Schneider'
+
+
+class TestSpatial(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        start = rng.uniform(0, 2000, (600, 2))
+        angle = rng.uniform(0, 2 * np.pi, 600)
+        length = rng.uniform(10, 200, 600)
+        end = start + np.column_stack((np.cos(angle), np.sin(angle))) * length[:, None]
+        self.walls = np.column_stack((start, end))
+        self.walls[:50, 2] = self.walls[:50, 0]  # vertical walls
+        self.origins = rng.uniform(-100, 2100, (40, 2))
+        self.angles = rng.uniform(0, 360, (40, 12))
+        self.angles[:, 0] = 90  # axis aligned rays
+        self.angles[:, 1] = 180
+
+    def test_cast_rays(self):
+        grid = spatial.WallGrid(self.walls, brute_force_pairs=0)
+        self.assertTrue(grid.indexed)
+        expected_distances, expected_points = tri.cast_rays(self.origins, self.angles, 500, self.walls)
+        distances, points = grid.cast_rays(self.origins, self.angles, 500)
+        np.testing.assert_allclose(distances, expected_distances)
+        np.testing.assert_allclose(points, expected_points)
+
+        # Single origin
+        distances, _ = grid.cast_rays(self.origins[0], self.angles[0], 500)
+        np.testing.assert_allclose(distances, expected_distances[0])
+
+    def test_small_map(self):
+        grid = spatial.WallGrid(self.walls[:10])
+        self.assertFalse(grid.indexed)
+        distances, _ = grid.cast_rays(self.origins, self.angles, 500)
+        np.testing.assert_allclose(distances, tri.cast_rays(self.origins, self.angles, 500, self.walls[:10])[0])
+
+    def test_line_of_sight(self):
+        grid = spatial.WallGrid([((0, 100), (100, 100)), ((50, -10), (50, 10))])
+        visible = grid.line_of_sight((10, 5), [(40, 5), (60, 5), (52, 5), (80, -20), (40, 50), (40, 150)],
+                                     target_tolerance=5)
+        np.testing.assert_array_equal(visible, [True, False, True, False, True, False])
+
+    def test_visibility_grid(self):
+        # Rooms with doors, beacons in corners and on walls
+        walls = [(0, 0, 300, 0), (0, 0, 0, 200), (300, 0, 300, 200), (0, 200, 300, 200),
+                 (100, 0, 100, 80), (100, 120, 100, 200), (200, 0, 200, 150), (150, 100, 250, 100)]
+        beacons = [(5, 5), (100, 50), (100, 100), (200, 180), (250, 100), (295, 195)]
+        index = spatial.WallGrid(walls)
+        grid = spatial.VisibilityGrid(index, beacons)
+        self.assertTrue((grid.table == spatial.VISIBLE).any())
+        self.assertTrue((grid.table == spatial.HIDDEN).any())
+
+        rng = np.random.default_rng(5)
+        for origin in rng.uniform(-20, 320, (2000, 2)):
+            np.testing.assert_array_equal(grid.visible(origin, 0.001, 5),
+                                          index.line_of_sight(origin, beacons, 0.001, 5))
+        # Other tolerances always use the exact test
+        np.testing.assert_array_equal(grid.visible((50, 150), 0.001, 0), index.line_of_sight((50, 150), beacons))
+
+    def test_ray_table(self):
+        walls = [(0, 0, 300, 0), (0, 0, 0, 200), (300, 0, 300, 200), (0, 200, 300, 200), (100, 0, 100, 120)]
+        index = spatial.WallGrid(walls)
+        table = spatial.RayTable.build(index, 250, resolution=5, angle_resolution=3)
+        self.assertEqual(table.table.shape, (42, 62, 121))
+        self.assertLess(table.accuracy['median'], 0.1)
+
+        # Away from wall ends the interpolation is close to the exact ray caster
+        origins = np.array([[200, 100], [50, 150], [250, 40.5]])
+        angles = np.array([[0, 90, 180, 270], [30, 100, 190, 280], [45, 135, 225, 315]])
+        distances, points = table.cast_rays(origins, angles, 250)
+        expected_distances, expected_points = index.cast_rays(origins, angles, 250)
+        np.testing.assert_allclose(distances, expected_distances, atol=0.5)
+        np.testing.assert_allclose(points, expected_points, atol=0.5)
+        distances, _ = table.cast_rays(origins[0], angles[0], 50)
+        np.testing.assert_allclose(distances, [50, 50, 50, 50])
+
+        # Origins outside the table and longer rays use the exact ray caster
+        np.testing.assert_array_equal(table.cast_rays((-10, 50), angles[0], 250)[0],
+                                      index.cast_rays((-10, 50), angles[0], 250)[0])
+        np.testing.assert_array_equal(table.cast_rays(origins, angles, 400)[0],
+                                      index.cast_rays(origins, angles, 400)[0])
+
+        # One length per ray, the table is only used if no ray is longer than the table
+        lengths = np.array([[20, 250, 100, 60], [250, 20, 100, 60], [10, 60, 250, 100]])
+        distances, points = table.cast_rays(origins, angles, lengths)
+        expected_distances, expected_points = index.cast_rays(origins, angles, lengths)
+        np.testing.assert_allclose(distances, expected_distances, atol=0.5)
+        np.testing.assert_allclose(points, expected_points, atol=0.5)
+        lengths[0, 0] = 400
+        np.testing.assert_array_equal(table.cast_rays(origins, angles, lengths)[0],
+                                      index.cast_rays(origins, angles, lengths)[0])
+
+        # Collisions are only tested with exact rays where the field puts a wall within the clearance
+        np.testing.assert_array_equal(table.near_walls([[200, 100], [250, 10]], 20), [True, True])
+        table.field = spatial.DistanceField(walls)
+        np.testing.assert_array_equal(table.near_walls([[200, 100], [250, 10]], 20), [False, True])
+
+    def test_ray_table_file(self):
+        walls = [(0, 0, 100, 0), (0, 0, 0, 100), (100, 0, 100, 100), (0, 100, 100, 100)]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'rays.npy')
+            table = spatial.RayTable.build(walls, 150, resolution=10, angle_resolution=10, path=path)
+            self.assertIsInstance(table.table, np.memmap)
+            copy = pickle.loads(pickle.dumps(table))
+            self.assertIsInstance(copy.table, np.memmap)
+            np.testing.assert_array_equal(copy.cast_rays((50, 50), [0, 45], 150)[0],
+                                          table.cast_rays((50, 50), [0, 45], 150)[0])
+            del table, copy
+
+    def test_distance_field(self):
+        field = spatial.DistanceField(self.walls[:100])
+        x1, y1, x2, y2 = (self.walls[:100, i] for i in range(4))
+        points = np.random.default_rng(4).uniform(0, 2000, (2000, 2))
+        exact = spatial.point_segment_distance(points[:, 0, None], points[:, 1, None], x1, y1, x2, y2).min(axis=1)
+        near = exact < spatial.DISTANCE_FIELD_MAX_DISTANCE - field.error
+        np.testing.assert_array_less(np.abs(field.distance(points) - exact)[near], field.error)
+        self.assertAlmostEqual(field.distance_at(*points[0]), field.distance(points[0]))
+        np.testing.assert_allclose(field.closest_points(points[near])[0], exact[near])
+
+        # Sphere traced rays are the ones of the exact ray caster
+        grid = spatial.WallGrid(self.walls[:100])
+        np.testing.assert_allclose(field.cast_rays(self.origins, self.angles, 500)[0],
+                                   grid.cast_rays(self.origins, self.angles, 500)[0])
+
+    def test_contacts(self):
+        # A robot that touches the end of a wall between its sensor rays is pushed out along the wall normal
+        field = spatial.DistanceField([(0, 0, 100, 0), (200, -50, 200, 50)])
+        positions, touched = field.contacts([(50, 10), (50, -15), (150, 50), (195, 0)], 20)
+        np.testing.assert_array_equal(touched, [True, True, False, True])
+        np.testing.assert_allclose(positions, [(50, 20), (50, -20), (150, 50), (180, 0)])
+
+    def test_sweep_circles(self):
+        walls = np.array([(0, 0, 100, 0), (150, -50, 150, 50)], dtype=float)
+        # Straight into a wall, sliding along it, against the end of a wall, free and diagonal onto a wall end
+        starts = np.array([(50, 50), (50, 50), (100, 0), (50, 30), (-40, 40)], dtype=float)
+        ends = np.array([(50, -50), (80, 10), (260, 0), (90, 30), (40, -40)], dtype=float)
+        positions, touched = spatial.sweep_circles(walls, np.stack((starts, ends)), 20)
+        np.testing.assert_array_equal(touched, [True, True, True, False, True])
+        np.testing.assert_allclose(positions[:4], [(50, 20), (80, 20), (130, 0), (90, 30)], atol=0.01)
+        self.assertAlmostEqual(np.hypot(*positions[4]), 20, delta=0.01)
+
+        # No circle ever ends up closer than its radius to a wall, even with moves much longer than the radius
+        rng = np.random.default_rng(7)
+        x1, y1, x2, y2 = (self.walls[:100, i] for i in range(4))
+
+        def distance(points):
+            return spatial.point_segment_distance(points[:, 0, None], points[:, 1, None], x1, y1, x2, y2).min(axis=1)
+
+        for _ in range(3):
+            starts = rng.uniform(0, 2000, (200, 2))
+            starts = starts[distance(starts) > 20]
+            path = starts + np.linspace(0, 1, 5)[:, None, None] * rng.uniform(-300, 300, (len(starts), 2))
+            positions, touched = spatial.sweep_circles(self.walls[:100], path, 20)
+            np.testing.assert_array_less(20 - 1e-6, distance(positions))
+            np.testing.assert_array_equal(positions[~touched], path[-1][~touched])
+
+    def test_arc_time_of_impact(self):
+        # The first contact along an arc is the one of a finely sampled arc
+        x1, y1, x2, y2 = (self.walls[:100, i] for i in range(4))
+        rng = np.random.default_rng(8)
+        times = np.linspace(0, 400, 40001)
+        for speed, rotation_rate in ((1, 0.01), (-0.7, 0.05), (0.8, -0.002), (1, 0)):
+            position = rng.uniform(200, 1800, 2)
+            while spatial.point_segment_distance(*position, x1, y1, x2, y2).min() < 25:
+                position = rng.uniform(200, 1800, 2)
+            angle = rng.uniform(0, 360)
+            heading = np.radians(angle) + rotation_rate * times
+            if rotation_rate == 0:
+                xs = position[0] + speed * times * np.cos(heading)
+                ys = position[1] + speed * times * np.sin(heading)
+            else:
+                # Rotation around the ICC on the left of the heading (see kinematics.bot_calc_coordinate)
+                icc = speed / rotation_rate
+                xs = position[0] + icc * (np.sin(heading) - np.sin(heading[0]))
+                ys = position[1] - icc * (np.cos(heading) - np.cos(heading[0]))
+            distances = spatial.point_segment_distance(xs[:, None], ys[:, None], x1, y1, x2, y2).min(axis=1)
+            inside = np.flatnonzero(distances < 20)
+            expected = times[inside[0]] if len(inside) else 400
+            self.assertAlmostEqual(spatial.arc_time_of_impact(self.walls[:100], position, angle, speed, rotation_rate,
+                                                              20, 400), expected, delta=0.02)
+
+
+if __name__ == '__main__':
+    unittest.main()
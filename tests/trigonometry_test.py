@@ -1,6 +1,8 @@
 import unittest
 import math
+import numpy as np
 from bot import trigonometry as tri
+from bot import beacon as bc
 
 __author__ = 'Camiel Kerkhofs'
 
@@ -19,6 +21,17 @@ class TestTrigonometry(unittest.TestCase):
         tmp = tri.line_intersect((10, 10), (20, 30), (10, 0), (20, 40))
         self.assertEqual(tmp, (15, 20))
 
+    def test_cast_rays(self):
+        walls = [[(10, 10), (20, 10)], [(10, 10), (10, 20)]]
+        distances, points = tri.cast_rays((15, 15), [270, 180, 0, 225], 20, walls)
+        self.assertEqual([round(d, 5) for d in distances], [5, 5, 20, round(math.sqrt(50), 5)])
+        self.assertEqual((round(points[0][0]), round(points[0][1])), (15, 10))
+        self.assertEqual((round(points[2][0]), round(points[2][1])), (35, 15))
+
+        # Several origins at once
+        distances, points = tri.cast_rays([(15, 15), (15, 12)], [[270, 0], [270, 0]], 20, walls)
+        self.assertEqual([[round(d) for d in row] for row in distances], [[5, 20], [2, 20]])
+
     def test_line_endpoint(self):
         endpoint = tri.line_endpoint((0, 0), 0, 100)
         self.assertEqual((round(endpoint[0]), round(endpoint[1])), (100, 0))
@@ -93,5 +106,32 @@ class TestTrigonometry(unittest.TestCase):
         angle = tri.line_angle((0, 0), (10, 10))
         self.assertEqual(round(angle), 225)
 
+    def test_multilaterate_beacons(self):
+        x, y, theta = 300, 200, 350
+        beacons = []
+        for beacon_x, beacon_y in [(50, 50), (750, 50), (50, 750), (750, 750), (400, 400)]:
+            bearing = (tri.line_angle((beacon_x, beacon_y), (x, y)) - theta) % 360
+            beacons.append(bc.Beacon(beacon_x, beacon_y, tri.line_distance((beacon_x, beacon_y), (x, y)), bearing))
+
+        pose, covariance = tri.multilaterate_beacons(beacons)
+        np.testing.assert_allclose(pose, (x, y, theta), atol=1e-6)
+        self.assertEqual(covariance.shape, (3, 3))
+        np.testing.assert_allclose(covariance, covariance.T)
+
+        # 2 beacons are enough, more beacons give a smaller covariance
+        pose, covariance_2 = tri.multilaterate_beacons(beacons[:2])
+        np.testing.assert_allclose(pose, (x, y, theta), atol=1e-6)
+        self.assertGreater(np.trace(covariance_2), np.trace(covariance))
+        self.assertEqual(tri.multilaterate_beacons(beacons[:1]), (None, None))
+        self.assertEqual(tri.triangulate_beacons(beacons[:1]), False)
+
+        # Noisy distances
+        rng = np.random.default_rng(4)
+        measured = np.array([(b.x, b.y, b.distance * rng.normal(1, 0.1), b.bearing) for b in beacons])
+        x_noisy, y_noisy, theta_noisy = tri.triangulate_beacons(measured)
+        self.assertAlmostEqual(x_noisy, x, delta=30)
+        self.assertAlmostEqual(y_noisy, y, delta=30)
+        self.assertAlmostEqual(theta_noisy, theta, delta=5)
+
 if __name__ == '__main__':
     unittest.main()